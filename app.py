@@ -2,17 +2,23 @@
 import streamlit as st
 import random  
 import pandas as pd
+import os
 import json
 import uuid
+import threading
+from contextlib import closing
 from datetime import datetime, timedelta
 from streamlit_autorefresh import st_autorefresh 
 from core.backend import (
     MORANDI_COLORS, extract_text_from_file, MockUserManager, MockLearningEngine,
     MockAssessmentManager, DeepSeekAIAgent, MockAssistanceTracker, 
-    MockPDFGenerator, MockLearningAnalytics as LearningAnalytics
+    MockPDFGenerator, MockLearningAnalytics as LearningAnalytics, RequestMemo
 )
 from core.user_manager import user_manager
 
+# SHOW_PERF_STATS=1 adds a sidebar expander with the performance counters (request memo, writes, LLM calls)
+SHOW_PERF_STATS = os.environ.get("SHOW_PERF_STATS", "0") == "1"
+
 FIXED_MOTIVATIONAL_MESSAGES = [
     {
         "message": "Perseverance leads to victory! \n You have accumulated a considerable amount of time for study. \n Keep up this pace and the goal is just ahead.",
@@ -236,9 +242,10 @@ def init_session_state():
         'resource_views': {}, 'saved_assessments': {}, 'achievements': [],
         'path_resource_counts': {}, 'path_topic_counts': {}, 'topic_progress': {},
         'achievement_path_ids': set(), 'assessment_generating': {}, 'show_assessment': {},
-        'topic_assessment_scores': {},
+        'topic_assessment_scores': {}, 'path_job': None,
         'timer_initialized': False,  
-        'last_timer_update': None     
+        'last_timer_update': None,
+        'timer_target': None
     }
     for var, val in session_vars.items():
         if var not in st.session_state:
@@ -253,10 +260,14 @@ def init_ai_agent():
 init_ai_agent()
 
 # Calculate the progress of the learning path
-def calculate_path_progress(path_id, topics, path):
+def calculate_path_progress(path_id, topics, path, snapshot=None):
     user = st.session_state.user
     if not user: return 0.0
     
+    # Load all viewed resources and assessment scores of the path at once (reload after writes)
+    if snapshot is None:
+        snapshot = learning_engine.get_path_progress_snapshot(user['id'], path_id)
+    
     total_resources = viewed_resources = 0
     total_topics = len(topics)
     completed_topics = 0
@@ -269,18 +280,15 @@ def calculate_path_progress(path_id, topics, path):
         
         viewed_in_topic = 0
         for res in resources:
-            if learning_engine.check_resource_viewed(user['id'], path_id, topic['name'], res['title']):
+            if (topic['name'], res['title']) in snapshot['viewed']:
                 viewed_in_topic += 1
                 viewed_resources += 1
         
         resource_progress = viewed_in_topic / topic_resources if topic_resources > 0 else 1.0
         topic_key = f"{path_id}_topic_{i}_{topic['name']}"
-        state_content = learning_engine.get_assessments_by_topic(user['id'], path['subject'], topic['name'])
         
-        if state_content and state_content.get('content'):
-            scores = json.loads(state_content['content'])['scores']
-            valid_scores = [s for s in scores if isinstance(s, (int, float))]
-            score = (sum(valid_scores)/len(valid_scores)*100) if valid_scores else 0.0
+        if topic['name'] in snapshot['scores']:
+            score = snapshot['scores'][topic['name']]
             assessment_passed = score >= 80
             topic_completed = assessment_passed and resource_progress >= 0.8
             topic_progress = 1.0 if topic_completed else resource_progress
@@ -296,6 +304,19 @@ def calculate_path_progress(path_id, topics, path):
     return round(min(1.0, overall_progress), 4)
 
 # -------------------------- Real-time timing is connected to the back end --------------------------
+def forget_timer_path(path_id):
+    """Stop timing a path (deleted or missing): the next heartbeat resolves the default path again"""
+    target = st.session_state.get('timer_target')
+    if target and str(target[0]) == str(path_id):
+        st.session_state.timer_target = None
+
+def load_learning_path(path_id, user_id):
+    """get_learning_path that also drops the timer target when the path no longer exists"""
+    path = learning_engine.get_learning_path(path_id, user_id)
+    if path is None:
+        forget_timer_path(path_id)
+    return path
+
 def get_default_path_topic(user_id):
     """Obtain the default path_id and topic_name"""
     paths = learning_engine.get_learning_paths(user_id)
@@ -318,11 +339,12 @@ def init_backend_timer():
     """Initialize the backend timing"""
     if st.session_state.user and not st.session_state.timer_initialized:
         user_id = st.session_state.user['id']
-        # Get the default path and topic
+        # Get the default path and topic (resolved once per login and reused by every heartbeat)
         path_id, topic_name = get_default_path_topic(user_id)
         # Call the backend initialization interface
         init_result = learning_engine.init_study_timer(user_id, path_id, topic_name)
         if init_result["status"] == "success":
+            st.session_state.timer_target = (path_id, topic_name)
             st.session_state.timer_initialized = True
             st.session_state.last_timer_update = datetime.now()
             st.success("Total study duration may have a delay.")
@@ -347,11 +369,19 @@ def update_backend_timer():
     add_minutes = 10.0 / 60  # Use 10.0 to ensure that the floating-point number calculation results ≈0.1667
     add_minutes = round(add_minutes, 2)  # Retain two decimal places and pass it on for 0.17 minutes
     
-    # 2. Get the default path and topic
-    path_id, topic_name = get_default_path_topic(user_id)
-    
-    # 3. Call the backend update interface
-    update_result = learning_engine.update_study_timer(user_id, path_id, topic_name, add_minutes)
+    # 2. Get the default path and topic (cached at initialization, resolved again when that path is gone,
+    #    e.g. deleted in another tab: its minutes could not be written)
+    target = st.session_state.timer_target
+    if not target or target[0] is None or load_learning_path(target[0], user_id) is None:
+        st.session_state.timer_target = get_default_path_topic(user_id)
+    path_id, topic_name = st.session_state.timer_target
+    if path_id is None:
+        # No learning path could be found or created: there is nothing to attribute the time to yet
+        st.session_state.timer_target = None
+        return round(learning_engine.get_total_study_time(user_id), 2)
+
+    # 3. Buffer the heartbeat in the write-behind timer (flushed to the database in batches)
+    update_result = learning_engine.record_study_time(user_id, path_id, topic_name, add_minutes)
     if update_result["status"] == "success":
         st.session_state.last_timer_update = current_time
         # Return the latest total duration (rounded to two decimal places for a more friendly display)
@@ -441,26 +471,48 @@ def show_ai_assistant():
             conversation_history = [{"role": msg["role"], "content": msg["content"]} 
                                    for msg in st.session_state.chat_history]
             
-            with st.spinner("Thinking..."):
-                try:
-                    if not st.session_state.api_key:
-                        st.error("DeepSeek API Key is required. Please set it in the dashboard.")
-                        return
-                    
-                    response = st.session_state.ai_agent.chat(conversation_history)
-                    
-                    if response and isinstance(response, dict) and 'error' not in response:
-                        assistant_msg = {
-                            "role": "assistant", "content": response['response'], 
-                            "timestamp": datetime.now().strftime("%H:%M")
-                        }
-                        st.session_state.chat_history.append(assistant_msg)
-                        st.rerun()
-                    else:
-                        error_msg = response.get('error', 'Failed to get response') if isinstance(response, dict) else 'Unknown error'
-                        st.error(f"Assistant error: {error_msg}")
-                except Exception as e:
-                    st.error(f"Error communicating with AI: {str(e)}")
+            if not st.session_state.api_key:
+                st.error("DeepSeek API Key is required. Please set it in the dashboard.")
+                return
+
+            # Stream the reply as it is generated; navigating away cancels it
+            cancel_event = threading.Event()
+            st.session_state.chat_cancel_event = cancel_event
+            reply = None
+            completed = False
+            stream = st.session_state.ai_agent.chat_stream(conversation_history, cancel_event=cancel_event)
+            try:
+                # Closing the generator releases its limiter slot and HTTP stream right away (not when GC runs)
+                with closing(stream):
+                    reply = st.write_stream(stream)
+                completed = True
+            except Exception as e:
+                st.error(f"Error communicating with AI: {str(e)}")
+            finally:
+                if not completed:
+                    # Interrupted by a rerun, a navigation or an error: stop the request now
+                    cancel_event.set()
+                st.session_state.chat_cancel_event = None
+
+            if isinstance(reply, list):
+                reply = "".join(part for part in reply if isinstance(part, str))
+            if reply and not cancel_event.is_set():
+                # Append the finished reply once
+                assistant_msg = {
+                    "role": "assistant", "content": reply, 
+                    "timestamp": datetime.now().strftime("%H:%M")
+                }
+                st.session_state.chat_history.append(assistant_msg)
+                st.rerun()
+            elif not reply and not cancel_event.is_set():
+                st.error("Assistant error: Failed to get response")
+
+def cancel_chat_stream():
+    """Stop a streaming assistant reply that is still running (e.g. when the user navigates away)"""
+    cancel_event = st.session_state.get('chat_cancel_event')
+    if cancel_event is not None:
+        cancel_event.set()
+        st.session_state.chat_cancel_event = None
 
 # Login page
 def show_login_page():
@@ -625,11 +677,12 @@ def show_dashboard():
                 with col2:
                     if st.button("Delete Path", key=f"delete_{path['id']}"):
                         learning_engine.delete_learning_path(path['id'], user['id'])
+                        forget_timer_path(path['id'])
                         st.success("Learning path deleted successfully!")
                         st.rerun()
                 with col3:
                     if st.button("Continue", key=f"continue_{path['id']}"):
-                        st.session_state.active_path = learning_engine.get_learning_path(path['id'], user['id'])
+                        st.session_state.active_path = load_learning_path(path['id'], user['id'])
                         st.session_state.selected_path_id = path['id']
                         st.session_state.show_assessment = {}
                         st.session_state.current_view = 'learning_path'
@@ -753,7 +806,8 @@ def show_learning_path():
         topics = content.get('topics', [])
         
         
-        new_progress = calculate_path_progress(path_id, topics, path)
+        progress_snapshot = learning_engine.get_path_progress_snapshot(user['id'], path_id)
+        new_progress = calculate_path_progress(path_id, topics, path, progress_snapshot)
         if abs(new_progress - path['progress']) > 0.01:
             learning_engine.update_learning_progress(path_id, user['id'], new_progress)
             st.session_state.active_path['progress'] = new_progress
@@ -831,11 +885,8 @@ def show_learning_path():
                         st.write(f"Topic Progress: {topic_progress*100:.1f}% ({status})")
                     
                     topic_key = f"{path_id}_topic_{i}_{topic['name']}"
-                    state_content = learning_engine.get_assessments_by_topic(user['id'], path['subject'], topic['name'])
-                    if state_content and state_content.get('content'):
-                        scores = json.loads(state_content['content'])['scores']
-                        valid_scores = [s for s in scores if isinstance(s, (int, float))]
-                        score = (sum(valid_scores)/len(valid_scores)*100) if valid_scores else 0.0
+                    if topic['name'] in progress_snapshot['scores']:
+                        score = progress_snapshot['scores'][topic['name']]
                         if score >= 80:
                             st.success(f"Assessment passed! Score: {score}%")
                         elif score > 0:
@@ -864,7 +915,7 @@ def show_learning_path():
                         
                         # Mark viewed
                         resource_key = f"{path_id}_{i}_{j}"
-                        is_viewed = learning_engine.check_resource_viewed(user['id'], path_id, topic['name'], res['title'])
+                        is_viewed = (topic['name'], res['title']) in progress_snapshot['viewed']
                         
                         if is_viewed:
                             st.markdown("""<style>.viewed-btn {background-color: #cccccc !important; color: #666666 !important; pointer-events: none;}</style>""", unsafe_allow_html=True)
@@ -914,21 +965,19 @@ def show_learning_path():
                                             del st.session_state[key]
                                     
                                     # 2. Delete this topic from the database
-                                    learning_engine.data_manager.execute_query(
-                                        "DELETE FROM assessments WHERE user_id = %s AND topic_name = %s",
-                                        (user['id'], topic['name'])
-                                    )
+                                    learning_engine.delete_topic_assessments(user['id'], topic['name'])
                                     
                                     # 3. Force refresh the path data
                                     st.session_state.active_path = None  # Clear the cache of the old path
-                                    st.session_state.active_path = learning_engine.get_learning_path(path_id, user['id'])  # 重新加载
+                                    st.session_state.active_path = load_learning_path(path_id, user['id'])  # 重新加载
                                     
                                     # "Generate logic
                                     if full_topic_key in st.session_state.assessment_state:
                                         del st.session_state.assessment_state[full_topic_key]
                                     
-                                    questions_result = assessment_manager.generate_practice_exercises(
-                                        path['subject'], topic['name'], path['difficulty_level'],
+                                    # Unseen exercises from the pre-generated pool (live generation only when it runs dry)
+                                    questions_result = assessment_manager.draw_assessment(
+                                        user['id'], path['subject'], topic['name'], path['difficulty_level'],
                                         st.session_state.ai_agent, num_exercises=10
                                     )
                                     
@@ -941,7 +990,7 @@ def show_learning_path():
                                         # After the assessment is generated, the path data cached at the front end is updated synchronously
                                         learning_engine.add_topic_questions(path['id'], paths, topic['name'], questions, user['id'])
                                         # Re-obtain the latest path data and update it to the session state
-                                        st.session_state.active_path = learning_engine.get_learning_path(path_id, user['id'])
+                                        st.session_state.active_path = load_learning_path(path_id, user['id'])
                                         # Re-parse the path content (make sure to include the newly generated evaluation question)
                                         content = json.loads(st.session_state.active_path['content'])
                                         topics = content.get('topics', [])  # Refresh the topics list
@@ -1007,15 +1056,14 @@ def show_learning_path():
                             }
                         
                         current_state = st.session_state.assessment_state[full_topic_key]
-                        state_content = learning_engine.get_assessments_by_topic(user['id'], path['subject'], topic['name'])
-                        if state_content and not current_state['submitted']:
-                            saved_state = json.loads(state_content.get('content', '{}'))
+                        saved_state = progress_snapshot['assessments'].get(topic['name'])
+                        if saved_state and not current_state['submitted']:
                             if saved_state.get('user_answers') and len(saved_state['user_answers']) == len(questions):
                                 current_state['user_answers'] = saved_state['user_answers']
                                 current_state['questions'] = questions
                                 current_state['submitted'] = True
-                                current_state['scores'] = json.loads(state_content['content'])['scores']
-                                current_state['feedback'] = json.loads(state_content['content'])['feedback']
+                                current_state['scores'] = saved_state['scores']
+                                current_state['feedback'] = saved_state['feedback']
                                 valid_scores = [s for s in current_state['scores'] if isinstance(s, (int, float))]
                                 current_state['total_score'] = (sum(valid_scores)/len(valid_scores)*100) if valid_scores else 0.0
                         # (pghd)
@@ -1032,7 +1080,7 @@ def show_learning_path():
                                     """, unsafe_allow_html=True)
                                     
                                     current_answer = current_state['user_answers'][idx]
-                                    if q.get('type') == 'multiple_choice' and q.get('options'):
+                                    if assessment_manager.is_choice_question(q):
                                         option_index = q['options'].index(current_answer) if current_answer in q['options'] else None
                                         user_answer = st.radio(
                                             "Select your answer:", q['options'], index=option_index,
@@ -1059,11 +1107,13 @@ def show_learning_path():
                                     with st.spinner("Evaluating your answers..."):
                                         current_state['scores'] = []
                                         current_state['feedback'] = []
-                                        for idx, (q, ans) in enumerate(zip(questions, current_state['user_answers'])):
-                                            evaluation = assessment_manager.evaluate_answer(
-                                                path['subject'], topic['name'], q['question'],
-                                                ans, path['difficulty_level'], st.session_state.ai_agent
-                                            )
+                                        # Choice questions are graded locally, open answers concurrently by the AI (in question order)
+                                        evaluations = assessment_manager.evaluate_answers_batch(
+                                            path['subject'], topic['name'],
+                                            list(zip(questions, current_state['user_answers'])),
+                                            path['difficulty_level'], st.session_state.ai_agent, user_id=user['id']
+                                        )
+                                        for evaluation in evaluations:
                                             score = evaluation['data']['score'] if (evaluation and evaluation["status"] == "success") else 0.0
                                             feedback = evaluation['data']['feedback'] if (evaluation and evaluation["status"] == "success") else "No feedback available"
                                             current_state['scores'].append(score)
@@ -1125,8 +1175,8 @@ def show_learning_path():
                                     display_ans = ans.strip() if ans.strip() != "" else "Not filled in"
                                     st.write(f"**Your answer:** {display_ans}")
                                     
-                                    if q.get('type') == 'multiple_choice' and q.get('options') and q.get('correct_option') is not None:
-                                        correct_idx = q['correct_option']
+                                    if assessment_manager.is_choice_question(q):
+                                        correct_idx = int(q['correct_option'])
                                         if 0 <= correct_idx < len(q['options']):
                                             st.write(f"**Correct answer:** {q['options'][correct_idx]}")
                                     
@@ -1257,32 +1307,50 @@ def show_create_path():
             if not subject:
                 st.warning("Please enter a subject")
             else:
-                with st.spinner("Generating your personalized learning path..."):
-                    if not st.session_state.api_key:
-                        st.error("DeepSeek API Key is required. Please set it in the dashboard.")
-                        return
-                    path_id, default = learning_engine.create_learning_path(
-                        user['id'], subject, difficulty, target_days, st.session_state.ai_agent
-                    )
-                    if not default:
-                        st.error("DeepSeek error, please check it!")
-                        return
-                    
-                    if path_id:
-                        if materials:
-                            st.session_state.uploaded_materials[path_id] = materials
-                        
-                        st.session_state.active_path = learning_engine.get_learning_path(path_id, user['id'])
-                        st.session_state.selected_path_id = path_id
-                        st.session_state.ai_generated_path = ai_option
-                        st.session_state.show_assessment = {}
-                        # if ai_option:
-                        #     st.warning("Note: AI generation is currently unavailable. The path uses default content.")
-                        st.success("Path created successfully!")
-                        st.session_state.current_view = 'learning_path'
-                        st.rerun()
-                    else:
-                        st.error("Failed to create path. Try again.")
+                if not st.session_state.api_key:
+                    st.error("DeepSeek API Key is required. Please set it in the dashboard.")
+                    return
+                # Generate in the background; the page polls the job below
+                # An explicit request always gets a fresh generation, never a cached one
+                job_id = learning_engine.submit_learning_path(
+                    user['id'], subject, difficulty, target_days, st.session_state.ai_agent, cache=False
+                )
+                if job_id:
+                    st.session_state.path_job = {
+                        "id": job_id, "materials": materials, "ai_option": ai_option
+                    }
+                    st.rerun()
+                else:
+                    st.error("Failed to create path. Try again.")
+
+    show_path_job_status(user)
+
+def show_path_job_status(user):
+    """Poll the pending path generation job (a single lookup per refresh) and open the path once it is saved"""
+    pending = st.session_state.get('path_job')
+    if not pending:
+        return
+    job = learning_engine.get_job(pending['id'], user['id'])
+    if not job or job['status'] == 'failed':
+        st.session_state.path_job = None
+        st.error(f"Failed to create path: {(job or {}).get('error') or 'unknown error'}. Try again.")
+        return
+    if job['status'] != 'succeeded':
+        st.info(f"⏳ Generating your personalized learning path... {job.get('progress') or ''}")
+        st_autorefresh(interval=2000, key=f"path_job_poll_{pending['id']}")
+        return
+
+    path_id = job['result_id']
+    st.session_state.path_job = None
+    if pending['materials']:
+        st.session_state.uploaded_materials[path_id] = pending['materials']
+    st.session_state.active_path = load_learning_path(path_id, user['id'])
+    st.session_state.selected_path_id = path_id
+    st.session_state.ai_generated_path = pending['ai_option']
+    st.session_state.show_assessment = {}
+    st.success("Path created successfully!")
+    st.session_state.current_view = 'learning_path'
+    st.rerun()
 
 # Analysis Page
 def show_analytics():
@@ -1589,7 +1657,8 @@ def show_planner():
                 hours_per_day=daily_hours,
                 topics=topics,
                 subject=selected_path['subject'],
-                focus=focus_areas
+                focus=focus_areas,
+                cache=False  # Pressing the button again must produce a new plan
             )
             # Extract the planned data returned by AI
             ai_plan = ai_plan_result.get("data", {}) if ai_plan_result.get("status") == "success" else {}
@@ -1702,10 +1771,7 @@ def show_planner():
                 if confirm_delete and st.button("🗑️ Delete Saved Plan", key="delete_saved_plan_btn", type="primary"):
                     with st.spinner("Deleting plan..."):
                         # 1. Delete database records
-                        delete_result = learning_engine.data_manager.execute_query(
-                            """DELETE FROM study_schedules WHERE user_id = %s AND path_id = %s""",
-                            (user['id'], int(selected_path_id))
-                        )
+                        delete_result = learning_engine.delete_plan(user['id'], path_id=int(selected_path_id))
                         if delete_result is not False:
                             # 2. Thoroughly clean up all relevant session states
                             plan_keys = [k for k in st.session_state if f"current_plan_{selected_path_id}" in k]
@@ -1741,10 +1807,7 @@ def show_planner():
             except json.JSONDecodeError:
                 st.error("Failed to load saved plan. Please generate a new one.")
                 # Delete damaged plan records
-                learning_engine.data_manager.execute_query(
-                    "DELETE FROM study_schedules WHERE id = %s",
-                    (saved_plan['id'],)
-                )
+                learning_engine.delete_plan(user['id'], plan_id=saved_plan['id'])
         else:
             # Display prompts when there is no plan to avoid rendering empty components
             st.info("No saved study plans yet. Generate a plan to save it.")
@@ -1754,6 +1817,32 @@ def show_planner():
 def main():
     # Initialize the session state
     init_session_state()
+    # Memoize backend reads for this script run (duplicate reads of a view hit the database once)
+    with RequestMemo.scope(st.session_state.get('current_view', 'dashboard')) as memo:
+        render_app()
+        if SHOW_PERF_STATS and st.session_state.user:
+            show_perf_stats(memo)
+
+def show_perf_stats(memo):
+    """Sidebar debug panel with the process-wide performance counters"""
+    with st.sidebar.expander("Performance counters"):
+        # Duplicate reads served by the request memo: this run, and cumulative per view
+        st.caption("Request memo")
+        st.json({"this_run": memo.stats(), "per_view": RequestMemo.view_totals()}, expanded=False)
+        # Atomic write counters (commits, guard conflicts, no-ops, group rollbacks, deadlock retries)
+        st.caption("Database writes")
+        st.json(learning_engine.get_write_stats(), expanded=False)
+        # LLM response cache hit rates per feature
+        st.caption("LLM cache")
+        st.json(DeepSeekAIAgent.get_cache_stats(), expanded=False)
+        # Queue depth and wait times of the shared LLM limiter
+        st.caption("LLM limiter")
+        st.json(DeepSeekAIAgent.get_limiter_stats(), expanded=False)
+        # Latency percentiles, attempts, tokens and cost per LLM feature
+        st.caption("LLM telemetry")
+        st.json(DeepSeekAIAgent.get_telemetry_summary(), expanded=False)
+
+def render_app():
     # Initialize the AI agent
     init_ai_agent()
     
@@ -1790,6 +1879,7 @@ def main():
             btn_text = f"{name}"
             
             if st.button(btn_text, use_container_width=True, key=f"nav_btn_{view}", disabled=disabled):
+                cancel_chat_stream()
                 st.session_state.current_view = view
                 # Clear the active path when switching to a non-learning path page
                 if view != "learning_path":
@@ -1804,9 +1894,12 @@ def main():
         # Log out button
         if st.button("Logout", use_container_width=True, key="logout_btn"):
             # When logging out, the database duration is not cleared; only the session status is reset
+            learning_engine.flush_study_time(st.session_state.user['id'])
+            cancel_chat_stream()
             st.session_state.user = None
             st.session_state.current_view = 'login'
             st.session_state.timer_initialized = False
+            st.session_state.timer_target = None
             st.success("Logged out successfully!")
             st.rerun()
     
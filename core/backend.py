@@ -7,6 +7,7 @@ import time
 import random
 import openai
 from openai import OpenAI
+import httpx
 import PyPDF2
 import docx
 from io import BytesIO, StringIO
@@ -17,8 +18,23 @@ from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import letter
 from reportlab.lib.units import inch
 from .data_manager import DataManager
+from .llm_cache import llm_cache, feature_ttl, LLMResponseCache
+from .jobs import job_queue
+from .exercise_pool import exercise_pool
+from .llm_limiter import llm_limiter, feature_priority, retry_decision
+from .llm_telemetry import llm_telemetry, LLMCall
+from .llm_json import load_llm_json
 import logging
 import re
+import functools
+import copy
+import hashlib
+import contextvars
+import threading
+import atexit
+from contextlib import contextmanager
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait, as_completed, FIRST_COMPLETED
 
 # Configuration log
 logging.basicConfig(
@@ -73,6 +89,297 @@ def extract_text_from_file(uploaded_file):
         logger.error(f"The file content extraction failed: {str(e)}")
         return {"status": "error", "message": f"The file content cannot be extracted: {str(e)}"}
 
+# Request-scoped memoization (one Streamlit script run)
+class RequestMemo:
+    """Memoize engine reads within one script run; any write in the same run invalidates the memo"""
+    _current = contextvars.ContextVar("request_memo", default=None)
+    # Cumulative counters per view label, so duplicate reads can be compared across views (shared by all sessions)
+    _view_totals = {}
+    _totals_lock = threading.Lock()
+
+    def __init__(self, label="rerun"):
+        self.label = label
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        self.methods = {}
+
+    @classmethod
+    @contextmanager
+    def scope(cls, label="rerun"):
+        """Open a memo for the current script run (nested scopes reuse the outer memo)"""
+        outer = cls._current.get()
+        if outer is not None:
+            yield outer
+            return
+        memo = cls(label)
+        token = cls._current.set(memo)
+        try:
+            yield memo
+        finally:
+            cls._current.reset(token)
+            memo._record_totals()
+            if memo.hits or memo.invalidations:
+                logger.info(f"Request memo [{memo.label}]: {memo.hits} hits, {memo.misses} misses, {memo.invalidations} invalidations")
+
+    @classmethod
+    def current(cls):
+        return cls._current.get()
+
+    @classmethod
+    def invalidate(cls):
+        """Drop every memoized read of the current run (called after writes)"""
+        memo = cls._current.get()
+        if memo is not None:
+            memo.entries.clear()
+            memo.invalidations += 1
+
+    @classmethod
+    @contextmanager
+    def suspended(cls):
+        """Bypass the memo, e.g. for reads issued inside a write"""
+        token = cls._current.set(None)
+        try:
+            yield
+        finally:
+            cls._current.reset(token)
+
+    @classmethod
+    def view_totals(cls):
+        """Cumulative hit/miss counters per view label"""
+        with cls._totals_lock:
+            return {label: dict(totals) for label, totals in cls._view_totals.items()}
+
+    def lookup(self, method_name, key, loader):
+        """
+        The memoized result of key (loaded on a miss). Callers get their own deep copy, so mutating a returned
+        path or snapshot cannot change what later calls in the same run see
+        """
+        counters = self.methods.setdefault(method_name, {"hits": 0, "misses": 0})
+        if key in self.entries:
+            self.hits += 1
+            counters["hits"] += 1
+        else:
+            self.misses += 1
+            counters["misses"] += 1
+            self.entries[key] = loader()
+        return copy.deepcopy(self.entries[key])
+
+    def stats(self):
+        return {
+            "label": self.label,
+            "hits": self.hits,
+            "misses": self.misses,
+            "invalidations": self.invalidations,
+            "methods": {name: dict(counters) for name, counters in self.methods.items()}
+        }
+
+    def _record_totals(self):
+        with RequestMemo._totals_lock:
+            totals = RequestMemo._view_totals.setdefault(self.label, {"runs": 0, "hits": 0, "misses": 0})
+            totals["runs"] += 1
+            totals["hits"] += self.hits
+            totals["misses"] += self.misses
+
+def memoized_read(method):
+    """Engine read method: identical calls within one memo scope hit the database once"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        memo = RequestMemo.current()
+        if memo is None:
+            return method(self, *args, **kwargs)
+        key = (method.__name__, repr(args), repr(sorted(kwargs.items())))
+        return memo.lookup(method.__name__, key, lambda: method(self, *args, **kwargs))
+    return wrapper
+
+def invalidates_reads(method):
+    """Engine write method: runs without the memo and invalidates it afterwards"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            with RequestMemo.suspended():
+                return method(self, *args, **kwargs)
+        finally:
+            RequestMemo.invalidate()
+    return wrapper
+
+# Write-behind study timer
+class StudyTimeAccumulator:
+    """Collect study-time heartbeats in memory and flush them to learning_activities in batched upserts"""
+    FLUSH_QUERY = """
+        INSERT INTO learning_activities
+        (user_id, path_id, topic_name, content, total_minutes, activity_date)
+        VALUES (%s, %s, %s, %s, %s, NOW())
+        ON DUPLICATE KEY UPDATE
+            total_minutes = total_minutes + VALUES(total_minutes),
+            activity_date = NOW(),
+            version = version + 1
+    """
+    TOTALS_QUERY = """
+        INSERT INTO user_study_totals (user_id, total_minutes)
+        VALUES (%s, %s)
+        ON DUPLICATE KEY UPDATE
+            total_minutes = total_minutes + VALUES(total_minutes),
+            version = version + 1
+    """
+
+    def __init__(self, flush_interval=30, reconcile_interval=21600):
+        self.flush_interval = flush_interval
+        self.reconcile_interval = reconcile_interval
+        self._last_reconcile = time.monotonic()
+        self._pending = {}  # (user_id, path_id, topic_name) -> minutes not yet written
+        self._in_flight = {}  # minutes taken by a running flush (still counted as pending until written)
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.flushed_batches = 0
+        self.flushed_rows = 0
+
+    def add(self, user_id, path_id, topic_name, minutes):
+        """Buffer a minute delta for a user - path - topic; False (nothing buffered) without a path"""
+        if path_id is None:
+            # uk_user_path_topic cannot deduplicate NULL paths: every flush would insert a new row
+            logger.warning(f"Study time without a learning path is not recorded (user {user_id}, {topic_name})")
+            return False
+        key = (user_id, path_id, topic_name)
+        with self._lock:
+            self._pending[key] = round(self._pending.get(key, 0.0) + minutes, 2)
+        self.start()
+        return True
+
+    def discard_path(self, user_id, path_id):
+        """Drop the buffered minutes of a path that is being deleted"""
+        with self._lock:
+            for key in [k for k in self._pending if k[0] == user_id and k[1] == path_id]:
+                del self._pending[key]
+            # A running flush must not put them back if it fails
+            for key in [k for k in self._in_flight if k[0] == user_id and k[1] == path_id]:
+                del self._in_flight[key]
+
+    def pending_minutes(self, user_id):
+        """Minutes of a user that are buffered or being flushed (not yet visible in the database)"""
+        with self._lock:
+            return sum(m for k, m in self._pending.items() if k[0] == user_id) + \
+                   sum(m for k, m in self._in_flight.items() if k[0] == user_id)
+
+    def flush(self, user_id=None):
+        """Write the buffered deltas (of one user, or everyone) with one multi-row upsert"""
+        with self._flush_lock:
+            with self._lock:
+                keys = [k for k in self._pending if user_id is None or k[0] == user_id]
+                if not keys:
+                    return 0
+                self._in_flight = {k: self._pending.pop(k) for k in keys}
+                batch = dict(self._in_flight)
+
+            settled, written = set(), 0
+            try:
+                settled, written = self._write(batch)
+            except Exception as e:
+                logger.error(f"The study timer flush failed: {str(e)}")
+            finally:
+                with self._lock:
+                    in_flight, self._in_flight = self._in_flight, {}
+                    # Put the unsettled deltas back so the next flush retries them (except those of deleted paths)
+                    for key, minutes in in_flight.items():
+                        if key not in settled:
+                            self._pending[key] = round(self._pending.get(key, 0.0) + minutes, 2)
+            return written
+
+    def _write(self, batch):
+        """
+        Write a batch of deltas; a row that cannot be written must not hold back the others
+        Return: (settled keys: written or dropped, number of rows written)
+        """
+        # 1. Everything in one multi-row upsert
+        if self._write_rows(batch):
+            return set(batch), len(batch)
+
+        # 2. It failed: drop the deltas of paths that no longer exist (they break the path foreign key)
+        path_ids = tuple({key[1] for key in batch})
+        paths = DataManager().execute_query(
+            f"SELECT id, user_id FROM learning_paths WHERE id IN ({', '.join(['%s'] * len(path_ids))})", path_ids
+        )
+        if paths is False:
+            return set(), 0  # The database is unreachable: everything is retried on the next flush
+        existing = {(row['user_id'], row['id']) for row in paths}
+        settled = {key for key in batch if key[:2] not in existing}
+        if settled:
+            logger.warning(f"Dropped {len(settled)} study timer deltas of deleted learning paths")
+
+        # 3. Then one upsert per user, so that a failing row only holds back its own user
+        by_user = {}
+        for key, minutes in batch.items():
+            if key not in settled:
+                by_user.setdefault(key[0], {})[key] = minutes
+        written = 0
+        for uid, user_batch in by_user.items():
+            if self._write_rows(user_batch):
+                settled.update(user_batch)
+                written += len(user_batch)
+            else:
+                logger.error(f"The study timer flush failed for user {uid}, retrying on the next flush")
+        return settled, written
+
+    def _write_rows(self, batch):
+        """Upsert the activity minutes and per-user totals of a batch in the same commit"""
+        rows = [
+            (uid, path_id, topic_name, json.dumps({"status": "auto_timer"}), minutes)
+            for (uid, path_id, topic_name), minutes in batch.items()
+        ]
+        user_totals = {}
+        for (uid, _, _), minutes in batch.items():
+            user_totals[uid] = round(user_totals.get(uid, 0.0) + minutes, 2)
+        result = DataManager().execute_atomic([
+            (self.FLUSH_QUERY, rows),
+            (self.TOTALS_QUERY, list(user_totals.items()))
+        ])
+        if result is False:
+            return False
+        self.flushed_batches += 1
+        self.flushed_rows += len(rows)
+        return True
+
+    def start(self):
+        """Start the periodic flush thread (once per process)"""
+        if self._thread and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name="study-timer-flush", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        """Stop the flush thread and write everything that is still buffered"""
+        self._stop_event.set()
+        self.flush()
+
+    def _run(self):
+        while not self._stop_event.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error(f"The periodic study timer flush failed: {str(e)}")
+            # Periodic reconciliation job: recompute the incremental totals from learning_activities
+            if self.reconcile_interval and time.monotonic() - self._last_reconcile >= self.reconcile_interval:
+                self._last_reconcile = time.monotonic()
+                try:
+                    reconciled = DataManager().reconcile_study_totals()
+                    logger.info(f"Study time totals reconciled for {reconciled} users")
+                except Exception as e:
+                    logger.error(f"The study time reconciliation failed: {str(e)}")
+
+# One accumulator per process, shared by all sessions; flushed on shutdown
+study_time_accumulator = StudyTimeAccumulator(
+    flush_interval=float(os.environ.get("STUDY_TIMER_FLUSH_SECONDS", 30)),
+    reconcile_interval=float(os.environ.get("STUDY_TOTALS_RECONCILE_SECONDS", 21600))
+)
+atexit.register(study_time_accumulator.stop)
+
 # Core module implementation
 class MockUserManager:
     """User management class,handling user authentication and information management"""
@@ -98,6 +405,11 @@ class MockUserManager:
 # Learning path engine(with persistent storage)
 class MockLearningEngine:
     """The learning engine class,handles the generation of learning paths, progress tracking, and learning analysis"""
+    # Topic expansions of all path generations share one bounded pool
+    PATH_TOPIC_WORKERS = int(os.environ.get("PATH_TOPIC_WORKERS", 5))
+    _topic_executor = None
+    _topic_lock = threading.Lock()
+
     def __init__(self):
         self.data_dir = "data"
         self.paths_file = os.path.join(self.data_dir, "learning_paths.json")
@@ -109,42 +421,66 @@ class MockLearningEngine:
         if not os.path.exists(self.data_dir):
             os.makedirs(self.data_dir)
 
+    @memoized_read
     def get_learning_paths(self, user_id):
-        """Obtain all the learning paths of the user"""
+        """Obtain all the learning paths of the user (shared versioned cache in DataManager)"""
         try:
-            return self.data_manager.execute_query('''
-                SELECT * FROM learning_paths 
-                WHERE user_id = %s 
-                ORDER BY created_at DESC
-            ''', (user_id,))
+            return self.data_manager.get_learning_paths(user_id)
         except Exception as e:
             logger.error(f"Failed to obtain the learning path: {str(e)}")
             return []
 
+    @memoized_read
     def get_learning_path(self, path_id, user_id):
         """Get details of a specific learning path"""
         try:
-            paths = self.data_manager.execute_query('''
-                SELECT * FROM learning_paths 
-                WHERE id = %s AND user_id = %s
-            ''', (path_id, user_id))
-            return paths[0] if paths else None
+            for attempt in range(2):
+                paths = self.data_manager.get_learning_paths(user_id) or []
+                path = next((p for p in paths if str(p['id']) == str(path_id)), None)
+                # Retry only for an id newer than every cached path (created by another worker within the TTL);
+                # an older id is deleted or not the user's, and must not cost the user their cached list
+                if path or attempt or not str(path_id).isdigit() or \
+                        any(int(p['id']) >= int(path_id) for p in paths):
+                    return path
+                # The version probe reloads the list only if it changed
+                self.data_manager.revalidate_learning_paths(user_id)
         except Exception as e:
             logger.error(f"Failed to obtain a specific learning path: {str(e)}")
             return None
-    
+
+    @invalidates_reads
     def delete_learning_path(self, path_id, user_id):
         """Delete the specific learning path of a particular user"""
         try:
-            self.data_manager.execute_query('''
-                DELETE FROM learning_paths 
-                WHERE id = %s AND user_id = %s
-            ''', (path_id, user_id))
+            # Buffered minutes of the path would be flushed against a deleted path (and are not in the total yet)
+            study_time_accumulator.discard_path(user_id, path_id)
+            # The delete cascades to the path's activities: take their minutes off the user's total in the same commit
+            self.data_manager.execute_atomic([
+                ('''
+                    UPDATE user_study_totals t
+                    JOIN (
+                        SELECT COALESCE(SUM(total_minutes), 0) AS minutes
+                        FROM learning_activities WHERE user_id = %s AND path_id = %s
+                    ) a
+                    SET t.total_minutes = GREATEST(0, t.total_minutes - a.minutes), t.version = t.version + 1
+                    WHERE t.user_id = %s AND a.minutes > 0
+                ''', (user_id, path_id, user_id)),
+                ('''
+                    DELETE FROM learning_paths
+                    WHERE id = %s AND user_id = %s
+                ''', (path_id, user_id))
+            ])
         except Exception as e:
             logger.error(f"Failed to delete the learning path: {str(e)}")
+        finally:
+            self.data_manager.invalidate_learning_paths(user_id)
     
-    def create_learning_path(self, user_id, subject, difficulty, target_days, ai_agent, default=True):
-        """Create structured learning path, giving priority to AI-generated ones, and use the default paths when they fail"""
+    @invalidates_reads
+    def create_learning_path(self, user_id, subject, difficulty, target_days, ai_agent, default=True, progress=None, cache=True):
+        """
+        Create structured learning path, giving priority to AI-generated ones, and use the default paths when they fail
+        cache=False generates a fresh path instead of reusing a cached generation of the same request
+        """
         try:
             target_date = (datetime.now() + timedelta(days=target_days)).strftime("%Y-%m-%d")
             user_profile = self.data_manager.execute_query('''
@@ -157,7 +493,9 @@ class MockLearningEngine:
             
             user_interests = user_profile[0]['interests'] or "General interests"
             learning_style = user_profile[0]['learning_style'] or "Visual"
-            path_content = self._generate_ai_learning_path(subject, user_interests, learning_style, difficulty, target_days, ai_agent)
+            path_content = self._generate_ai_learning_path(
+                subject, user_interests, learning_style, difficulty, target_days, ai_agent, progress=progress, cache=cache
+            )
             
             if not path_content:
                 logger.warning(f"The AI failed to generate the learning path and used the default path: {subject}")
@@ -176,12 +514,40 @@ class MockLearningEngine:
                 json.dumps(path_content),
                 target_date,
             ))
+            self.data_manager.invalidate_learning_paths(user_id)
             
             return path_id, default
         except Exception as e:
             logger.error(f"Failed to create the learning path: {str(e)}")
             return None, False
 
+    def submit_learning_path(self, user_id, subject, difficulty, target_days, ai_agent, cache=True):
+        """Queue the generation of a learning path in the background; returns the job id (poll get_job)"""
+        return job_queue.submit(
+            user_id, "learning_path",
+            {"subject": subject, "difficulty": difficulty, "target_days": target_days, "cache": cache},
+            runtime={"ai_agent": ai_agent}
+        )
+
+    def get_job(self, job_id, user_id):
+        """Status of a background job: {'status', 'progress', 'result_id', 'error', ...} or None"""
+        return job_queue.status(job_id, user_id)
+
+    def _run_learning_path_job(self, job):
+        """Job handler: generate and save the path, return its id"""
+        ai_agent = job.runtime.get("ai_agent")
+        if ai_agent is None:
+            raise RuntimeError("The AI agent is no longer available, please try again")
+        job.report_progress("Outlining the learning path with AI...")
+        result = self.create_learning_path(
+            job.user_id, job.params["subject"], job.params["difficulty"], job.params["target_days"], ai_agent,
+            progress=job.report_progress, cache=job.params.get("cache", True)
+        )
+        path_id = result[0] if result else None
+        if not path_id:
+            raise RuntimeError("Failed to create path")
+        return path_id
+
     def _generate_default_learning_path(self, subject, difficulty, target_days):
         """Generate a default learning path as a backup for failed AI generation"""
         return {
@@ -223,59 +589,90 @@ class MockLearningEngine:
             ]
         }
 
-    def _generate_ai_learning_path(self, subject, user_interests, learning_style, difficulty, target_days, ai_agent):
-        """Use AI to generate personalized learning paths, including correctly formatted urls"""
+    def _generate_ai_learning_path(self, subject, user_interests, learning_style, difficulty, target_days, ai_agent,
+                                   progress=None, cache=True):
+        """
+        Generate the path in two phases: a short outline call (topics, durations, milestones, strategies), then one
+        concurrent call per topic for its resources and exercises. A topic whose expansion fails gets default content
+        on its own; only a failed outline fails the whole path
+        """
+        outline = self._generate_path_outline(
+            subject, user_interests, learning_style, difficulty, target_days, ai_agent, cache=cache
+        )
+        if not outline:
+            return None
+        topics = outline["topics"]
+        if progress:
+            progress(f"Outline ready, expanding {len(topics)} topics...")
+
+        # 1. Fan out: one expansion per topic, all in flight at once
+        executor = self._get_topic_executor()
+        futures = {
+            executor.submit(
+                self._expand_path_topic, subject, topic, index, topics, difficulty, learning_style, user_interests,
+                ai_agent, cache
+            ): index
+            for index, topic in enumerate(topics)
+        }
+
+        # 2. Merge each topic as it completes; a failure only affects its own topic
+        expanded = {}
+        for done, future in enumerate(as_completed(futures), 1):
+            index = futures[future]
+            try:
+                expanded[index] = future.result()
+            except Exception as e:
+                logger.error(f"Expanding the topic {topics[index]['name']} failed: {str(e)}")
+                expanded[index] = None
+            if progress:
+                progress(f"Expanded {done} of {len(topics)} topics...")
+
+        fallbacks = 0
+        for index, topic in enumerate(topics):
+            content = expanded.get(index) or {}
+            default = self._default_topic_content(subject, topic["name"], difficulty)
+            if not content.get("resources") or not content.get("practice_exercises"):
+                fallbacks += 1
+            topic["resources"] = content.get("resources") or default["resources"]
+            topic["practice_exercises"] = content.get("practice_exercises") or default["practice_exercises"]
+        if fallbacks:
+            logger.warning(f"{fallbacks} of {len(topics)} topics of the {subject} path use default content")
+        return outline
+
+    def _generate_path_outline(self, subject, user_interests, learning_style, difficulty, target_days, ai_agent, cache=True):
+        """Phase 1: topic names, descriptions and durations, milestones and strategies (validated), or None"""
         prompt = f"""
         You are a world-class educational curriculum designer, skilled at creating structured learning paths.
-        Design a comprehensive learning path based on the following parameters:
+        Outline a comprehensive learning path based on the following parameters:
         - Theme：{subject}
         - Difficulty level：{difficulty}
         - Target completion time：{target_days}day
         - User interest：{user_interests}
         - Learning style：{learning_style}
 
-        The learning path must include educational resources suitable for learners of {learning_style}.
         The learning path must be logically progressive, starting from basic concepts and gradually advancing to more complex topics.
-        
+        Only the outline is needed here: the resources and practice questions of each topic are created separately.
+
         # Discipline-Specific Granularity & Path Adaptation Rules
-        The learning path shall be tailored to the discipline category with differentiated knowledge granularity, content progression logic, and resource weight allocation, as follows:
-        
+        The learning path shall be tailored to the discipline category with differentiated knowledge granularity and content progression logic, as follows:
+
         1. For STEM disciplines (e.g., Artificial Intelligence, Data Science)
         - Split the core knowledge into 8 fine-grained sub-topics, structured in a three-stage progression: Theory → Hands-on Practice → Extension & Innovation
-        - Resource weight allocation: 30% theoretical resources (academic papers, textbooks), 40% hands-on resources (tutorials, coding platforms, labs), 30% extension resources (cutting-edge research, industry projects)
         - The 8 sub-topics shall be evenly distributed across the three stages to ensure progressive mastery.
-        
+
         2.For Business disciplines (e.g., Marketing, Management)
         - Split the core knowledge into 3 core modules, focused on a three-dimensional progression: Theoretical Framework → Industry Case Analysis → Decision-Making Simulation
-        - Resource weight allocation: 20% theoretical resources (frameworks, models), 50% case resources (real-world cases, case studies), 30% simulation resources (business simulation tools, role-play scenarios)
         - The 3 modules shall be designed to realize the transformation from "knowing" to "applying".
 
         3.For Finance disciplines (e.g., Financial Analysis, FinTech)
         - Split the core knowledge into 5 medium-grained nodes, balanced in a three-directional progression: Foundation → Application → Cross-Boundary Integration
-        - Resource weight allocation: 35% foundational resources (principles, regulations), 35% application resources (data analysis tools, investment strategies), 30% cross-boundary resources (FinTech convergence, interdisciplinary practices)
         - The 5 nodes shall connect theoretical basics with practical scenarios and cross-field applications.
-        
+
         It should include the following components:
         1.3 to 5 main themes, comprehensively covering the discipline
         (1)Each topic must have a clear and descriptive title
         (2)Provide a detailed explanation of the content covered by this topic (3-5 sentences)
         (3)Appropriate duration allocation (the total is approximately {target_days} days)
-        (4)3-5 high-quality learning resources, including:
-        1)Descriptive title
-        2)Resource types (videos, articles, interactions, etc.)
-        3)A detailed description of content/value
-        4)Source/Platform name (e.g., Coursera, YouTube, Medium, Khan Academy)
-        5)The URL format is [Platform base URL] + search query related to the resource
-        6)Example：
-         https://www.coursera.org/search?query={subject}+fundamentals
-         https://www.youtube.com/results?search_query={subject}+tutorial
-         https://medium.com/search?q={subject}+advanced+techniques
-        (5)2 to 3 practice questions, including:
-        1)Clear and challenging questions
-        2)Difficulty rating (matching the overall difficulty level)
-        3)Estimated completion time (minutes)
-        4)Detailed answer
-        5)A comprehensive explanation of the solution/concept
         2.2-3 key milestones, including:
         (1)Expected completion date (relative to the start)
         (2)Descriptive milestone name
@@ -284,32 +681,14 @@ class MockLearningEngine:
         (1)The unique challenges of this discipline
         (2)The specified difficulty level
         (3)Best knowledge retention
-        
+
         Format your response in a valid JSON format with the exact structure as follows:
         {{
             "topics": [
                 {{
                     "name": "Theme Name",
                     "description": "Detailed topic description",
-                    "duration_days": 3,
-                    "resources": [
-                        {{
-                            "title": "Resource Title",
-                            "type": "Resource type",
-                            "description": "Resource content description",
-                            "platform": "Platform name",
-                            "url": "https://platform.com/search?q={subject}+specific+terms"
-                        }}
-                    ],
-                    "practice_exercises": [
-                        {{
-                            "question": "Exercise text",
-                            "difficulty": "Difficulty level",
-                            "estimated_time_minutes": 25,
-                            "answer": "Complete answer text",
-                            "explanation": "A detailed explanation of the concept"
-                        }}
-                    ]
+                    "duration_days": 3
                 }}
             ],
             "milestones": [
@@ -321,128 +700,218 @@ class MockLearningEngine:
             ],
             "learning_strategies": ["Strategy1", "Strategy2", "Strategy3"]
         }}
-        
-        Key requirements
-        - All urls must follow the platform base URL + search query format shown in the example
-        - The URL must be valid and point to the relevant content
-        - Maintain consistency with the specified JSON structure
-        - Ensure that the content is rigorous in education and suitable for the difficulty level
         """
-        
+
         messages = [
-            {"role": "system", "content": "You are a professional educational curriculum designer, creating structured and progressive learning paths. Your output must be valid JSON, strictly following the specified format. The URL should adopt the platform's basic + search query format."},
+            {"role": "system", "content": "You are a professional educational curriculum designer, outlining structured and progressive learning paths. Your output must be valid JSON, strictly following the specified format."},
             {"role": "user", "content": prompt}
         ]
-        
+
+        response = None
         try:
-            response = ai_agent._call_api(messages, response_format={"type": "json_object"})
+            response = ai_agent._call_api(
+                messages, response_format={"type": "json_object"}, feature="learning_path_outline", cache=cache
+            )
             if not response or not isinstance(response, str):
-                logger.warning(f"AI returned invalid response for learning path: {response}")
+                logger.warning(f"AI returned invalid response for learning path outline: {response}")
                 return None
-            
-            # Verify the URL format in the response
-            path_content = json.loads(response.strip())
-            if "topics" in path_content:
-                for topic in path_content["topics"]:
-                    if "resources" in topic:
-                        for resource in topic["resources"]:
-                            if "url" in resource:
-                                # Check whether the URL contains search query parameters
-                                if "search?" not in resource["url"] and "query=" not in resource["url"]:
-                                    logger.warning(f"URL {resource['url']} does not meet the required search format")
-            return path_content
+            outline = load_llm_json(response, "learning path outline")
         except json.JSONDecodeError as e:
-            logger.error(f"AI learning path JSON parsing failed: {e}, Response: {response[:200]}...")
+            logger.error(f"AI learning path outline JSON parsing failed: {e}, Response: {response[:200]}...")
             return None
         except Exception as e:
-            logger.error(f"AI learning path generation failed: {e}, Response: {str(response)[:200]}...")
+            logger.error(f"AI learning path outline generation failed: {e}, Response: {str(response)[:200]}...")
             return None
 
-    def update_viewed_resource(self, user_id, path_id, topic_name, resource_name, duration_minutes=0):
-        """Update the viewing status of learning resources (optimistic lock + short transaction)"""
-        try:
-            duration_minutes = max(0.0, float(duration_minutes))  # Ensure the duration is legal
-            max_retries = 3
-            retry_delay = 0.5
-
-            for attempt in range(max_retries):
-                # 1. First, query the current record (including the version number. You need to add the Version field to the learning_activities table first).
-                query = """
-                    SELECT id, content, total_minutes, version 
-                    FROM learning_activities 
-                    WHERE user_id = %s AND path_id = %s AND topic_name = %s
-                    LIMIT 1
-                """
-                result = self.data_manager.execute_query(query, (user_id, path_id, topic_name))
-
-                # 2. Prepare to update the data
-                if result:
-                    # The record exists: updated
-                    record = result[0]
-                    # Enhance the robustness of JSON parsing
-                    content_str = record.get('content', '{}')
-                    if not content_str or not isinstance(content_str, str):
-                        content_dict = {}
-                    else:
-                        try:
-                            content_dict = json.loads(content_str)
-                        except json.JSONDecodeError as e:
-                            logger.error(f"Content JSON parsing failed: {e}, Content: {content_str[:100]}...")
-                            content_dict = {}
-                    
-                    current_total = float(record['total_minutes'])
-                    current_version = record['version']
-
-                    # Update only when the resource is not marked (to avoid duplicate operations)
-                    if content_dict.get(resource_name) is None:
-                        content_dict[resource_name] = 1
-                        updated_content = json.dumps(content_dict)
-                        new_total = current_total + duration_minutes
-
-                        # 3. Intra-transaction update execution (with optimistic lock)
-                        try:
-                            row_count = self.data_manager.execute_query("""
-                                UPDATE learning_activities 
-                                SET content = %s, total_minutes = %s, activity_date = NOW(), version = version + 1
-                                WHERE id = %s AND version = %s
-                            """, (updated_content, new_total, record['id'], current_version))
-
-                            if row_count == 1:
-                                self.data_manager.commit_transaction()
-                                return {"status": "success"}
-                            else:
-                                # Version conflict, roll back and retry
-                                self.data_manager.rollback_transaction()
-                                if attempt < max_retries - 1:
-                                    time.sleep(retry_delay * (attempt + 1))
-                                    continue
-                                raise Exception("Version conflict, update failed")
-                        except Exception as e:
-                            self.data_manager.rollback_transaction()
-                            raise e
-                    else:
-                        # The resource has been marked and no update is required
-                        return {"status": "success", "message": "The resource has been marked."}
+        if not isinstance(outline, dict) or not isinstance(outline.get("topics"), list):
+            logger.warning("The AI learning path outline has no topics")
+            return None
+        topics = [
+            topic for topic in outline["topics"]
+            if isinstance(topic, dict) and isinstance(topic.get("name"), str) and topic["name"].strip()
+        ]
+        if not topics:
+            # Nothing usable survived (e.g. truncated before the first complete topic)
+            logger.warning("The AI learning path outline has no complete topics")
+            return None
+        for topic in topics:
+            topic["name"] = topic["name"].strip()
+            topic["description"] = topic.get("description") or f"Study {topic['name']} as part of {subject}."
+            try:
+                topic["duration_days"] = max(1, int(topic.get("duration_days")))
+            except (TypeError, ValueError):
+                topic["duration_days"] = max(1, target_days // len(topics))
 
-                else:
-                    # Record does not exist: Insert a new record
-                    initial_content = json.dumps({resource_name: 1})
-                    self.data_manager.execute_query("""
-                        INSERT INTO learning_activities 
-                        (user_id, path_id, topic_name, content, total_minutes, activity_date, version)  
-                        VALUES (%s, %s, %s, %s, %s, NOW(), 1)
-                    """, (user_id, path_id, topic_name, initial_content, duration_minutes))
-                    return {"status": "success"}
+        default = self._generate_default_learning_path(subject, difficulty, target_days)
+        milestones = [m for m in outline.get("milestones") or [] if isinstance(m, dict) and m.get("name")]
+        strategies = [s for s in outline.get("learning_strategies") or [] if isinstance(s, str) and s.strip()]
+        return {
+            "topics": topics,
+            "milestones": milestones or default["milestones"],
+            "learning_strategies": strategies or default["learning_strategies"],
+        }
 
-            return {"status": "error", "message": "Reach the maximum number of retries"}
+    def _expand_path_topic(self, subject, topic, index, topics, difficulty, learning_style, user_interests, ai_agent, cache=True):
+        """Phase 2 (one topic): its resources and practice exercises, validated; None when nothing usable came back"""
+        other_topics = ", ".join(t["name"] for i, t in enumerate(topics) if i != index) or "None"
+        prompt = f"""
+        Create the study material of one topic of a learning path:
+        - Theme：{subject}
+        - Topic：{topic['name']}
+        - Topic description：{topic['description']}
+        - Position in the path：{index + 1} of {len(topics)}
+        - Duration：{topic['duration_days']} days
+        - Difficulty level：{difficulty}
+        - Learning style：{learning_style}
+        - User interest：{user_interests}
+        - Other topics of the path (do not repeat their content)：{other_topics}
+
+        The material must be suitable for learners of {learning_style} and match the position of the topic in the path.
+
+        It should include the following components:
+        1.3-5 high-quality learning resources, including:
+        1)Descriptive title
+        2)Resource types (videos, articles, interactions, etc.)
+        3)A detailed description of content/value
+        4)Source/Platform name (e.g., Coursera, YouTube, Medium, Khan Academy)
+        5)The URL format is [Platform base URL] + search query related to the resource
+        6)Example：
+         https://www.coursera.org/search?query={subject}+fundamentals
+         https://www.youtube.com/results?search_query={subject}+tutorial
+         https://medium.com/search?q={subject}+advanced+techniques
+        2.2 to 3 practice questions, including:
+        1)Clear and challenging questions
+        2)Difficulty rating (matching the overall difficulty level)
+        3)Estimated completion time (minutes)
+        4)Detailed answer
+        5)A comprehensive explanation of the solution/concept
+
+        Format your response in a valid JSON format with the exact structure as follows:
+        {{
+            "resources": [
+                {{
+                    "title": "Resource Title",
+                    "type": "Resource type",
+                    "description": "Resource content description",
+                    "platform": "Platform name",
+                    "url": "https://platform.com/search?q={subject}+specific+terms"
+                }}
+            ],
+            "practice_exercises": [
+                {{
+                    "question": "Exercise text",
+                    "difficulty": "Difficulty level",
+                    "estimated_time_minutes": 25,
+                    "answer": "Complete answer text",
+                    "explanation": "A detailed explanation of the concept"
+                }}
+            ]
+        }}
+
+        Key requirements
+        - All urls must follow the platform base URL + search query format shown in the example
+        - Ensure that the content is rigorous in education and suitable for the difficulty level
+        """
+
+        messages = [
+            {"role": "system", "content": "You are a professional educational content curator, expanding one topic of a learning path into resources and practice questions. Your output must be valid JSON, strictly following the specified format. The URL should adopt the platform's basic + search query format."},
+            {"role": "user", "content": prompt}
+        ]
+
+        response = ai_agent._call_api(
+            messages, response_format={"type": "json_object"}, feature="learning_path_topic", cache=cache
+        )
+        if not response or not isinstance(response, str):
+            logger.warning(f"AI returned invalid response for the topic {topic['name']}: {response}")
+            return None
+        content = load_llm_json(response, f"learning path topic {topic['name']}")
+        if not isinstance(content, dict):
+            return None
+
+        resources = []
+        for resource in content.get("resources") or []:
+            if not isinstance(resource, dict) or not resource.get("title") or not resource.get("url"):
+                continue
+            # Check whether the URL contains search query parameters
+            if "search?" not in resource["url"] and "query=" not in resource["url"]:
+                logger.warning(f"URL {resource['url']} does not meet the required search format")
+            resources.append(resource)
+        exercises = []
+        for exercise in content.get("practice_exercises") or []:
+            if not isinstance(exercise, dict) or not exercise.get("question"):
+                continue
+            exercise.setdefault("difficulty", difficulty)
+            exercises.append(exercise)
+        if not resources and not exercises:
+            return None
+        return {"resources": resources, "practice_exercises": exercises}
+
+    def _default_topic_content(self, subject, topic_name, difficulty):
+        """Default resources and exercises of one topic, for a topic whose expansion failed"""
+        query = "+".join(f"{subject} {topic_name}".split())
+        return {
+            "resources": [
+                {
+                    "title": f"{topic_name}: a beginner's guide",
+                    "type": "Article",
+                    "description": f"An introduction to {topic_name} in {subject}",
+                    "platform": "Learning platform",
+                    "url": f"https://example.com/search?q={query}"
+                }
+            ],
+            "practice_exercises": [
+                {
+                    "question": f"Explain the key ideas of {topic_name}",
+                    "difficulty": difficulty,
+                    "estimated_time_minutes": 20,
+                    "answer": f"The key ideas of {topic_name} include...",
+                    "explanation": f"This question assesses the understanding of {topic_name} within {subject}..."
+                }
+            ]
+        }
+
+    @classmethod
+    def _get_topic_executor(cls):
+        with cls._topic_lock:
+            if cls._topic_executor is None:
+                cls._topic_executor = ThreadPoolExecutor(
+                    max_workers=cls.PATH_TOPIC_WORKERS, thread_name_prefix="path_topic"
+                )
+            return cls._topic_executor
+
+    @invalidates_reads
+    def update_viewed_resource(self, user_id, path_id, topic_name, resource_name, duration_minutes=0):
+        """Update the viewing status of learning resources (one server-side upsert, no read-modify-write)"""
+        try:
+            duration_minutes = round(max(0.0, float(duration_minutes)), 2)  # Ensure the duration is legal
+
+            # 1. Insert the activity row, or merge the resource flag into it; minutes are only added the first time
+            statements = [self.data_manager.upsert_statement(
+                'learning_activities',
+                {'user_id': user_id, 'path_id': path_id, 'topic_name': topic_name,
+                 'content': json.dumps({resource_name: 1}), 'total_minutes': duration_minutes},
+                increment_columns=['total_minutes'],
+                json_merge_columns=['content'],
+                condition="JSON_EXTRACT(content, %s) IS NULL",
+                condition_params=(self.data_manager.json_path_key(resource_name),),
+                touch='activity_date'
+            ) + (True,)]
+            if duration_minutes > 0:
+                statements.append((StudyTimeAccumulator.TOTALS_QUERY, (user_id, duration_minutes)))
+
+            # 2. One round trip; if the resource was already marked the whole group is rolled back
+            row_counts = self.data_manager.execute_atomic(statements)
+            if row_counts is False:
+                return {"status": "error", "message": "Failed to update the viewing status of the resource"}
+            if row_counts[0] == 0:
+                return {"status": "success", "message": "The resource has been marked."}
+            return {"status": "success"}
 
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON parsing failed：{str(e)}")
-            return {"status": "error", "message": "Data format error"}
         except Exception as e:
             logger.error(f"Failed to update the viewing status of the resource：{str(e)}")
             return {"status": "error", "message": str(e)}
     
+    @memoized_read
     def check_resource_viewed(self, user_id, path_id, topic_name, resource_name):
         """Check whether the viewing status of the specified resource is 1 (watched)"""
         try:
@@ -480,66 +949,105 @@ class MockLearningEngine:
             logger.error(f"Failed to query the viewing status of the resource：{str(e)}")
             return False
 
+    @memoized_read
+    def get_path_progress_snapshot(self, user_id, path_id):
+        """
+        Load all progress inputs of a path in bulk (at most two queries) instead of one query per resource/topic
+        Return: {"viewed": {(topic_name, resource_name), ...}, "scores": {topic_name: score%}, "assessments": {topic_name: content}}
+        """
+        snapshot = {"viewed": set(), "scores": {}, "assessments": {}}
+        try:
+            # 1. All learning activity records of this path (one row per topic is the norm; keep the first like check_resource_viewed)
+            activities = self.data_manager.execute_query('''
+                SELECT topic_name, content FROM learning_activities
+                WHERE user_id = %s AND path_id = %s
+                ORDER BY id
+            ''', (user_id, path_id)) or []
+
+            seen_topics = set()
+            for activity in activities:
+                topic_name = activity.get('topic_name')
+                if topic_name in seen_topics:
+                    continue
+                seen_topics.add(topic_name)
+
+                content_str = activity.get('content')
+                if not content_str or not isinstance(content_str, str):
+                    continue
+                try:
+                    inner_content = json.loads(content_str)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Content JSON parsing failed: {e}, Content: {content_str[:100]}...")
+                    continue
+                if not isinstance(inner_content, dict):
+                    continue
+                for resource_name, status in inner_content.items():
+                    if status == 1:
+                        snapshot["viewed"].add((topic_name, resource_name))
+
+            # 2. All assessment records of the path's subject (assessments are keyed by subject + topic, not by path)
+            assessments = self.data_manager.execute_query('''
+                SELECT a.topic_name, a.content FROM assessments a
+                JOIN learning_paths p ON p.user_id = a.user_id AND p.subject = a.subject
+                WHERE p.id = %s AND a.user_id = %s
+                ORDER BY a.id
+            ''', (path_id, user_id)) or []
+
+            for assessment in assessments:
+                topic_name = assessment.get('topic_name')
+                if topic_name in snapshot["assessments"]:
+                    continue
+                content_str = assessment.get('content')
+                if not content_str or not isinstance(content_str, str):
+                    continue
+                try:
+                    content = json.loads(content_str)
+                except json.JSONDecodeError as e:
+                    logger.error(f"Assessment content JSON parsing failed: {e}, Content: {content_str[:100]}...")
+                    continue
+                valid_scores = [s for s in content.get('scores', []) if isinstance(s, (int, float))]
+                snapshot["assessments"][topic_name] = content
+                snapshot["scores"][topic_name] = (sum(valid_scores)/len(valid_scores)*100) if valid_scores else 0.0
+
+            return snapshot
+        except Exception as e:
+            logger.error(f"Failed to load the path progress snapshot：{str(e)}")
+            return snapshot
+
+    @invalidates_reads
     def update_learning_progress(self, path_id, user_id, new_progress):
-        """Update the learning progress (optimistic locking + retry, solve lock waiting)"""
+        """Update the learning progress (a single atomic UPDATE, the server bumps the version)"""
         try:
             # 1. Ensure that the progress is within the legal range (0-1)
             new_progress = max(0.0, min(1.0, new_progress))
-            max_retries = 3  # Retry up to 3 times (for occasional conflicts)
-            retry_delay = 0.5  # Retry interval (seconds)
 
-            for attempt in range(max_retries):
-                # 2. Query the current version number outside the transaction (unlocked to avoid resource occupation)
-                path_data = self.data_manager.execute_query('''
-                    SELECT version FROM learning_paths 
-                    WHERE id = %s AND user_id = %s
-                ''', (path_id, user_id))
-            
-                if not path_data:
-                    logger.warning(f"path {path_id} It doesn't exist. Progress cannot be updated")
-                    return 0
-            
-                current_version = path_data[0]['version']  #Get the current version
-
-                # 3. Only updates are performed within the transaction (minimizing lock holding time)
-                try:
-                    # The core of optimistic locking: The WHERE condition contains version, and only updates the records that have not been modified
-                    row_count = self.data_manager.execute_query('''
-                        UPDATE learning_paths 
-                        SET progress = %s, last_updated = NOW(), version = version + 1  -- The version number is incremented
-                        WHERE id = %s AND user_id = %s AND version = %s  -- Update only when the version matches
-                    ''', (new_progress, path_id, user_id, current_version))
-
-                    if row_count == 1:
-                        # The update was successful. Commit the transaction
-                        self.data_manager.commit_transaction()
-                        logger.info(f"path {path_id} Progress update successful（version：{current_version}→{current_version+1}）")
-                        return row_count
-                    elif row_count == 0:
-                        # Version mismatch. Roll back and try again
-                        self.data_manager.rollback_transaction()
-                        if attempt < max_retries - 1:
-                            time.sleep(retry_delay * (attempt + 1))  # Exponential retreat waiting
-                            logger.warning(f"path {path_id} Version conflict，Try again the {attempt+1} th time")
-                            continue
-                        else:
-                            logger.error(f"path {path_id} version conflict，the maximum number of retries has been reached.")
-                            return 0
+            # 2. Write it in one statement: no version read, no conflict window
+            row_count = self.data_manager.update_fields(
+                'learning_paths',
+                {'progress': new_progress},
+                where={'id': path_id, 'user_id': user_id},
+                touch='last_updated'
+            )
+            if row_count is False:
+                logger.error(f"path {path_id} progress update failed")
+                return 0
+            if row_count == 0:
+                logger.warning(f"path {path_id} It doesn't exist. Progress cannot be updated")
+                return 0
 
-                except Exception as e:
-                    # For other errors, roll back the transaction
-                    self.data_manager.rollback_transaction()
-                    logger.error(f"The progress update transaction failed：{str(e)}")
-                    return 0
+            self.data_manager.invalidate_learning_paths(user_id)
+            logger.info(f"path {path_id} Progress update successful")
+            return row_count
 
         except Exception as e:
             logger.error(f"There are always errors in updating the learning progress：{str(e)}")
             return 0
     
+    @invalidates_reads
     def add_topic_questions(self, path_id, paths, topic_name, questions, user_id):
-        """Add topic questions to the learning path (delete full deletion + optimistic lock, solve lock waiting)"""
+        """Add topic questions to the learning path (JSON_SET on the topic, guarded by its name)"""
         try:
-            # 1. Out-of-transaction preprocessing: Find the target path and modify the content (lock-free operation)
+            # 1. Find the target path and the position of the topic in its content
             target_path = None
             for path in paths:
                 if 'id' in path and path['id'] == path_id:
@@ -549,75 +1057,62 @@ class MockLearningEngine:
                 logger.warning(f"Target path {path_id} doesn't exist")
                 return 0
 
-            # Parse and modify the content (place time-consuming operations outside the transaction)
-            content_str = target_path.get('content', '{}')
-            if not content_str or not isinstance(content_str, str):
-                logger.error(f"Invalid content format for path {path_id}")
+            topic_index = self._find_topic_index(target_path.get('content', '{}'), path_id, topic_name)
+            if topic_index is None:
                 return 0
-            
-            try:
-                content_dict = json.loads(content_str)
-            except json.JSONDecodeError as e:
-                logger.error(f"Path content JSON parsing failed: {e}, Content: {content_str[:100]}...")
-                return 0
-            
-            topics = content_dict.get('topics', [])
-            topic_found = False
-            for topic in topics:
-                if topic.get('name') == topic_name:
-                    topic['questions'] = questions
-                    topic_found = True
-                    break
-            if not topic_found:
-                logger.warning(f"path {path_id}, the topic was not found in the text, {topic_name}")
-                return 0
-            updated_content = json.dumps(content_dict)  # Serialization in advance reduces transaction time
-
-            # 2. Optimistic lock update: Only update the target path
-            max_retries = 3
-            retry_delay = 0.5
-            for attempt in range(max_retries):
-                # Query the current version of the target path outside the transaction
-                path_data = self.data_manager.execute_query('''
-                    SELECT version FROM learning_paths 
-                    WHERE id = %s AND user_id = %s
-                ''', (path_id, user_id))
-                if not path_data:
-                    logger.error(f"path {path_id} Version query failed")
-                    return 0
-                current_version = path_data[0]['version']
 
-                try:
-                    row_count = self.data_manager.execute_query('''
-                        UPDATE learning_paths 
-                        SET content = %s, last_updated = NOW(), version = version + 1  -- Version increment
-                        WHERE id = %s AND user_id = %s AND version = %s  -- Update only when the version matches
-                    ''', (updated_content, path_id, user_id, current_version))
-
-                    if row_count == 1:
-                        self.data_manager.commit_transaction()
-                        logger.info(f"path {path_id} ,the topic question has been added successfully（version：{current_version}→{current_version+1}）")
-                        return row_count
-                    elif row_count == 0:
-                        # Version conflict, roll back and retry
-                        self.data_manager.rollback_transaction()
-                        if attempt < max_retries - 1:
-                            time.sleep(retry_delay * (attempt + 1))
-                            logger.warning(f"path {path_id} version conflict，retry {attempt+1} times")
-                            continue
-                        else:
-                            logger.error(f"path {path_id} version conflict，the maximum number of retries has been reached")
-                            return 0
+            # 2. Set only $.topics[i].questions on the server. The guard makes sure the topic at that index is still
+            # the expected one; if the content changed underneath us, re-read the index once and write again
+            for attempt in range(2):
+                row_count = self.data_manager.json_set(
+                    'learning_paths', 'content',
+                    {f"$.topics[{topic_index}].questions": questions},
+                    where={'id': path_id, 'user_id': user_id},
+                    condition="JSON_UNQUOTE(JSON_EXTRACT(content, %s)) = %s",
+                    condition_params=(f"$.topics[{topic_index}].name", topic_name),
+                    touch='last_updated'
+                )
+                if row_count is False:
+                    logger.error(f"The transaction to add the topic issue failed for path {path_id}")
+                    return 0
+                if row_count:
+                    self.data_manager.invalidate_learning_paths(user_id)
+                    logger.info(f"path {path_id} ,the topic question has been added successfully")
+                    return row_count
 
-                except Exception as e:
-                    self.data_manager.rollback_transaction()
-                    logger.error(f"The transaction to add the topic issue failed：{str(e)}")
+                latest = self.data_manager.execute_query(
+                    "SELECT content FROM learning_paths WHERE id = %s AND user_id = %s", (path_id, user_id)
+                )
+                if not latest or attempt > 0:
+                    break
+                topic_index = self._find_topic_index(latest[0].get('content'), path_id, topic_name)
+                if topic_index is None:
                     return 0
 
+            logger.error(f"path {path_id}, the topic {topic_name} could not be updated")
+            return 0
+
         except Exception as e:
             logger.error(f"There are always errors in adding topic questions：{str(e)}")
             return 0
+
+    def _find_topic_index(self, content_str, path_id, topic_name):
+        """Position of a topic inside the path content JSON, or None"""
+        if not content_str or not isinstance(content_str, str):
+            logger.error(f"Invalid content format for path {path_id}")
+            return None
+        try:
+            content_dict = json.loads(content_str)
+        except json.JSONDecodeError as e:
+            logger.error(f"Path content JSON parsing failed: {e}, Content: {content_str[:100]}...")
+            return None
+        for index, topic in enumerate(content_dict.get('topics', [])):
+            if topic.get('name') == topic_name:
+                return index
+        logger.warning(f"path {path_id}, the topic was not found in the text, {topic_name}")
+        return None
                
+    @memoized_read
     def get_assessments_by_topic(self, user_id, subject, topic):
         """Query assessment records based on user ID, subject and topic"""
         try:
@@ -631,6 +1126,7 @@ class MockLearningEngine:
             logger.error(f"Failed to obtain the topic evaluation record：{str(e)}")
             return None
     
+    @invalidates_reads
     def insert_assessment_from_state(self, user_id, subject, topic, current_state):
         """Insert the evaluation results from the front-end status data"""
         if not current_state.get('submitted'):
@@ -642,22 +1138,15 @@ class MockLearningEngine:
                 logger.error(f"Invalid current_state format: {type(current_state)}")
                 return {"status": "error", "message": "Invalid assessment data format"}
             
-            existing_records = self.data_manager.execute_query('''
-                SELECT id FROM assessments 
-                WHERE user_id = %s AND subject = %s AND topic_name = %s
-            ''', (user_id, subject, topic))
-            if existing_records:  
-                self.data_manager.execute_query('''
-                    DELETE FROM assessments 
-                    WHERE user_id = %s AND subject = %s AND topic_name = %s
-                ''', (user_id, subject, topic))
-
-            assessment_id = self.data_manager.execute_query('''
-                INSERT INTO assessments  
-                (user_id, subject, topic_name, content, taken_at)  
-                VALUES (%s, %s, %s, %s, NOW())
-            ''', (user_id, subject, topic, json.dumps(current_state)))
-            
+            # One upsert on (user_id, subject, topic_name); an unchanged state is skipped without writing
+            assessment_id = self.data_manager.upsert_content(
+                'assessments',
+                {'user_id': user_id, 'subject': subject, 'topic_name': topic},
+                current_state,
+                touch='taken_at'
+            )
+            if assessment_id is False:
+                return {"status": "error", "message": "The evaluation result could not be saved"}
             return {"status": "success", "id": assessment_id}
             
         except json.JSONDecodeError as e:
@@ -667,6 +1156,7 @@ class MockLearningEngine:
             logger.error(f"The insertion of the evaluation result failed: {str(e)}")
             return {"status": "error", "message": str(e)}
     
+    @invalidates_reads
     def insert_plan_from_json(self, user_id, path_id, study_schedules):
         """Insert the study plan into the database"""
         try:
@@ -675,24 +1165,16 @@ class MockLearningEngine:
                 logger.error(f"Invalid study_schedules format: {type(study_schedules)}")
                 return {"status": "error", "message": "Invalid study plan format"}
             
-            existing = self.data_manager.execute_query('''
-                SELECT 1 FROM study_schedules 
-                WHERE user_id = %s AND path_id = %s
-                LIMIT 1
-            ''', (user_id, path_id))
-            
-            if existing:  
-                self.data_manager.execute_query('''
-                    DELETE FROM study_schedules 
-                    WHERE user_id = %s AND path_id = %s
-                ''', (user_id, path_id))
-            
-            schedule_id = self.data_manager.execute_query('''
-                    INSERT INTO study_schedules 
-                    (user_id, path_id, schedule_json, created_at)
-                    VALUES (%s, %s, %s, NOW())
-                ''', (user_id, path_id, json.dumps(study_schedules)))
-            
+            # One upsert on (user_id, path_id); saving the same plan again is skipped without writing
+            schedule_id = self.data_manager.upsert_content(
+                'study_schedules',
+                {'user_id': user_id, 'path_id': path_id},
+                study_schedules,
+                content_column='schedule_json',
+                touch='created_at'
+            )
+            if schedule_id is False:
+                return {"status": "error", "message": "The study plan could not be saved"}
             return {"status": "success", "id": schedule_id}
         except json.JSONDecodeError as e:
             logger.error(f"Study_schedules JSON serialization failed: {e}, Data: {str(study_schedules)[:100]}...")
@@ -701,6 +1183,35 @@ class MockLearningEngine:
             logger.error(f"The insertion of the study plan failed: {str(e)}")
             return {"status": "error", "message": str(e)}
     
+    @invalidates_reads
+    def delete_topic_assessments(self, user_id, topic_name):
+        """Delete the saved assessments of a topic (in every subject)"""
+        try:
+            result = self.data_manager.execute_query(
+                "DELETE FROM assessments WHERE user_id = %s AND topic_name = %s",
+                (user_id, topic_name)
+            )
+            return result
+        except Exception as e:
+            logger.error(f"Failed to delete the topic assessments: {str(e)}")
+            return False
+
+    @invalidates_reads
+    def delete_plan(self, user_id, path_id=None, plan_id=None):
+        """Delete a saved study plan by path (or by plan id)"""
+        try:
+            if plan_id is not None:
+                return self.data_manager.execute_query(
+                    "DELETE FROM study_schedules WHERE id = %s AND user_id = %s", (plan_id, user_id)
+                )
+            return self.data_manager.execute_query(
+                "DELETE FROM study_schedules WHERE user_id = %s AND path_id = %s", (user_id, path_id)
+            )
+        except Exception as e:
+            logger.error(f"Failed to delete the study plan: {str(e)}")
+            return False
+
+    @memoized_read
     def get_plan(self, user_id, path_id):
         """Obtain the user's study plan"""
         try:
@@ -715,6 +1226,7 @@ class MockLearningEngine:
             return None
 
     # Real-time timing method
+    @invalidates_reads
     def init_study_timer(self, user_id, path_id, topic_name):
         """
         Initialization timing (called when the web page is opened) : Create a learning activity record of the current user - path - topic
@@ -750,83 +1262,92 @@ class MockLearningEngine:
             logger.error(f"The initialization timing failed：{str(e)}")
             return {"status": "error", "message": str(e)}
 
+    @invalidates_reads
     def update_study_timer(self, user_id, path_id, topic_name, add_minutes):
-        """Real-time update timing (supplement optimistic locking to avoid multi-connection conflicts)"""
+        """Real-time update timing (activity row and per-user total are incremented in one transaction)"""
         try:
             add_minutes = round(float(add_minutes), 2)
             if add_minutes < 0.01:
                 return {"status": "error", "message": "The newly added duration must be greater than 0.01 minutes"}
-        
-            max_retries = 3
-            retry_delay = 0.5
-            for attempt in range(max_retries):
-                # 1. Query the current record (including version number)
-                query = """
-                    SELECT id, total_minutes, version 
-                    FROM learning_activities 
-                    WHERE user_id = %s AND path_id = %s AND topic_name = %s
-                    LIMIT 1
-                """
-                result = self.data_manager.execute_query(query, (user_id, path_id, topic_name))
-                if not result:
-                    init_result = self.init_study_timer(user_id, path_id, topic_name)
-                    if init_result["status"] != "success":
-                        return init_result
-                    # Re-query the initialized record
-                    result = self.data_manager.execute_query(query, (user_id, path_id, topic_name))
-                    if not result:
-                        return {"status": "error", "message": "There is still no record after initializing the timing"}
-            
-                record = result[0]
-                new_total = float(record['total_minutes']) + add_minutes
-                current_version = record['version']
-
-                try:
-                    row_count = self.data_manager.execute_query("""
-                        UPDATE learning_activities 
-                        SET total_minutes = %s, activity_date = NOW(), version = version + 1
-                        WHERE id = %s AND version = %s
-                    """, (new_total, record['id'], current_version))
-
-                    if row_count == 1:
-                        self.data_manager.commit_transaction()
-                        total_time = self.get_total_study_time(user_id)
-                        return {"status": "success", "total_study_time": round(total_time, 2)}
-                    else:
-                        self.data_manager.rollback_transaction()
-                        if attempt < max_retries - 1:
-                            time.sleep(retry_delay * (attempt + 1))
-                            continue
-                        raise Exception("Version conflict, update duration failed")
-                except Exception as e:
-                    self.data_manager.rollback_transaction()
-                    raise e
+            if path_id is None:
+                return {"status": "error", "message": "Study time can only be recorded for a learning path"}
+
+            # 1. Increment the activity row and the user's total together, so they never drift apart
+            result = self.data_manager.execute_atomic([
+                self.data_manager.upsert_statement(
+                    'learning_activities',
+                    {'user_id': user_id, 'path_id': path_id, 'topic_name': topic_name,
+                     'content': json.dumps({"status": "auto_timer"}), 'total_minutes': add_minutes},
+                    increment_columns=['total_minutes'],
+                    touch='activity_date'
+                ),
+                self.data_manager.upsert_statement(
+                    'user_study_totals',
+                    {'user_id': user_id, 'total_minutes': add_minutes},
+                    increment_columns=['total_minutes']
+                )
+            ])
+            if result is False:
+                return {"status": "error", "message": "Failed to update the timing"}
 
-            return {"status": "error", "message": "Reach the maximum number of retries"}
+            # 2. Return the new total (a primary-key read)
+            total_time = self.get_total_study_time(user_id)
+            return {"status": "success", "total_study_time": round(total_time, 2)}
         except Exception as e:
             logger.error(f"Failed to update the timing：{str(e)}")
             return {"status": "error", "message": str(e)}
 
+    @invalidates_reads
+    def record_study_time(self, user_id, path_id, topic_name, add_minutes):
+        """Record a study-time heartbeat (write-behind: buffered in memory and flushed in batches)"""
+        try:
+            add_minutes = round(float(add_minutes), 2)
+            if add_minutes < 0.01:
+                return {"status": "error", "message": "The newly added duration must be greater than 0.01 minutes"}
+
+            if not study_time_accumulator.add(user_id, path_id, topic_name, add_minutes):
+                return {"status": "error", "message": "Study time can only be recorded for a learning path"}
+            return {"status": "success", "total_study_time": round(self.get_total_study_time(user_id), 2)}
+        except Exception as e:
+            logger.error(f"Failed to record the study time：{str(e)}")
+            return {"status": "error", "message": str(e)}
+
+    def get_write_stats(self):
+        """Counters of the atomic write primitives used by the engine"""
+        return self.data_manager.get_write_stats()
+
+    @invalidates_reads
+    def flush_study_time(self, user_id=None):
+        """Write the buffered study time of a user (or of everyone) to the database now"""
+        try:
+            return study_time_accumulator.flush(user_id)
+        except Exception as e:
+            logger.error(f"Failed to flush the study time：{str(e)}")
+            return 0
+
+    @memoized_read
     def get_total_study_time(self, user_id):
         """
-        Obtain the total learning duration of the user (for real-time display) : Calculate the total total_minutes of all learning activities of this user
+        Obtain the total learning duration of the user (for real-time display) : a primary-key lookup of the incrementally maintained total
         Return: Total duration (unit: minutes)
         """
         try:
             query = """
-                SELECT COALESCE(SUM(total_minutes), 0) AS total 
-                FROM learning_activities 
+                SELECT total_minutes AS total
+                FROM user_study_totals
                 WHERE user_id = %s
             """
             result = self.data_manager.execute_query(query, (user_id,))
-            # Make sure to return a floating-point number
-            return float(result[0]["total"]) if result else 0.0
+            # Make sure to return a floating-point number (including minutes still buffered by the write-behind timer)
+            total = float(result[0]["total"]) if result else 0.0
+            return total + study_time_accumulator.pending_minutes(user_id)
         
         except Exception as e:
             logger.error(f"Failed to query the total duration：{str(e)}")
             return 0.0
 
     # Learn to analyze statistical logic
+    @memoized_read
     def get_learning_analytics(self, user_id, completed_paths):
         """Obtain user learning analysis data"""
         try:
@@ -891,18 +1412,113 @@ class MockLearningEngine:
             logger.error(f"Failed to obtain the learning analysis data：{str(e)}")
             return {"status": "error", "message": str(e)}
 
+job_queue.register("learning_path", lambda job: MockLearningEngine()._run_learning_path_job(job))
+
+
 class MockAssessmentManager:
     """Evaluation management category, handling the generation of practice questions and the assessment of answers"""
     import re  
+    # Gradings of all sessions share one bounded pool; each user may only occupy a few of its workers
+    GRADING_MAX_WORKERS = int(os.environ.get("GRADING_MAX_WORKERS", 8))
+    GRADING_PER_USER_LIMIT = int(os.environ.get("GRADING_PER_USER_LIMIT", 4))
+    _grading_executor = None
+    _user_slots = {}  # user_id -> [semaphore, holders + waiters]; dropped once the user has none
+    _grading_lock = threading.Lock()
+    # Practice questions are generated in concurrent chunks of a few questions, each chunk with its own focus
+    EXERCISE_CHUNK_SIZE = int(os.environ.get("EXERCISE_CHUNK_SIZE", 3))
+    EXERCISE_CHUNK_RETRIES = int(os.environ.get("EXERCISE_CHUNK_RETRIES", 1))
+    EXERCISE_MAX_WORKERS = int(os.environ.get("EXERCISE_MAX_WORKERS", 8))
+    EXERCISE_FOCUSES = [
+        "core definitions and concepts",
+        "applying the concepts to concrete situations",
+        "common mistakes and misconceptions",
+        "comparisons and trade-offs",
+        "analysis of worked examples",
+        "edge cases and limitations",
+    ]
+    DUPLICATE_SIMILARITY = 0.8  # Questions whose word sets overlap this much are near-duplicates
+    _exercise_executor = None
+
+    def generate_practice_exercises(self, subject, topic, difficulty_level, ai_agent, num_exercises=3, feature="practice_exercises"):
+        """
+        Generate practice questions based on the learning topic: concurrent chunks of a few questions each, merged
+        with near-duplicates removed. Only the shortfall (failed chunks, dropped duplicates) is requested again
+        feature tags the LLM calls (practice_exercises_refill queues background pool refills behind interactive calls)
+        """
+        exercises = []
+        seen = []  # Word sets of the accepted questions
+        batch = 0
+        for _ in range(1 + self.EXERCISE_CHUNK_RETRIES):
+            missing = num_exercises - len(exercises)
+            if missing <= 0:
+                break
+            # 1. One chunk per few missing questions, each with its own focus so that parallel chunks differ
+            chunks = []
+            for size in self._chunk_sizes(missing):
+                chunks.append((size, self.EXERCISE_FOCUSES[batch % len(self.EXERCISE_FOCUSES)]))
+                batch += 1
+            avoid = [exercise["question"] for exercise in exercises]
+            results = self._run_exercise_chunks(subject, topic, difficulty_level, ai_agent, chunks, avoid, feature)
+
+            # 2. Merge in chunk order, dropping questions too close to one already accepted
+            for chunk in results:
+                for exercise in chunk or []:
+                    if len(exercises) >= num_exercises:
+                        break
+                    words = self._question_words(exercise["question"])
+                    if any(self._similarity(words, other) >= self.DUPLICATE_SIMILARITY for other in seen):
+                        logger.info(f"Dropped a near-duplicate practice question: {exercise['question'][:80]}")
+                        continue
+                    seen.append(words)
+                    exercises.append(exercise)
+
+        if exercises:
+            if len(exercises) < num_exercises:
+                logger.warning(f"Only {len(exercises)} of {num_exercises} practice questions could be generated")
+            return {"status": "success", "exercises": exercises}
+
+        # Return the default practice questions when every chunk failed (to avoid function crash)
+        default_exercises = self._get_default_exercises(subject, topic, difficulty_level, num_exercises)
+        return {"status": "success", "exercises": default_exercises, "message": "Used default exercises due to AI response error"}
+
+    def _chunk_sizes(self, count):
+        """Split count questions into near-equal chunks of at most EXERCISE_CHUNK_SIZE (10 -> 3, 3, 2, 2)"""
+        chunks = -(-count // max(1, self.EXERCISE_CHUNK_SIZE))
+        size, extra = divmod(count, chunks)
+        return [size + 1] * extra + [size] * (chunks - extra)
+
+    def _run_exercise_chunks(self, subject, topic, difficulty_level, ai_agent, chunks, avoid, feature="practice_exercises"):
+        """The exercises of every (size, focus) chunk, in order; None for a chunk that failed"""
+        def run(index, size, focus):
+            try:
+                return self._generate_exercise_chunk(
+                    subject, topic, difficulty_level, ai_agent, size, focus, index + 1, len(chunks), avoid, feature
+                )
+            except Exception as e:
+                logger.error(f"Practice question chunk {index + 1}/{len(chunks)} failed: {str(e)}")
+                return None
+
+        if len(chunks) == 1:
+            return [run(0, *chunks[0])]
+        executor = self._get_exercise_executor()
+        futures = [executor.submit(run, index, size, focus) for index, (size, focus) in enumerate(chunks)]
+        return [future.result() for future in futures]
 
-    def generate_practice_exercises(self, subject, topic, difficulty_level, ai_agent, num_exercises=3):
-        """Generate practice questions based on the learning topic (with JSON error tolerance)"""
+    def _generate_exercise_chunk(self, subject, topic, difficulty_level, ai_agent, num_exercises, focus, batch, batches, avoid,
+                                 feature="practice_exercises"):
+        """One chunk of validated practice questions (with JSON error tolerance); raises when nothing usable came back"""
+        avoid_text = "\n".join(f"        - {question}" for question in avoid[-20:]) or "        - None"
         prompt = f"""
         You are an education expert and need to create random practice questions (in English) for the following learning topics.：
         Subject: {subject}
         Theme: {topic}
         Difficulty: {difficulty_level}
         The number of questions: {num_exercises}
+        Focus: {focus}
+
+        This is batch {batch} of {batches} of one assessment; the other batches are written at the same time with other focuses, so keep to this focus.
+        Do not repeat or paraphrase these questions, which the assessment already contains:
+{avoid_text}
 
         Requirement
         1.Each generated question must be different from the previous result to avoid repetitive questions or similar options.
@@ -933,68 +1549,89 @@ class MockAssessmentManager:
             {"role": "user", "content": prompt}
         ]
 
-        def fix_common_json_errors(json_str):
-            """Fix common JSON syntax errors"""
-            json_str = re.sub(r'//.*?$', '', json_str, flags=re.MULTILINE)
-            # Remove the redundant trailing commas
-            json_str = re.sub(r',\s*}', '}', json_str)
-            json_str = re.sub(r',\s*]', ']', json_str)
-            # Fix the unclosed double quotation marks
-            quote_count = json_str.count('"')
-            if quote_count % 2 != 0:
-                json_str = json_str.rstrip().rstrip('"') + '"'
-            # Replace Chinese parentheses with English parentheses
-            json_str = json_str.replace('（', '(').replace('）', ')')
-            return json_str
+        response = ai_agent._call_api(messages, response_format={"type": "json_object"}, feature=feature)
+        if not response or not isinstance(response, str):
+            logger.warning(f"AI returned invalid response for practice exercises: {response}")
+            raise ValueError("Invalid AI response format")
+
+        # Parse (and repair / salvage) the JSON in one pass
+        data = load_llm_json(response, "practice exercises")
+        if not isinstance(data, dict):
+            raise ValueError("The response is not a JSON object")
+
+        # Verify the structure and supplement the missing fields
+        if "exercises" not in data or not isinstance(data["exercises"], list):
+            logger.warning(f"AI response missing 'exercises' field: {data}")
+            raise ValueError("Missing exercises field")
+
+        # Make sure that each exercise field is complete
+        valid_exercises = []
+        for exercise in data["exercises"]:
+            required_fields = ["question", "type", "options", "correct_option", "explanation", "difficulty", "estimated_time_minutes"]
+            if isinstance(exercise, dict) and all(field in exercise for field in required_fields):
+                # Make sure the number of options is 4
+                if len(exercise["options"]) < 4:
+                    exercise["options"] += [f"Option {i+1}" for i in range(len(exercise["options"]), 4)]
+                elif len(exercise["options"]) > 4:
+                    exercise["options"] = exercise["options"][:4]
+                # Ensure that the correct option index is legal
+                exercise["correct_option"] = max(0, min(3, int(exercise["correct_option"])))
+                valid_exercises.append(exercise)
+
+        if not valid_exercises:
+            logger.warning("No valid exercises found after validation")
+            raise ValueError("No valid exercises")
+        return valid_exercises[:num_exercises]
 
-        try:
-            response = ai_agent._call_api(messages, response_format={"type": "json_object"})
-            if not response or not isinstance(response, str):
-                logger.warning(f"AI returned invalid response for practice exercises: {response}")
-                raise ValueError("Invalid AI response format")
-            
-            # Clean up and fix the response
-            clean_response = response.strip().strip('`').strip('json').strip()
-            fixed_response = fix_common_json_errors(clean_response)
-            
-            # Try to parse the repaired JSON
-            data = json.loads(fixed_response)
-            
-            # Verify the structure and supplement the missing fields
-            if "exercises" not in data or not isinstance(data["exercises"], list):
-                logger.warning(f"AI response missing 'exercises' field: {data}")
-                raise ValueError("Missing exercises field")
-            
-            # Make sure that each exercise field is complete
-            valid_exercises = []
-            for exercise in data["exercises"]:
-                required_fields = ["question", "type", "options", "correct_option", "explanation", "difficulty", "estimated_time_minutes"]
-                if all(field in exercise for field in required_fields):
-                    # Make sure the number of options is 4
-                    if len(exercise["options"]) < 4:
-                        exercise["options"] += [f"Option {i+1}" for i in range(len(exercise["options"]), 4)]
-                    elif len(exercise["options"]) > 4:
-                        exercise["options"] = exercise["options"][:4]
-                    # Ensure that the correct option index is legal
-                    exercise["correct_option"] = max(0, min(3, int(exercise["correct_option"])))
-                    valid_exercises.append(exercise)
-            
-            if not valid_exercises:
-                logger.warning("No valid exercises found after validation")
-                raise ValueError("No valid exercises")
-            
-            return {"status": "success", "exercises": valid_exercises[:num_exercises]}
-        
-        except json.JSONDecodeError as e:
-            logger.error(f"Practice questions JSON parsing failed (after fix): {e}, Response: {fixed_response[:300]}...")
-        except ValueError as e:
-            logger.error(f"Exercise validation failed: {e}")
-        except Exception as e:
-            logger.error(f"Failed to generate the practice questions: {str(e)}")
-        
-        # Return the default practice questions when parsing fails (to avoid function crash)
-        default_exercises = self._get_default_exercises(subject, topic, difficulty_level, num_exercises)
-        return {"status": "success", "exercises": default_exercises, "message": "Used default exercises due to AI response error"}
+    @staticmethod
+    def _question_words(question):
+        return set(re.findall(r"\w+", str(question).lower()))
+
+    @staticmethod
+    def _similarity(words, other):
+        """Jaccard similarity of two questions' word sets"""
+        if not words or not other:
+            return 1.0 if words == other else 0.0
+        return len(words & other) / len(words | other)
+
+    @classmethod
+    def _get_exercise_executor(cls):
+        with cls._grading_lock:
+            if cls._exercise_executor is None:
+                cls._exercise_executor = ThreadPoolExecutor(
+                    max_workers=cls.EXERCISE_MAX_WORKERS, thread_name_prefix="exercise_chunk"
+                )
+            return cls._exercise_executor
+
+    def draw_assessment(self, user_id, subject, topic, difficulty_level, ai_agent, num_exercises=10):
+        """
+        A fresh assessment for the user: drawn from the exercise pool when it holds enough unseen exercises,
+        generated live otherwise. Either way the pool is topped up in the background afterwards
+        Return: {"status": "success", "exercises": [...], "source": "pool" | "live"} like generate_practice_exercises
+        """
+        def generate(count):
+            # Background refill: queued behind interactive grading and chat
+            result = self.generate_practice_exercises(
+                subject, topic, difficulty_level, ai_agent, num_exercises=count, feature="practice_exercises_refill"
+            )
+            # Never pool the placeholder questions returned when generation failed
+            if result.get("status") != "success" or result.get("message"):
+                return []
+            return result["exercises"]
+
+        exercises = exercise_pool.draw(user_id, subject, topic, difficulty_level, num_exercises)
+        if exercises:
+            result = {"status": "success", "exercises": exercises, "source": "pool"}
+        else:
+            result = self.generate_practice_exercises(subject, topic, difficulty_level, ai_agent, num_exercises=num_exercises)
+            result["source"] = "live"
+            if result.get("status") == "success" and not result.get("message"):
+                exercise_ids = exercise_pool.add(subject, topic, difficulty_level, result["exercises"])
+                exercise_pool.mark_seen(user_id, exercise_ids)
+
+        if ai_agent is not None and ai_agent.api_key:
+            exercise_pool.ensure_stock(subject, topic, difficulty_level, generate)
+        return result
 
     def _get_default_exercises(self, subject, topic, difficulty_level, num_exercises):
         """Generate default practice questions as a demotion solution"""
@@ -1017,6 +1654,255 @@ class MockAssessmentManager:
             })
         return exercises
     
+    @staticmethod
+    def is_choice_question(question):
+        """A question with an answer key (options + a valid correct_option) can be graded locally"""
+        if not isinstance(question, dict):
+            return False
+        options = question.get('options')
+        correct = question.get('correct_option')
+        if not isinstance(options, list) or len(options) < 2:
+            return False
+        try:
+            return 0 <= int(correct) < len(options)
+        except (TypeError, ValueError):
+            return False
+
+    @staticmethod
+    def _match_option(options, user_answer):
+        """Index of the chosen option: the option text itself, a letter (A / b) or a 1-based number; else None"""
+        answer = str(user_answer or "").strip()
+        if not answer:
+            return None
+        normalized = [str(option).strip().lower() for option in options]
+        if answer.lower() in normalized:
+            return normalized.index(answer.lower())
+        # "B", "b)", "B. text" or "2"
+        match = re.match(r'^\(?([A-Za-z]|\d+)\s*(?:[.):]\s*(.*))?$', answer)
+        if not match:
+            return None
+        token, rest = match.group(1), (match.group(2) or "").strip().lower()
+        index = int(token) - 1 if token.isdigit() else ord(token.lower()) - ord('a')
+        if not 0 <= index < len(options):
+            return None
+        if rest and rest != normalized[index]:
+            return None
+        return index
+
+    def grade_locally(self, question, user_answer):
+        """
+        Score a choice question from its stored key (no API call). Feedback comes from the stored explanation
+        Return: an evaluation like evaluate_answer, or None when the question/answer needs the LLM
+        """
+        if not self.is_choice_question(question):
+            return None
+        options = question['options']
+        chosen = self._match_option(options, user_answer)
+        if chosen is None:
+            return None
+
+        correct = int(question['correct_option'])
+        explanation = str(question.get('explanation') or "").strip()
+        if chosen == correct:
+            feedback = "Correct!"
+        else:
+            feedback = f"Incorrect. The correct answer is: {options[correct]}."
+        return {
+            "status": "success",
+            "data": {
+                "score": 1.0 if chosen == correct else 0.0,
+                "feedback": f"{feedback} {explanation}".strip(),
+                "explanation": explanation
+            }
+        }
+
+    def evaluate_answers_batch(self, subject, topic, items, difficulty_level, ai_agent, user_id=None, bulk=True):
+        """
+        Grade several (question, user_answer) pairs; latency is roughly the slowest single grading.
+        A question may be the exercise dict: choice questions are graded locally and only
+        open-ended answers are sent to the LLM, in one bulk request when bulk=True (items the bulk
+        response misses are graded one by one, concurrently)
+        Return: one evaluation per item, in item order (items that fail get the default evaluation)
+        """
+        evaluations = [None] * len(items)
+        pending = []
+        for index, (question, user_answer) in enumerate(items):
+            local = self.grade_locally(question, user_answer)
+            if local is not None:
+                evaluations[index] = local
+            else:
+                question_text = question.get('question', '') if isinstance(question, dict) else question
+                pending.append((index, question_text, user_answer))
+        if len(pending) < len(items):
+            logger.info(f"Graded {len(items) - len(pending)} of {len(items)} answers locally, {len(pending)} sent to the AI")
+
+        if bulk and len(pending) > 1:
+            bulk_results = self.evaluate_answers_bulk(
+                subject, topic, [(question, user_answer) for _, question, user_answer in pending],
+                difficulty_level, ai_agent
+            )
+            remaining = []
+            for (index, question, user_answer), evaluation in zip(pending, bulk_results):
+                if evaluation is not None:
+                    evaluations[index] = evaluation
+                else:
+                    remaining.append((index, question, user_answer))
+            pending = remaining
+
+        executor = self._get_grading_executor() if pending else None
+        futures = []
+        for index, question, user_answer in pending:
+            # The per-user cap is enforced here, so a waiting user never blocks a pool worker
+            self._acquire_user_slot(user_id)
+            try:
+                future = executor.submit(
+                    self.evaluate_answer, subject, topic, question, user_answer, difficulty_level, ai_agent
+                )
+            except Exception as e:
+                self._release_user_slot(user_id)
+                logger.error(f"Failed to schedule the answer evaluation: {str(e)}")
+                futures.append((index, None))
+                continue
+            future.add_done_callback(lambda _: self._release_user_slot(user_id))
+            futures.append((index, future))
+
+        for index, future in futures:
+            evaluation = None
+            if future is not None:
+                try:
+                    evaluation = future.result()
+                except Exception as e:
+                    logger.error(f"The evaluation of answer {index + 1} failed: {str(e)}")
+            if not evaluation or evaluation.get("status") != "success":
+                evaluation = self._default_evaluation(topic)
+            evaluations[index] = evaluation
+        return evaluations
+
+    def evaluate_answers_bulk(self, subject, topic, items, difficulty_level, ai_agent):
+        """
+        Grade several open-ended (question, user_answer) pairs with one structured request
+        Return: one evaluation per item, in item order; None for items the response did not grade validly
+        """
+        if not items:
+            return []
+        answers = "\n".join(
+            f"{number}. Question: {question}\n   User answer: {user_answer}"
+            for number, (question, user_answer) in enumerate(items, start=1)
+        )
+        prompt = f"""
+        You are an AI education expert and need to evaluate students' responses to the following {len(items)} questions (in English).：
+        Subject: {subject}
+        Theme: {topic}
+        Difficulty: {difficulty_level}
+
+        {answers}
+
+        Please evaluate every answer separately according to the following criteria:
+        Based on the analysis of the question, if the answer is correct, there will be points.
+
+        Return the result in JSON format, with exactly one entry per question, in the same order:
+        {{
+            "evaluations": [
+                {{
+                    "index": 1,
+                    "score": 0.0-1.0,
+                    "feedback": "Specific feedback and improvement suggestions for the answer",
+                    "explanation": "Explanation of the problem (as concise as possible)"
+                }}
+            ]
+        }}
+        """
+
+        messages = [
+            {"role": "system", "content": "You are an AI education expert who assesses students' learning outcomes and provides constructive feedback. Your output must be valid JSON with an evaluations array whose items have index, score (0.0-1.0), feedback, and explanation fields."},
+            {"role": "user", "content": prompt}
+        ]
+
+        results = [None] * len(items)
+        response = None
+        try:
+            response = ai_agent._call_api(messages, response_format={"type": "json_object"}, feature="answer_evaluation_bulk")
+            if not response or not isinstance(response, str):
+                logger.warning(f"AI returned invalid response for bulk answer evaluation: {response}")
+                return results
+
+            data = load_llm_json(response, "bulk answer evaluation")
+            entries = data.get("evaluations") if isinstance(data, dict) else None
+            if not isinstance(entries, list):
+                raise ValueError("Missing evaluations array")
+
+            # Validate item by item: a bad entry only costs that item a fallback
+            for position, entry in enumerate(entries):
+                if not isinstance(entry, dict):
+                    continue
+                try:
+                    index = int(entry.get("index", position + 1)) - 1
+                except (TypeError, ValueError):
+                    index = position
+                if not 0 <= index < len(items) or results[index] is not None:
+                    continue
+                score = entry.get("score")
+                if not all(field in entry for field in ("score", "feedback", "explanation")):
+                    continue
+                if isinstance(score, bool) or not isinstance(score, (int, float)) or not 0 <= score <= 1:
+                    continue
+                results[index] = {
+                    "status": "success",
+                    "data": {"score": score, "feedback": entry["feedback"], "explanation": entry["explanation"]}
+                }
+        except json.JSONDecodeError as e:
+            logger.error(f"Bulk answer evaluation JSON parsing failed: {e}, Response: {str(response)[:200]}...")
+        except ValueError as e:
+            logger.error(f"Invalid bulk evaluation data: {e}")
+        except Exception as e:
+            logger.error(f"The bulk answer evaluation failed: {str(e)}")
+
+        missing = sum(1 for result in results if result is None)
+        if missing:
+            logger.warning(f"Bulk evaluation left {missing} of {len(items)} answers ungraded; they fall back to single gradings")
+        return results
+
+    @classmethod
+    def _get_grading_executor(cls):
+        with cls._grading_lock:
+            if cls._grading_executor is None:
+                cls._grading_executor = ThreadPoolExecutor(
+                    max_workers=cls.GRADING_MAX_WORKERS, thread_name_prefix="grading"
+                )
+            return cls._grading_executor
+
+    @classmethod
+    def _acquire_user_slot(cls, user_id):
+        """Take one of the user's grading slots (blocks while GRADING_PER_USER_LIMIT are in use)"""
+        with cls._grading_lock:
+            entry = cls._user_slots.get(user_id)
+            if entry is None:
+                entry = cls._user_slots[user_id] = [threading.BoundedSemaphore(cls.GRADING_PER_USER_LIMIT), 0]
+            entry[1] += 1
+        entry[0].acquire()
+
+    @classmethod
+    def _release_user_slot(cls, user_id):
+        """Give the slot back; the user's semaphore is dropped when nobody holds or waits for one"""
+        with cls._grading_lock:
+            entry = cls._user_slots[user_id]
+            entry[0].release()
+            entry[1] -= 1
+            if entry[1] == 0:
+                del cls._user_slots[user_id]
+
+    @staticmethod
+    def _default_evaluation(topic):
+        """Evaluation used when the AI result is unavailable or cannot be parsed"""
+        return {
+            "status": "success",
+            "data": {
+                "score": 0,
+                "feedback": "Network issue, resolution failed. Please refer to the correct answer",
+                "explanation": f"Complete some evaluations to obtain personalized suggestions on {topic}"
+            }
+        }
+
     def evaluate_answer(self, subject, topic, question, user_answer, difficulty_level, ai_agent):
         """Use AI to evaluate open-ended answers"""
         prompt = f"""
@@ -1045,22 +1931,16 @@ class MockAssessmentManager:
         ]
         
         try:
-            response = ai_agent._call_api(messages, response_format={"type": "json_object"})
+            response = ai_agent._call_api(messages, response_format={"type": "json_object"}, feature="answer_evaluation")
             if not response or not isinstance(response, str):
                 logger.warning(f"AI returned invalid response for answer evaluation: {response}")
                 # Return the default evaluation result
-                return {
-                    "status": "success",
-                    "data": {
-                        "score": 0,
-                        "feedback": "Network issue, resolution failed. Please refer to the correct answer",
-                        "explanation": f"Complete some evaluations to obtain personalized suggestions on {topic}"
-                    }
-                }
+                return self._default_evaluation(topic)
             
-            # Clean up the response content
-            clean_response = response.strip().strip('`').strip('json').strip()
-            evaluation_data = json.loads(clean_response)
+            # Parse (and repair) the response content
+            evaluation_data = load_llm_json(response, "answer evaluation")
+            if not isinstance(evaluation_data, dict):
+                raise ValueError("The evaluation is not a JSON object")
             
             # Verify the necessary fields
             required_fields = ["score", "feedback", "explanation"]
@@ -1082,14 +1962,7 @@ class MockAssessmentManager:
             logger.error(f"The evaluation answer failed: {str(e)}")
         
         # Return the default evaluation logic when the parsing fails
-        return {
-            "status": "success",
-            "data": {
-                "score": 0,
-                "feedback": "Network issue, resolution failed. Please refer to the correct answer",
-                "explanation": f"Complete some evaluations to obtain personalized suggestions on {topic}"
-            }
-        }
+        return self._default_evaluation(topic)
     
     def save_assessment_result(self, assessment_results, user_id, subject, topic, score, feedback, difficulty_level):
         """Save the assessment results"""
@@ -1272,45 +2145,400 @@ class MockAssessmentManager:
             return patterns
 
 # Real AI agent class
+class OpenAIClientRegistry:
+    """Long-lived OpenAI clients keyed by (api_key, base_url), shared by every session using the same key"""
+    def __init__(self, max_clients=16):
+        self.max_clients = max_clients
+        self.limits = httpx.Limits(
+            max_connections=int(os.environ.get("LLM_MAX_CONNECTIONS", 20)),
+            max_keepalive_connections=int(os.environ.get("LLM_MAX_KEEPALIVE", 10)),
+            keepalive_expiry=float(os.environ.get("LLM_KEEPALIVE_EXPIRY", 60))
+        )
+        self.timeout = httpx.Timeout(
+            float(os.environ.get("LLM_READ_TIMEOUT", 80)),  # 80-second timeout
+            connect=float(os.environ.get("LLM_CONNECT_TIMEOUT", 10))
+        )
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, api_key, base_url):
+        """The pooled client of a key (created on first use; the least recently used one is closed beyond max_clients)"""
+        key = (api_key, base_url)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                return client
+            client = OpenAI(
+                api_key=api_key,
+                base_url=base_url,
+                timeout=self.timeout,
+                max_retries=0,  # Retries go through DeepSeekAIAgent so every attempt passes the shared limiter
+                http_client=httpx.Client(
+                    limits=self.limits, timeout=self.timeout,
+                    event_hooks={"response": [llm_telemetry.on_response]}  # Time to first byte
+                )
+            )
+            self._clients[key] = client
+            while len(self._clients) > self.max_clients:
+                _, evicted = self._clients.popitem(last=False)
+                self._close(evicted)
+            return client
+
+    def close_all(self):
+        with self._lock:
+            clients = list(self._clients.values())
+            self._clients.clear()
+        for client in clients:
+            self._close(client)
+
+    @staticmethod
+    def _close(client):
+        try:
+            client.close()
+        except Exception as e:
+            logger.warning(f"Failed to close an API client: {str(e)}")
+
+# One registry per process: connections stay warm across calls, reruns and sessions
+openai_clients = OpenAIClientRegistry()
+atexit.register(openai_clients.close_all)
+
+
+class ConversationContext:
+    """
+    Bounds the chat payload to a token budget: a sliding window of recent turns plus a rolling summary
+    of the older ones. The summary is only refreshed when the window overflows, and then folds just the
+    turns that left the window into the previous summary (never the whole history again)
+    """
+    def __init__(self, max_tokens=None, summary_tokens=None, low_water=0.6):
+        self.max_tokens = max_tokens or int(os.environ.get("CHAT_CONTEXT_TOKENS", 3000))
+        self.summary_tokens = summary_tokens or int(os.environ.get("CHAT_SUMMARY_TOKENS", 400))
+        # After a fold the window shrinks to this share of its budget, so the next turns fit without folding
+        self.low_water = low_water
+        self.summary = ""
+        self._summarized = []  # fingerprints of the turns folded into self.summary, in order
+        self._lock = threading.Lock()
+        self.last_payload_tokens = 0
+
+    @staticmethod
+    def estimate_tokens(text):
+        """Fast local estimate: ~4 ASCII characters per token, one token per other (e.g. CJK) character"""
+        if not text:
+            return 0
+        ascii_chars = sum(1 for ch in text if ord(ch) < 128)
+        return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+    @classmethod
+    def message_tokens(cls, message):
+        return cls.estimate_tokens(message.get("content", "")) + 4  # role and framing overhead
+
+    @staticmethod
+    def _fingerprint(message):
+        payload = f"{message.get('role', '')}\x00{message.get('content', '')}"
+        return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+    def build(self, messages, agent=None):
+        """The messages to send: [summary system message] + the recent turns that fit the budget"""
+        with self._lock:
+            fingerprints = [self._fingerprint(m) for m in messages]
+            # 1. Reuse the summary only if the turns it covers are still the start of the history
+            #    (deleting a message or clearing the history invalidates it)
+            covered = len(self._summarized)
+            if covered > len(messages) - 1 or fingerprints[:covered] != self._summarized:
+                self.summary = ""
+                self._summarized = []
+                covered = 0
+
+            # 2. Fold the oldest turns of the window into the summary when the window overflows
+            window_budget = max(self.max_tokens - self.summary_tokens, 1)
+            window = messages[covered:]
+            tokens = [self.message_tokens(m) for m in window]
+            if sum(tokens) > window_budget:
+                target = window_budget * self.low_water
+                fold = 0
+                total = sum(tokens)
+                while fold < len(window) - 1 and total > target:
+                    total -= tokens[fold]
+                    fold += 1
+                self.summary = self._fold(self.summary, window[:fold], agent)
+                self._summarized = fingerprints[:covered + fold]
+                window = window[fold:]
+
+            # 3. Assemble the payload
+            payload = []
+            if self.summary:
+                payload.append({
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation with this student:\n{self.summary}"
+                })
+            payload.extend({"role": m["role"], "content": m["content"]} for m in window)
+            self.last_payload_tokens = sum(self.message_tokens(m) for m in payload)
+            return payload
+
+    def reset(self):
+        with self._lock:
+            self.summary = ""
+            self._summarized = []
+
+    def _fold(self, summary, turns, agent):
+        """Merge turns into the summary with one small LLM call; fall back to a local digest"""
+        transcript = "\n".join(f"{m['role']}: {m['content']}" for m in turns)
+        word_limit = max(self.summary_tokens * 3 // 4, 50)
+        updated = None
+        if agent is not None:
+            prompt = f"""
+            Update the summary of a tutoring conversation with the new turns below.
+            Keep the student's goals, the topics covered, key facts and explanations given, and open questions.
+            Reply with the updated summary only, in at most {word_limit} words.
+
+            Current summary:
+            {summary or "(none)"}
+
+            New turns:
+            {transcript}
+            """
+            updated = agent._call_api([{"role": "user", "content": prompt}], feature="chat_summary")
+        if not updated:
+            # Local digest: the opening of each folded turn
+            digest = "\n".join(f"{m['role']}: {m['content'][:200]}" for m in turns)
+            updated = f"{summary}\n{digest}".strip()
+        return self._clip(updated.strip(), self.summary_tokens)
+
+    @classmethod
+    def _clip(cls, text, max_tokens):
+        """Keep the most recent part of text within max_tokens"""
+        while text and cls.estimate_tokens(text) > max_tokens:
+            text = text[len(text) // 8 or 1:]
+        return text
+
+
+class AttemptTimeout(TimeoutError):
+    """No reply to a (hedged) attempt within its timeout"""
+
+
 class DeepSeekAIAgent:
     """DeepSeek AI agent, handling AI-related learning assistance functions"""
+    # Total time budget of one call per feature: queueing, attempts and backoff included (seconds)
+    FEATURE_DEADLINES = {
+        "chat": 45,
+        "chat_summary": 20,
+        "answer_evaluation": 30,
+        "answer_evaluation_bulk": 120,
+        "assistance": 45,
+        "motivational_message": 30,
+        "study_reminder": 30,
+        "study_schedule": 90,
+        "practice_exercises": 120,
+        "practice_exercises_refill": 180,
+        "learning_path_outline": 120,
+        "learning_path_topic": 150,
+    }
+    DEFAULT_DEADLINE = 120
+    # Attempt timeout = TIMEOUT_FACTOR x the feature's observed p99, within [MIN_TIMEOUT, LLM_READ_TIMEOUT]
+    TIMEOUT_FACTOR = 2.0
+    MIN_TIMEOUT = 5.0
+    MAX_TIMEOUT = float(os.environ.get("LLM_READ_TIMEOUT", 80))
+    # Features whose requests may be duplicated: after the observed p95 a second request races the first.
+    # Only cheap single-item requests: answer_evaluation_bulk (one call grading a whole submission) is never hedged
+    HEDGED_FEATURES = set(filter(None, os.environ.get(
+        "LLM_HEDGED_FEATURES", "answer_evaluation,assistance,chat_summary"
+    ).split(",")))
+    _hedge_executor = None
+    _hedge_lock = threading.Lock()
+
     def __init__(self, api_key=None):
         self.api_key = api_key
-        self.base_url = "https://api.deepseek.com/v1"
+        # DEEPSEEK_BASE_URL points the agent at another OpenAI-compatible server (e.g. core/llm_standin.py)
+        self.base_url = os.environ.get("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
         self.model = "deepseek-chat"
         self.temperature = 1  # Reduce randomness and enhance the stability of the JSON format
         self.max_retries = 3
         self.retry_delay = 2  # Initial retry delay (in seconds)
+        self.conversation_context = ConversationContext()  # Token budget of the chat payload
 
-    def _call_api(self, messages, response_format=None):
-        """Call the DeepSeek API with a retry mechanism"""
+    def _call_api(self, messages, response_format=None, feature=None, cache=True):
+        """
+        Call the DeepSeek API with a retry mechanism.
+        feature selects the response cache TTL (see llm_cache.FEATURE_TTLS); cache=False bypasses the cache
+        """
         if not self.api_key:
             logger.warning("The DeepSeek API cannot be invoked without providing the API key")
             return None
-            
-        client = openai.OpenAI(api_key=self.api_key, base_url=self.base_url)
+
+        # Every call is timed and tagged with its feature (see llm_telemetry)
+        call = llm_telemetry.start(feature)
+        ttl = feature_ttl(feature) if cache else 0
+        cache_key = None
+        if ttl > 0:
+            cache_key = LLMResponseCache.make_key(self.model, messages, self.temperature, response_format)
+            cached = llm_cache.get(cache_key, feature)
+            if cached is not None:
+                llm_telemetry.finish(call, "cache_hit", model=self.model)
+                return cached
+            
+        # Pooled keep-alive client; a changed api_key simply maps to another client
+        client = openai_clients.get(self.api_key, self.base_url)
         
+        # The whole call (queueing, attempts, backoff) must fit the feature's deadline
+        deadline = time.monotonic() + self.deadline_for(feature)
+        last_error = None
         for attempt in range(self.max_retries):
+            remaining = deadline - time.monotonic()
+            if remaining < 1:
+                last_error = last_error or TimeoutError("The deadline budget is exhausted")
+                break
+            call.begin_attempt()
+            timeout = min(self.attempt_timeout(feature), remaining)
             try:
-                response = client.chat.completions.create(
+                response = self._request(
+                    client, call, feature, deadline,
+                    timeout=timeout,
                     model=self.model,
                     messages=messages,
                     temperature=self.temperature,
-                    response_format=response_format,
-                    timeout=80  # 80-second timeout
+                    response_format=response_format
                 )
-                return response.choices[0].message.content
+                content = response.choices[0].message.content
+                llm_telemetry.finish(call, "success", usage=getattr(response, "usage", None), model=self.model)
+                if cache_key and self._is_cacheable(content, response_format):
+                    llm_cache.set(cache_key, feature, content, ttl)
+                return content
             except Exception as e:
+                last_error = e
                 logger.error(f"API call failed (Try {attempt + 1}/{self.max_retries}): {str(e)}")
-                if attempt < self.max_retries - 1:
-                    # Exponential backoff retry
-                    delay = self.retry_delay * (2 ** attempt)
-                    logger.info(f"Wait {delay} seconds, try again...")
-                    time.sleep(delay)
+                if isinstance(e, (openai.APITimeoutError, httpx.TimeoutException, AttemptTimeout)):
+                    # Without this sample a slowdown past the timeout would never raise the timeout
+                    llm_telemetry.attempt_timed_out(feature, timeout)
+                if attempt < self.max_retries - 1 and self._backoff(e, attempt, deadline):
                     continue
-                return None
+                break
+        llm_telemetry.finish(call, "error", error=last_error, model=self.model)
         return None
 
+    def deadline_for(self, feature):
+        """Total budget of a call (LLM_DEADLINE_<FEATURE> overrides the default)"""
+        override = os.environ.get(f"LLM_DEADLINE_{(feature or 'default').upper()}")
+        if override:
+            try:
+                return float(override)
+            except ValueError:
+                logger.warning(f"Invalid LLM_DEADLINE_{feature.upper()}: {override}")
+        return self.FEATURE_DEADLINES.get(feature, self.DEFAULT_DEADLINE)
+
+    def attempt_timeout(self, feature):
+        """Timeout of one attempt, adapted to the feature's recent p99 latency (the fixed maximum until known)"""
+        p99 = llm_telemetry.latency_quantile(feature, 0.99)
+        if p99 is None:
+            return self.MAX_TIMEOUT
+        return min(max(p99 * self.TIMEOUT_FACTOR, self.MIN_TIMEOUT), self.MAX_TIMEOUT)
+
+    def _request(self, client, call, feature, deadline, timeout, **request):
+        """
+        One attempt, holding a limiter slot. For hedged features, when no reply has come after the feature's
+        p95 latency a second identical request is sent (only if a slot is free right away) and the first
+        reply wins; the slower one is left to finish in the background and discarded
+        """
+        priority = feature_priority(feature)
+
+        def send(hedge=False):
+            try:
+                # A hedge never queues: under load it would only add to the congestion
+                llm_limiter.acquire(priority, timeout=0 if hedge else max(0.0, deadline - time.monotonic()))
+            except TimeoutError:
+                if hedge:
+                    return None
+                raise
+            try:
+                if not hedge:
+                    call.admitted()
+                return client.chat.completions.create(timeout=timeout, **request)
+            finally:
+                llm_limiter.release()
+
+        hedge_after = llm_telemetry.latency_quantile(feature, 0.95) if feature in self.HEDGED_FEATURES else None
+        if hedge_after is None or hedge_after >= timeout:
+            return send()
+
+        executor = self._get_hedge_executor()
+        # Copy the context so the telemetry response hook still finds this call on the worker threads
+        primary = executor.submit(contextvars.copy_context().run, send)
+        done, _ = wait([primary], timeout=hedge_after)
+        if done:
+            return primary.result()
+        call.hedged = True
+        pending = {primary, executor.submit(contextvars.copy_context().run, send, True)}
+        ends_at = time.monotonic() + timeout
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, ends_at - time.monotonic()), return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = error or e
+                    continue
+                if response is not None:  # None: the hedge was skipped for lack of a free slot
+                    return response
+        raise error or AttemptTimeout(f"No reply within {timeout:.1f}s")
+
+    @classmethod
+    def _get_hedge_executor(cls):
+        # A separate pool: hedged calls often run on grading workers already, which must not wait on themselves
+        with cls._hedge_lock:
+            if cls._hedge_executor is None:
+                cls._hedge_executor = ThreadPoolExecutor(
+                    max_workers=int(os.environ.get("LLM_HEDGE_WORKERS", 16)), thread_name_prefix="llm_hedge"
+                )
+            return cls._hedge_executor
+
+    def _backoff(self, error, attempt, deadline=None):
+        """
+        Wait before retrying a failed request; False when the error is not worth a retry or the wait would
+        not leave time for another attempt before the deadline.
+        A 429 pauses the shared limiter (honoring Retry-After) so all sessions back off together;
+        other transient errors sleep a jittered exponential delay
+        """
+        retryable, delay, rate_limited = retry_decision(error, attempt, self.retry_delay)
+        if not retryable:
+            return False
+        if deadline is not None and time.monotonic() + delay + 1 > deadline:
+            return False
+        if rate_limited:
+            llm_limiter.pause(delay)
+        else:
+            logger.info(f"Wait {delay:.1f} seconds, try again...")
+            time.sleep(delay)
+        return True
+
+    @staticmethod
+    def _is_cacheable(content, response_format):
+        """Only cache complete answers: JSON requests must return strictly valid JSON"""
+        if not content or not isinstance(content, str):
+            return False
+        if response_format and response_format.get("type") == "json_object":
+            try:
+                json.loads(content)
+            except ValueError:
+                return False
+        return True
+
+    @staticmethod
+    def get_cache_stats():
+        """Hit-rate metrics of the LLM response cache, per feature"""
+        return llm_cache.stats()
+
+    @staticmethod
+    def get_telemetry_summary():
+        """Per-feature latency percentiles, attempts, token usage and cost of recent LLM calls"""
+        return llm_telemetry.summary()
+
+    @staticmethod
+    def get_limiter_stats():
+        """Queue depth, in-flight requests and wait times of the shared LLM limiter"""
+        return llm_limiter.stats()
+
     def generate_motivational_message(self, user_id, context):
         """Generate learning motivation information"""
         prompt = f"""
@@ -1332,12 +2560,12 @@ class DeepSeekAIAgent:
         ]
         
         try:
-            response = self._call_api(messages, response_format={"type": "json_object"})
+            response = self._call_api(messages, response_format={"type": "json_object"}, feature="motivational_message")
             if not response or not isinstance(response, str):
                 logger.warning(f"AI returned invalid response for motivational message: {response}")
                 raise ValueError("Invalid response")
             
-            return {"status": "success", "data": json.loads(response.strip())}
+            return {"status": "success", "data": load_llm_json(response, "motivational message")}
         except json.JSONDecodeError as e:
             logger.error(f"Motivational message JSON parsing failed: {e}, Response: {response[:200]}...")
         except Exception as e:
@@ -1371,12 +2599,12 @@ class DeepSeekAIAgent:
         ]
         
         try:
-            response = self._call_api(messages, response_format={"type": "json_object"})
+            response = self._call_api(messages, response_format={"type": "json_object"}, feature="study_reminder")
             if not response or not isinstance(response, str):
                 logger.warning(f"AI returned invalid response for study reminder: {response}")
                 raise ValueError("Invalid response")
             
-            return {"status": "success", "data": json.loads(response.strip())}
+            return {"status": "success", "data": load_llm_json(response, "study reminder")}
         except json.JSONDecodeError as e:
             logger.error(f"Study reminder JSON parsing failed: {e}, Response: {response[:200]}...")
         except Exception as e:
@@ -1391,8 +2619,8 @@ class DeepSeekAIAgent:
             }
         }
 
-    def generate_study_schedule(self, deadline=None, hours_per_day=120, topics=None, subject=None, focus=None):
-        """Generate a learning plan based on the user's learning path"""
+    def generate_study_schedule(self, deadline=None, hours_per_day=120, topics=None, subject=None, focus=None, cache=True):
+        """Generate a learning plan based on the user's learning path (cache=False: a fresh plan, e.g. on regenerate)"""
         subject = subject if subject else "various subject"
         topics_str = str(topics) if topics else "various topics"
         focus = focus if focus else "various focus areas"
@@ -1507,12 +2735,12 @@ class DeepSeekAIAgent:
         ]
         
         try:
-            response = self._call_api(messages, response_format={"type": "json_object"})
+            response = self._call_api(messages, response_format={"type": "json_object"}, feature="study_schedule", cache=cache)
             if not response or not isinstance(response, str):
                 logger.warning(f"AI returned invalid response for study schedule: {response}")
                 raise ValueError("Invalid response")
             
-            return {"status": "success", "data": json.loads(response.strip())}
+            return {"status": "success", "data": load_llm_json(response, "study schedule")}
         except json.JSONDecodeError as e:
             logger.error(f"Study schedule JSON parsing failed: {e}, Response: {response[:200]}...")
         except Exception as e:
@@ -1607,12 +2835,12 @@ class DeepSeekAIAgent:
         ]
         
         try:
-            response = self._call_api(messages, response_format={"type": "json_object"})
+            response = self._call_api(messages, response_format={"type": "json_object"}, feature="assistance")
             if not response or not isinstance(response, str):
                 logger.warning(f"AI returned invalid response for assistance request: {response}")
                 raise ValueError("Invalid response")
             
-            return {"status": "success", "data": json.loads(response.strip())}
+            return {"status": "success", "data": load_llm_json(response, "assistance")}
         except json.JSONDecodeError as e:
             logger.error(f"Assistance request JSON parsing failed: {e}, Response: {response[:200]}...")
         except Exception as e:
@@ -1638,18 +2866,18 @@ class DeepSeekAIAgent:
             }
         }
     
+    CHAT_SYSTEM_MESSAGE = {
+        "role": "system", 
+        "content": "You are an AI learning assistant, named ASC (Adaptive Study Companion). You help students learn various subjects, answer questions and provide explanations. Please keep your answers clear and detailed, and answer users' questions in English."
+    }
+
     def chat(self, messages):
         """Handle dialogue interactions with students"""
-        system_message = {
-            "role": "system", 
-            "content": "You are an AI learning assistant, named ASC (Adaptive Study Companion). You help students learn various subjects, answer questions and provide explanations. Please keep your answers clear and detailed, and answer users' questions in English."
-        }
-        
-        # Build a complete dialogue history (including system messages)
-        full_conversation = [system_message] + messages
+        # System message + rolling summary + the recent turns that fit the token budget
+        full_conversation = [self.CHAT_SYSTEM_MESSAGE] + self.conversation_context.build(messages, self)
         
         try:
-            response = self._call_api(full_conversation)
+            response = self._call_api(full_conversation, feature="chat")
             if not response:
                 return {"status": "error", "message": "The AI response cannot be obtained"}
             
@@ -1659,6 +2887,82 @@ class DeepSeekAIAgent:
             logger.error(f"Dialogue interaction error: {str(e)}")
             return {"status": "error", "message": f"An error occurred during AI interaction: {str(e)}"}
 
+    def chat_stream(self, messages, cancel_event=None):
+        """
+        Stream the reply to a dialogue: yields text fragments as the model produces them.
+        Stops early and closes the HTTP stream when cancel_event is set or the consumer stops iterating
+        (e.g. a Streamlit rerun interrupts the render). Raises RuntimeError if no reply can be obtained
+        """
+        if not self.api_key:
+            raise RuntimeError("DeepSeek API Key is required")
+
+        full_conversation = [self.CHAT_SYSTEM_MESSAGE] + self.conversation_context.build(messages, self)
+        client = openai_clients.get(self.api_key, self.base_url)
+
+        # Timed directly (not through the context variable, which would leak across yields)
+        call = LLMCall("chat", stream=True)
+        # The deadline bounds the wait for the stream to start; once tokens flow the reply may take its time
+        deadline = time.monotonic() + self.deadline_for("chat")
+        stream = None
+        for attempt in range(self.max_retries):
+            if cancel_event is not None and cancel_event.is_set():
+                llm_telemetry.finish(call, "cancelled", model=self.model)
+                return
+            call.begin_attempt()
+            try:
+                # The limiter slot is held for the whole stream
+                llm_limiter.acquire(feature_priority("chat"), timeout=max(0.0, deadline - time.monotonic()))
+            except TimeoutError as e:
+                llm_telemetry.finish(call, "error", error=e, model=self.model)
+                raise RuntimeError("The AI assistant is busy, please try again")
+            call.admitted()
+            try:
+                stream = client.chat.completions.create(
+                    model=self.model,
+                    messages=full_conversation,
+                    temperature=self.temperature,
+                    stream=True,
+                    stream_options={"include_usage": True},  # The last chunk carries the token usage
+                    timeout=min(self.MAX_TIMEOUT, max(1.0, deadline - time.monotonic()))
+                )
+                break
+            except Exception as e:
+                llm_limiter.release()
+                logger.error(f"Streaming API call failed (Try {attempt + 1}/{self.max_retries}): {str(e)}")
+                # Retry only before the first token; a started reply cannot be replayed
+                if attempt < self.max_retries - 1 and self._backoff(e, attempt, deadline):
+                    continue
+                llm_telemetry.finish(call, "error", error=e, model=self.model)
+                raise RuntimeError(f"The AI response cannot be obtained: {str(e)}")
+
+        outcome, usage, error = "cancelled", None, None
+        try:
+            for chunk in stream:
+                if call.ttfb is None:
+                    call.first_byte()
+                if getattr(chunk, "usage", None):
+                    usage = chunk.usage
+                if cancel_event is not None and cancel_event.is_set():
+                    logger.info("The streaming reply was cancelled")
+                    return
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+            outcome = "success"
+        except Exception as e:
+            outcome, error = "error", e
+            raise
+        finally:
+            # Release the connection back to the pool whether the reply finished or not
+            try:
+                stream.close()
+            except Exception:
+                pass
+            llm_limiter.release()
+            llm_telemetry.finish(call, outcome, usage=usage, error=error, model=self.model)
+
 class MockAssistanceTracker:
     """Learn the help tracker to record and query help requests"""
     @staticmethod
@@ -2,11 +2,18 @@
 import MySQLdb
 import MySQLdb.cursors
 import os
+import re
 import json
+import hashlib
+import itertools
 import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from functools import lru_cache
 from dbutils.pooled_db import PooledDB
+from . import migrations
 
 
 class Config:
@@ -22,23 +29,153 @@ class Config:
         'cursorclass': MySQLdb.cursors.DictCursor
     }
 
+    # Read-through cache configuration (seconds before an entry is revalidated against the version column)
+    CACHE_CONFIG = {
+        'learning_paths_ttl': float(os.environ.get('LEARNING_PATHS_CACHE_TTL', 30)),
+        'learning_paths_maxsize': int(os.environ.get('LEARNING_PATHS_CACHE_SIZE', 512))
+    }
+
+class ReadThroughCache:
+    """Read-through cache with per-key TTL, LRU eviction and version-token revalidation (thread-safe)"""
+    def __init__(self, name, maxsize=256, ttl=30):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> [value, version_token, checked_at]
+        # key -> generation of its last invalidation, guards against storing results of in-flight loads
+        # (LRU-bounded like the entries; a forgotten key reads as the newest generation forgotten)
+        self._generations = OrderedDict()
+        self._generation_seq = itertools.count(1)
+        self._generation_floor = 0
+        self._lock = threading.RLock()
+        self._stats = {'hits': 0, 'revalidated': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, key, loader, version_probe):
+        """
+        Return the cached value of key, loading it on a miss
+        Fresh entries (younger than ttl) are served without touching the database; stale entries are
+        revalidated with version_probe (a cheap query on the version column) and only reloaded when it changed
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[2] < self.ttl:
+                self._entries.move_to_end(key)
+                self._stats['hits'] += 1
+                return entry[0]
+            generation = self._generation(key)
+
+        token = version_probe()
+        if entry is not None and token is not None and token == entry[1]:
+            with self._lock:
+                if self._generation(key) == generation and key in self._entries:
+                    self._entries[key][2] = now
+                    self._entries.move_to_end(key)
+                    self._stats['revalidated'] += 1
+                    return entry[0]
+
+        # The token is read before the value, so a write racing the load leaves a stale token, never a stale value
+        value = loader()
+        with self._lock:
+            self._stats['misses'] += 1
+            if value is None or value is False or token is None:
+                # Query failures are not cached
+                return value
+            if self._generation(key) != generation:
+                return value
+            self._entries[key] = [value, token, now]
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key (or everything) after a local write"""
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries.keys())
+            for k in keys:
+                self._entries.pop(k, None)
+                self._generations[k] = next(self._generation_seq)
+                self._generations.move_to_end(k)
+            while len(self._generations) > self.maxsize:
+                _, forgotten = self._generations.popitem(last=False)
+                self._generation_floor = max(self._generation_floor, forgotten)
+            self._stats['invalidations'] += 1
+
+    def expire(self, key):
+        """Revalidate key on its next read (one version probe) instead of dropping it"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry[2] = float('-inf')
+
+    def _generation(self, key):
+        return self._generations.get(key, self._generation_floor)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, name=self.name, size=len(self._entries))
+
+class UnitOfWork:
+    """One connection pinned to the current thread/task for the duration of a DataManager.unit_of_work() block"""
+    def __init__(self, connection):
+        self.connection = connection
+        self.statements = 0
+        self.rollback_only = False  # Set by a failed statement; the block then rolls back instead of committing
+        self.last_error = None
+        self.legacy_context = None  # Set when opened through start_transaction()
+
+    def run(self, query, params=None, many=False):
+        """Execute one statement on the pinned connection (the commit happens when the block ends)"""
+        try:
+            with self.connection.cursor(MySQLdb.cursors.DictCursor) as cursor:
+                self.statements += 1
+                if many:
+                    cursor.executemany(query, params)
+                    return cursor.rowcount
+                cursor.execute(query, params or ())
+                if query.strip().upper().startswith('SELECT'):
+                    return cursor.fetchall()
+                elif query.strip().upper().startswith('INSERT'):
+                    return cursor.lastrowid
+                return cursor.rowcount
+        except MySQLdb.Error as e:
+            print(f"Query execution error: {e}")
+            self.last_error = e
+            self.rollback_only = True
+            return False
+
+
 class DataManager:
     """Data Manager - Singleton pattern + delayed initialization of the connection pool"""
     _instance = None
     _pool = None  # Connection pool instance, deferred initialization
     _table_initialized = False  # Table initialization tag
+    _schema_retry_at = 0.0  # After a failed schema check, no new attempt before this time (monotonic)
+    SCHEMA_RETRY_SECONDS = float(os.environ.get('SCHEMA_RETRY_SECONDS', 30))
+    _current_uow = contextvars.ContextVar('data_manager_unit_of_work', default=None)
+    DEADLOCK_RETRIES = 2  # Immediate replays of a statement group chosen as a deadlock victim
+    RETRYABLE_ERRORS = (1213, 1205)  # ER_LOCK_DEADLOCK, ER_LOCK_WAIT_TIMEOUT
+    IDENTIFIER_PATTERN = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
 
     def __new__(cls, *args, **kwargs):
         if not cls._instance:
             cls._instance = super(DataManager, cls).__new__(cls)
             cls._instance.config = Config.POOL_CONFIG
-            cls._instance.connection = None
-            cls._instance.cursor = None
+            cls._instance._local = threading.local()  # Dedicated per-thread connections when there is no pool
+            cls._instance.learning_paths_cache = ReadThroughCache(
+                'learning_paths',
+                maxsize=Config.CACHE_CONFIG['learning_paths_maxsize'],
+                ttl=Config.CACHE_CONFIG['learning_paths_ttl']
+            )
+            cls._instance.write_stats = {
+                'atomic_writes': 0, 'conflicts': 0, 'noops': 0, 'group_rollbacks': 0, 'deadlock_retries': 0, 'failures': 0
+            }
+            cls._instance._write_stats_lock = threading.Lock()
             # Initialize the connection pool first
             cls._instance._initialize_pool()
-            # Delay ensures that the connection pool is ready
-            time.sleep(1)
-            # Initialize the table structure
+            # Check the schema version (DDL only when the database is behind)
             cls._instance._initialize_database()
         return cls._instance
 
@@ -52,61 +189,103 @@ class DataManager:
             # Do not directly throw an exception and allow subsequent retries
             self._pool = None
 
-    # Transaction-related methods
+    # Transaction-related methods (kept for older callers; they open and close a unit of work)
     def start_transaction(self):
+        """Open a unit of work that lasts until commit_transaction()/rollback_transaction() (prefer unit_of_work)"""
+        if self._current_uow.get() is not None:
+            return True
         try:
-            if not self.connection or not self.connection.open:
-                self._connect()
-            # Use method calls instead of property assignments to be compatible with the connection pool to connect objects
-            self.connection.set_autocommit(False)
+            context = self.unit_of_work()
+            context.__enter__().legacy_context = context
         except MySQLdb.Error as e:
             print(f"Error in starting a transaction: {e}")
             return False
         return True
     
     def commit_transaction(self):
-        try:
-            if self.connection and self.connection.open:
-                self.connection.commit()
-                # Use method calls instead of attribute assignments
-                self.connection.set_autocommit(True)
-        except MySQLdb.Error as e:
-            print(f"Transaction submission error: {e}")
-            return False
-        return True
+        return self._end_transaction(rollback=False)
     
     def rollback_transaction(self):
+        return self._end_transaction(rollback=True)
+
+    def _end_transaction(self, rollback):
+        uow = self._current_uow.get()
+        context = uow.legacy_context if uow is not None else None
+        if context is None:
+            # No transaction was started: statements outside a unit of work already committed themselves
+            return True
+        uow.rollback_only = uow.rollback_only or rollback
         try:
-            if self.connection and self.connection.open:
-                self.connection.rollback()
-                # Use method calls instead of attribute assignments
-                self.connection.set_autocommit(True)
+            context.__exit__(None, None, None)
         except MySQLdb.Error as e:
-            print(f"Rollback transaction error: {e}")
+            print(f"Transaction submission error: {e}")
             return False
-        return True
-        
-    def _connect(self):
-        """Obtain a connection from the connection pool (use the connection pool first)"""
+        return rollback or not uow.rollback_only
+
+    @contextmanager
+    def unit_of_work(self, read_only=False):
+        """
+        Pin one connection to the current thread/task: every execute_* call inside the block runs on it and the
+        block commits once (or rolls back on an exception or a failed statement). Nested blocks join the outer unit
+        A read_only block never commits: a pooled connection is rolled back by the pool when it is returned
+        """
+        if not self._table_initialized:
+            self._initialize_database()
+
+        outer = self._current_uow.get()
+        if outer is not None:
+            yield outer
+            return
+
+        connection, pooled = self._checkout_connection()
+        uow = UnitOfWork(connection)
+        token = self._current_uow.set(uow)
         try:
-            # If the connection pool has been initialized, obtain it from the connection pool first
-            if self._pool:
-                self.connection = self._pool.connection()
-                print(f"从连接池获取连接成功（ThreadID: {self.connection.thread_id()}）")
+            yield uow
+            if read_only and pooled:
+                pass
+            elif uow.rollback_only or read_only:
+                connection.rollback()
             else:
-                # Alternative solution: Create a connection directly
-                self.connection = MySQLdb.connect(
-                    host=self.config['host'],
-                    user=self.config['user'],
-                    passwd=self.config['password'],
-                    db=self.config['database'],
-                    port=self.config['port'],
-                    connect_timeout=10,
-                    cursorclass=MySQLdb.cursors.DictCursor
-                )
-                print(f"The connection was directly created successfully（ThreadID: {self.connection.thread_id()}）")
-            
-            self.cursor = self.connection.cursor()
+                connection.commit()
+        except BaseException:
+            try:
+                connection.rollback()
+            except MySQLdb.Error:
+                pass
+            raise
+        finally:
+            self._current_uow.reset(token)
+            if pooled:
+                # Returns the connection to the pool
+                connection.close()
+
+    def _checkout_connection(self):
+        """A pooled connection, or (without a pool) this thread's own dedicated connection"""
+        if self._pool:
+            return self._pool.connection(), True
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or not connection.open:
+            connection = self._connect()
+            if connection is None:
+                raise MySQLdb.OperationalError(2006, "No valid database connection available")
+            self._local.connection = connection
+        return connection, False
+
+    def _connect(self):
+        """Create a dedicated connection (used when the connection pool is unavailable)"""
+        try:
+            connection = MySQLdb.connect(
+                host=self.config['host'],
+                user=self.config['user'],
+                passwd=self.config['password'],
+                db=self.config['database'],
+                port=self.config['port'],
+                connect_timeout=10,
+                cursorclass=MySQLdb.cursors.DictCursor
+            )
+            print(f"The connection was directly created successfully（ThreadID: {connection.thread_id()}）")
+            return connection
             
         except MySQLdb.Error as e:
             error_msg = str(e)
@@ -126,311 +305,371 @@ class DataManager:
                 temp_cursor.close()
                 temp_conn.close()
                 print(f"Database {self.config['database']} Creation successful. Reconnect...")
-                self._connect()
+                return self._connect()
             
-            self.connection = None
-            self.cursor = None
-    
-    def _check_column_exists(self, cursor, table_name, column_name):
-        """Check if the field exists (compatible with DictCursor)"""
-        cursor.execute("""
-            SELECT COUNT(*) AS count 
-            FROM information_schema.columns 
-            WHERE table_schema = DATABASE() 
-            AND table_name = %s 
-            AND column_name = %s
-        """, (table_name, column_name))
-        result = cursor.fetchone()
-        return result['count'] > 0 if result else False
+            return None
     
     def _initialize_database(self):
-        """Initialize the database table structure (compatible with lower versions of MySQL and DictCursor)"""
-        if self._table_initialized:
+        """
+        Check the schema version once (one indexed read); migrations run only when the database is behind.
+        A failed check is retried after SCHEMA_RETRY_SECONDS, not on every query (the migrations are idempotent,
+        so a retry resumes a half-applied one)
+        """
+        if self._table_initialized or time.monotonic() < self._schema_retry_at:
             return
             
-        # Force a connection from the connection pool or create a new connection
         current_conn = None
         try:
-            if self._pool:
-                current_conn = self._pool.connection()
-                print("Obtain a connection from the connection pool for table initialization")
-            else:
-                # Alternative solution: Create a connection directly
-                current_conn = MySQLdb.connect(
-                    host=self.config['host'],
-                    user=self.config['user'],
-                    passwd=self.config['password'],
-                    db=self.config['database'],
-                    port=self.config['port'],
-                    connect_timeout=10,
-                    cursorclass=MySQLdb.cursors.DictCursor
-                )
-                print("Create a connection directly for table initialization")
-
-            with current_conn.cursor() as cursor:
-                # User Table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        username VARCHAR(50) UNIQUE,
-                        password VARCHAR(255),
-                        email VARCHAR(100) UNIQUE,
-                        full_name VARCHAR(100),
-                        interests TEXT,
-                        learning_style TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        last_login TIMESTAMP NULL,
-                        is_active BOOLEAN DEFAULT TRUE,
-                        version INT DEFAULT 1
-                    )
-                ''')
-                
-                # Learning Path table
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS learning_paths (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT,
-                        subject VARCHAR(100),
-                        progress FLOAT DEFAULT 0.0,
-                        difficulty_level VARCHAR(10),
-                        content JSON,
-                        target_completion_date DATE,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
-                        is_active BOOLEAN DEFAULT FALSE,
-                        version INT DEFAULT 1,
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                        INDEX idx_user_id_subject (user_id, subject),
-                        INDEX idx_last_updated (last_updated)
-                    )
-                ''')
-                
-                # Learning Activity Schedule
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS learning_activities (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT,
-                        path_id INT,
-                        topic_name VARCHAR(100),
-                        progress FLOAT DEFAULT 0.0,
-                        total_score FLOAT DEFAULT 0.0,
-                        total_minutes DECIMAL(10,2) DEFAULT 0.00,
-                        content JSON,
-                        activity_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        version INT DEFAULT 1,
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                        FOREIGN KEY (path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
-                        INDEX idx_user_id_activity_date (user_id, activity_date)
-                    )
-                ''')
-                
-                # Evaluation Form
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS assessments (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT,
-                        subject VARCHAR(100),
-                        topic_name VARCHAR(100),
-                        content JSON,  
-                        taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,  
-                        version INT DEFAULT 1,
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,  
-                        INDEX idx_user_id_subject_topic_name (user_id, subject, topic_name) 
-                    )
-                ''')
-                
-                # Path Evaluation Form
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS path_assessments (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        learning_path_id INT,
-                        user_id INT,
-                        question TEXT,
-                        user_answer TEXT,
-                        score FLOAT,
-                        feedback TEXT,
-                        difficulty_level VARCHAR(10),
-                        question_type VARCHAR(10),
-                        completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        version INT DEFAULT 1,
-                        FOREIGN KEY (learning_path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                        INDEX idx_learning_path_id (learning_path_id)
-                    )
-                ''')
-                
-                # Certificate Form
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS certifications (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT,
-                        learning_path_id INT,
-                        completion_date DATE,
-                        certificate_number VARCHAR(50) UNIQUE,
-                        recipient_name VARCHAR(100),
-                        version INT DEFAULT 1,
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                        FOREIGN KEY (learning_path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
-                        INDEX idx_user_id_cert_date (user_id, completion_date)
-                    )
-                ''')
-                
-                # Learning Habits Chart
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS study_streaks (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT UNIQUE,
-                        current_streak_days INT DEFAULT 0,
-                        longest_streak_days INT DEFAULT 0,
-                        last_study_date DATE,
-                        version INT DEFAULT 1
-                    )
-                ''')
-                
-                # Study Schedule
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS study_schedules (
-                        id INT AUTO_INCREMENT PRIMARY KEY,
-                        user_id INT,
-                        path_id INT,
-                        schedule_json JSON,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        version INT DEFAULT 1,
-                        FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
-                        FOREIGN KEY (path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
-                        INDEX idx_user_id_path_id (user_id, path_id)
-                    )
-                ''')
-
-                # ========== Compatible with lower versions of MySQL: Check and add the version field ==========
-                tables = [
-                    'users', 'learning_paths', 'learning_activities', 
-                    'assessments', 'path_assessments', 'certifications', 
-                    'study_streaks', 'study_schedules'
-                ]
-                for table in tables:
-                    if not self._check_column_exists(cursor, table, 'version'):
-                        cursor.execute(f"ALTER TABLE {table} ADD COLUMN version INT DEFAULT 1")
-                        print(f"For table, {table} ,add version")
-
-            current_conn.commit()
+            current_conn, pooled = self._checkout_connection()
+            migrations.ensure_schema(current_conn)
             self._table_initialized = True
-            print("The table structure initialization (including the version field) has been completed!")
 
-        except MySQLdb.Error as e:
-            print(f"The table structure initialization failed: {e}")
-            if current_conn:
-                current_conn.rollback()
+        except (MySQLdb.Error, RuntimeError) as e:
+            self._schema_retry_at = time.monotonic() + self.SCHEMA_RETRY_SECONDS
+            print(f"The table structure initialization failed (retrying in {self.SCHEMA_RETRY_SECONDS:g}s): {e}")
         finally:
-            if current_conn:
+            if current_conn and pooled:
                 current_conn.close()
     
     def execute_query(self, query, params=None, commit=True):
-        """Execute the query with reconnect logic + Table initialization check"""
+        """Execute the query with reconnect logic + Table initialization check (joins the current unit of work)"""
         # Make sure the table has been initialized
         if not self._table_initialized:
             self._initialize_database()
 
-        max_reconnect = 2
-        reconnect_count = 0
+        uow = self._current_uow.get()
+        if uow is not None:
+            return uow.run(query, params)
 
-        while reconnect_count < max_reconnect:
+        # A standalone statement is its own unit of work: one checkout, one commit (none for reads)
+        read_only = not commit or query.strip().upper().startswith(('SELECT', 'SHOW'))
+        max_reconnect = 2
+        for reconnect_count in range(max_reconnect):
+            uow = None
             try:
-                current_conn = None
-                # Give priority to using the connection pool to obtain connections
-                if self._pool:
-                    current_conn = self._pool.connection()
-                elif not self.connection or not self.connection.open:
-                    print(f"Connection failed. Trying to reconnect（Attempt {reconnect_count+1}）")
-                    self._connect()
-                    current_conn = self.connection
-                    if not current_conn or not current_conn.open:
-                        reconnect_count += 1
-                        continue
-                else:
-                    current_conn = self.connection
-
-                with current_conn.cursor(MySQLdb.cursors.DictCursor) as cursor:
-                    cursor.execute(query, params or ())
-                
-                    if query.strip().upper().startswith('SELECT'):
-                        result = cursor.fetchall()
-                    elif query.strip().upper().startswith('INSERT'):
-                        result = cursor.lastrowid
-                        if commit:
-                            current_conn.commit()
-                    else:
-                        result = cursor.rowcount
-                        if commit:
-                            current_conn.commit()
-                    
-                    return result
-
+                with self.unit_of_work(read_only=read_only) as uow:
+                    result = uow.run(query, params)
             except MySQLdb.Error as e:
-                error_msg = str(e)
-                print(f"Query execution error: {error_msg}")
-                
-                if any(keyword in error_msg for keyword in ["Lost connection", "Connection refused", "not connected"]):
-                    reconnect_count += 1
-                    self.connection = None
-                    self.cursor = None
-                    continue
-                
-                # Use getattr security to check the autocommit status
-                if current_conn and not getattr(current_conn, 'autocommit', True):
-                    try:
-                        current_conn.rollback()
-                    except:
-                        pass
-                return False
+                if uow is not None and uow.last_error is None and not read_only:
+                    # The statement ran and the COMMIT failed: it may have been applied, so it is never replayed
+                    print(f"Commit failed, the statement is not retried: {e}")
+                    self._local.connection = None
+                    return False
+                print(f"Connection failed. Trying to reconnect（Attempt {reconnect_count+1}）: {e}")
+                self._local.connection = None
+                continue
+
+            error_msg = str(uow.last_error or "")
+            if any(keyword in error_msg for keyword in ["Lost connection", "Connection refused", "not connected"]):
+                self._local.connection = None
+                continue
+            return result
     
         print(f"Failed after {max_reconnect} reconnection attempts")
         return False
 
     
     def execute_batch(self, query, data, commit=True):
-        """Perform batch insertion"""
+        """Perform batch insertion (joins the current unit of work)"""
         # Make sure the table has been initialized
         if not self._table_initialized:
             self._initialize_database()
-            
+
+        uow = self._current_uow.get()
+        if uow is not None:
+            return uow.run(query, data, many=True)
+
         try:
-            current_conn = None
-            if self._pool:
-                current_conn = self._pool.connection()
-            elif not self.connection or not self.connection.open:
-                self._connect()
-                current_conn = self.connection
-                
-            if not current_conn:
-                print("No valid database connection available")
-                return False
-                
-            with current_conn.cursor(MySQLdb.cursors.DictCursor) as cursor:
-                cursor.executemany(query, data)
-                
-                if commit:
-                    current_conn.commit()
-                return cursor.rowcount
-                
+            with self.unit_of_work() as uow:
+                result = uow.run(query, data, many=True)
+                if not commit:
+                    uow.rollback_only = True
+            return result
         except MySQLdb.Error as e:
             print(f"Batch query execution error: {e}")
-            if current_conn:
-                try:
-                    current_conn.rollback()
-                except:
-                    pass
             return False
-    
+
+    def execute_atomic(self, statements):
+        """
+        Execute several statements on one connection and commit them once (all or nothing)
+        statements: [(query, params), ...]; params given as a list of tuples are run with executemany
+        A statement given as (query, params, True) must change at least one row, otherwise the group is rolled back
+        and the rowcounts up to (and including) that statement are returned
+        Inside unit_of_work() the group joins the enclosing unit, isolated by a savepoint
+        Return: the rowcount of each statement, or False after a rollback
+        """
+        outer = self._current_uow.get()
+        if outer is not None:
+            try:
+                return self._run_statement_group(outer, statements, savepoint=True)
+            except MySQLdb.Error as e:
+                print(f"Atomic statement group execution error: {e}")
+                outer.rollback_only = True
+                self._count_write('failures')
+                return False
+
+        for attempt in range(self.DEADLOCK_RETRIES + 1):
+            try:
+                with self.unit_of_work() as uow:
+                    results = self._run_statement_group(uow, statements)
+                if not uow.rollback_only:
+                    self._count_write('atomic_writes')
+                return results
+            except MySQLdb.Error as e:
+                # The server already rolled back the deadlock victim, so the group can be replayed right away
+                if e.args and e.args[0] in self.RETRYABLE_ERRORS and attempt < self.DEADLOCK_RETRIES:
+                    self._count_write('deadlock_retries')
+                    continue
+                print(f"Atomic statement group execution error: {e}")
+                self._count_write('failures')
+                return False
+        return False
+
+    def _run_statement_group(self, uow, statements, savepoint=False):
+        results = []
+        with uow.connection.cursor(MySQLdb.cursors.DictCursor) as cursor:
+            if savepoint:
+                cursor.execute("SAVEPOINT atomic_group")
+            for statement in statements:
+                query, params = statement[0], statement[1]
+                if isinstance(params, list):
+                    cursor.executemany(query, params)
+                else:
+                    cursor.execute(query, params or ())
+                uow.statements += 1
+                results.append(cursor.rowcount)
+                if len(statement) > 2 and statement[2] and cursor.rowcount == 0:
+                    if savepoint:
+                        cursor.execute("ROLLBACK TO SAVEPOINT atomic_group")
+                    else:
+                        uow.rollback_only = True
+                    self._count_write('group_rollbacks')
+                    return results
+        return results
+
+    # Server-side atomic write primitives: each one is a single statement, no read-modify-write and no retry sleeps
+    def update_fields(self, table, values, where, condition=None, condition_params=(), touch=None):
+        """UPDATE the given columns (and bump version); condition is an optional extra SQL guard"""
+        return self._write_one(
+            self.update_fields_statement(table, values, where, condition, condition_params, touch),
+            guard=(table, where) if condition else None
+        )
+
+    def increment(self, table, deltas, where, touch=None):
+        """Add the deltas to numeric columns on the server (col = col + %s)"""
+        return self._write_one(self.increment_statement(table, deltas, where, touch))
+
+    def json_set(self, table, column, path_values, where, condition=None, condition_params=(), touch=None):
+        """Set JSON paths inside a JSON column with JSON_SET; values are serialized and cast to JSON"""
+        return self._write_one(
+            self.json_set_statement(table, column, path_values, where, condition, condition_params, touch),
+            guard=(table, where) if condition else None
+        )
+
+    def upsert(self, table, values, update_columns=(), increment_columns=(), json_merge_columns=(),
+               condition=None, condition_params=(), touch=None):
+        """INSERT a row, or update it in place on a unique key conflict (optionally only when condition holds)"""
+        return self._write_one(self.upsert_statement(
+            table, values, update_columns, increment_columns, json_merge_columns, condition, condition_params, touch
+        ))
+
+    def update_fields_statement(self, table, values, where, condition=None, condition_params=(), touch=None):
+        assignments = [f"{self._identifier(col)} = %s" for col in values]
+        params = list(values.values())
+        return self._update_statement(table, assignments, params, where, condition, condition_params, touch)
+
+    def increment_statement(self, table, deltas, where, touch=None):
+        assignments = [f"{self._identifier(col)} = {self._identifier(col)} + %s" for col in deltas]
+        params = list(deltas.values())
+        return self._update_statement(table, assignments, params, where, None, (), touch)
+
+    def json_set_statement(self, table, column, path_values, where, condition=None, condition_params=(), touch=None):
+        column = self._identifier(column)
+        pairs = ", ".join("%s, CAST(%s AS JSON)" for _ in path_values)
+        assignments = [f"{column} = JSON_SET(COALESCE({column}, JSON_OBJECT()), {pairs})"]
+        params = []
+        for path, value in path_values.items():
+            params.extend([path, json.dumps(value)])
+        return self._update_statement(table, assignments, params, where, condition, condition_params, touch)
+
+    def upsert_statement(self, table, values, update_columns=(), increment_columns=(), json_merge_columns=(),
+                         condition=None, condition_params=(), touch=None, returning_id=None):
+        """
+        Build INSERT ... ON DUPLICATE KEY UPDATE. MySQL applies the assignments left to right, so version and the
+        timestamp go first and the data columns after them (JSON merges last): condition sees the existing row as
+        long as the columns it reads are assigned after the others. returning_id makes lastrowid report the
+        existing row's id on an update
+        """
+        table = self._identifier(table)
+        columns = [self._identifier(col) for col in values]
+        params = list(values.values())
+
+        def guarded(col, expr):
+            if not condition:
+                return f"{col} = {expr}", []
+            return f"{col} = IF({condition}, {expr}, {col})", list(condition_params)
+
+        assignments = []
+        if returning_id:
+            returning_id = self._identifier(returning_id)
+            assignments.append(f"{returning_id} = LAST_INSERT_ID({returning_id})")
+        for col, expr in (
+            [("version", "version + 1")]
+            + ([(self._identifier(touch), "NOW()")] if touch else [])
+            + [(self._identifier(c), f"{self._identifier(c)} + VALUES({self._identifier(c)})") for c in increment_columns]
+            + [(self._identifier(c), f"VALUES({self._identifier(c)})") for c in update_columns]
+            + [(self._identifier(c), f"JSON_MERGE_PATCH(COALESCE({self._identifier(c)}, JSON_OBJECT()), VALUES({self._identifier(c)}))")
+               for c in json_merge_columns]
+        ):
+            assignment, extra = guarded(col, expr)
+            assignments.append(assignment)
+            params.extend(extra)
+
+        query = (
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) "
+            f"ON DUPLICATE KEY UPDATE {', '.join(assignments)}"
+        )
+        return query, tuple(params)
+
+    def upsert_content(self, table, key_values, content, content_column='content', touch=None):
+        """
+        Store a JSON document under a unique key, skipping unchanged content. The SHA-256 of the document is kept
+        in content_hash and the upsert guard turns a repeat of the stored hash into a no-op (one statement, no
+        row write). The database is always asked: rows may be deleted by another process or by a cascade
+        Return: the row id (existing or new), or False on error
+        """
+        serialized = content if isinstance(content, str) else json.dumps(content, sort_keys=True)
+        content_hash = hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+        values = dict(key_values)
+        values[content_column] = serialized
+        values['content_hash'] = content_hash
+        query, params = self.upsert_statement(
+            table, values,
+            update_columns=[content_column, 'content_hash'],
+            condition="NOT (content_hash <=> VALUES(content_hash))",
+            touch=touch,
+            returning_id='id'
+        )
+        return self.execute_query(query, params)
+
+    def _update_statement(self, table, assignments, params, where, condition, condition_params, touch):
+        assignments = list(assignments) + ["version = version + 1"]
+        if touch:
+            assignments.append(f"{self._identifier(touch)} = NOW()")
+        clauses = [f"{self._identifier(col)} = %s" for col in where]
+        params = list(params) + list(where.values())
+        if condition:
+            clauses.append(f"({condition})")
+            params.extend(condition_params)
+        query = f"UPDATE {self._identifier(table)} SET {', '.join(assignments)} WHERE {' AND '.join(clauses)}"
+        return query, tuple(params)
+
+    def _write_one(self, statement, guard=None):
+        """
+        Run one primitive statement; return its rowcount (0 when nothing matched) or False on error
+        A 0 rowcount is a conflict only when guard (table, where) names a row that exists, i.e. the version/condition
+        guard failed; a vanished row or a guarded upsert with nothing to change is counted as a no-op
+        """
+        results = self.execute_atomic([statement])
+        if results is False:
+            return False
+        rowcount = results[0] if results else 0
+        if rowcount == 0:
+            self._count_write('conflicts' if guard and self._row_exists(*guard) else 'noops')
+        return rowcount
+
+    def _row_exists(self, table, where):
+        clauses = " AND ".join(f"{self._identifier(col)} = %s" for col in where)
+        rows = self.execute_query(
+            f"SELECT 1 AS found FROM {self._identifier(table)} WHERE {clauses} LIMIT 1", tuple(where.values())
+        )
+        return bool(rows)
+
+    @staticmethod
+    def _identifier(name):
+        if not DataManager.IDENTIFIER_PATTERN.match(str(name)):
+            raise ValueError(f"Invalid SQL identifier: {name}")
+        return name
+
+    @staticmethod
+    def json_path_key(*keys):
+        """Build a JSON path such as $."key"."other" that is safe for arbitrary key names"""
+        return "$" + "".join("." + json.dumps(str(key)) for key in keys)
+
+    def _count_write(self, counter):
+        with self._write_stats_lock:
+            self.write_stats[counter] = self.write_stats.get(counter, 0) + 1
+
+    def get_write_stats(self):
+        """
+        Counters of the atomic write path: commits, guard conflicts (the row exists but its version/condition guard
+        failed), no-ops (nothing to change, or the row is gone), rolled-back groups, immediate deadlock retries, failures
+        """
+        with self._write_stats_lock:
+            return dict(self.write_stats)
+
+    def reconcile_study_totals(self, chunk_size=500):
+        """Recompute user_study_totals from learning_activities, one chunk of users per statement"""
+        last_id = 0
+        reconciled = 0
+        while True:
+            users = self.execute_query(
+                "SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s", (last_id, chunk_size)
+            )
+            if not users:
+                break
+            first_id, last_id = users[0]['id'], users[-1]['id']
+            result = self.execute_query('''
+                INSERT INTO user_study_totals (user_id, total_minutes)
+                SELECT u.id, COALESCE(SUM(la.total_minutes), 0)
+                FROM users u
+                LEFT JOIN learning_activities la ON la.user_id = u.id
+                WHERE u.id BETWEEN %s AND %s
+                GROUP BY u.id
+                ON DUPLICATE KEY UPDATE total_minutes = VALUES(total_minutes), version = version + 1
+            ''', (first_id, last_id))
+            if result is False:
+                print(f"Study time reconciliation failed for users {first_id}-{last_id}")
+                return False
+            reconciled += len(users)
+        return reconciled
+
     def get_user_by_id(self, user_id):
         query = "SELECT * FROM users WHERE id = %s"
         result = self.execute_query(query, (user_id,))
         return result[0] if result else None
     
-    @lru_cache(maxsize=32)
     def get_learning_paths(self, user_id):
-        query = "SELECT * FROM learning_paths WHERE user_id = %s ORDER BY last_updated DESC"
-        return self.execute_query(query, (user_id,))
+        """All learning paths of a user (newest first), served from the versioned read-through cache"""
+        rows = self.learning_paths_cache.get(
+            user_id,
+            loader=lambda: self.execute_query(
+                "SELECT * FROM learning_paths WHERE user_id = %s ORDER BY created_at DESC", (user_id,)
+            ),
+            version_probe=lambda: self._learning_paths_version(user_id)
+        )
+        # Hand out copies so callers can modify rows without touching the shared cache
+        return [dict(row) for row in rows] if rows else rows
+
+    def _learning_paths_version(self, user_id):
+        """Version token of a user's paths: every update bumps version, inserts/deletes change the count or max id"""
+        result = self.execute_query('''
+            SELECT COUNT(*) AS total, COALESCE(SUM(version), 0) AS version_sum, COALESCE(MAX(id), 0) AS max_id
+            FROM learning_paths WHERE user_id = %s
+        ''', (user_id,))
+        if not result:
+            return None
+        row = result[0]
+        return (int(row['total']), int(row['version_sum']), int(row['max_id']))
+
+    def invalidate_learning_paths(self, user_id=None):
+        """Invalidate the cached paths of a user after a local write (other processes catch up via the version probe)"""
+        self.learning_paths_cache.invalidate(user_id)
+
+    def revalidate_learning_paths(self, user_id):
+        """Check the cached paths of a user against the version probe on the next read (reloaded only if changed)"""
+        self.learning_paths_cache.expire(user_id)
     
     def update_study_streak(self, user_id):
         today = datetime.now().date()
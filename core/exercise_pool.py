@@ -0,0 +1,149 @@
+# Pool of pre-generated exercises per (subject, topic, difficulty), refilled in the background
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .data_manager import DataManager
+
+logger = logging.getLogger(__name__)
+
+
+class ExercisePool:
+    """
+    Exercises are stored once per bucket (normalized subject, topic and difficulty) and deduplicated by question
+    text, shared by every user. A draw hands a user exercises they have not seen yet; when the bucket holds fewer
+    than low_water exercises one background refill (per bucket, whoever triggers it) generates more
+    """
+    def __init__(self, low_water=20, refill_batch=10, max_refill_calls=3, max_per_bucket=300, max_workers=2):
+        self.low_water = low_water
+        self.refill_batch = refill_batch  # Exercises requested per generation call
+        self.max_refill_calls = max_refill_calls  # Generation calls per refill at most
+        self.max_per_bucket = max_per_bucket  # The oldest exercises are dropped beyond this
+        self.max_workers = max_workers
+        self.data_manager = DataManager()
+        self._executor = None
+        self._refilling = set()  # Buckets with a refill in flight
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def normalize(text):
+        return re.sub(r'\s+', ' ', str(text or '')).strip().lower()
+
+    @classmethod
+    def bucket_key(cls, subject, topic, difficulty):
+        raw = "\x00".join(cls.normalize(part) for part in (subject, topic, difficulty))
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def question_hash(cls, exercise):
+        return hashlib.sha256(cls.normalize(exercise.get('question')).encode('utf-8')).hexdigest()
+
+    def draw(self, user_id, subject, topic, difficulty, count):
+        """
+        count exercises of the bucket the user has not seen yet, marked as seen; None when the pool cannot
+        supply a full set (the caller then generates them live)
+        """
+        bucket = self.bucket_key(subject, topic, difficulty)
+        rows = self.data_manager.execute_query('''
+            SELECT p.id, p.exercise FROM exercise_pool p
+            LEFT JOIN exercise_pool_seen s ON s.exercise_id = p.id AND s.user_id = %s
+            WHERE p.bucket_key = %s AND s.exercise_id IS NULL
+            ORDER BY RAND() LIMIT %s
+        ''', (user_id, bucket, count))
+        if not rows or len(rows) < count:
+            return None
+        self.mark_seen(user_id, [row['id'] for row in rows])
+        return [json.loads(row['exercise']) if isinstance(row['exercise'], (str, bytes)) else row['exercise'] for row in rows]
+
+    def add(self, subject, topic, difficulty, exercises):
+        """Store exercises in their bucket (duplicates are ignored); returns the ids of the given exercises"""
+        if not exercises:
+            return []
+        bucket = self.bucket_key(subject, topic, difficulty)
+        hashes = [self.question_hash(exercise) for exercise in exercises]
+        self.data_manager.execute_batch('''
+            INSERT IGNORE INTO exercise_pool
+            (bucket_key, subject, topic_name, difficulty_level, question_hash, exercise, created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, NOW())
+        ''', [
+            (bucket, subject, topic, difficulty, question_hash, json.dumps(exercise))
+            for question_hash, exercise in zip(hashes, exercises)
+        ])
+        placeholders = ", ".join(["%s"] * len(hashes))
+        rows = self.data_manager.execute_query(f'''
+            SELECT id FROM exercise_pool WHERE bucket_key = %s AND question_hash IN ({placeholders})
+        ''', (bucket, *hashes)) or []
+        self._trim(bucket)
+        return [row['id'] for row in rows]
+
+    def mark_seen(self, user_id, exercise_ids):
+        if exercise_ids:
+            self.data_manager.execute_batch('''
+                INSERT IGNORE INTO exercise_pool_seen (user_id, exercise_id, seen_at) VALUES (%s, %s, NOW())
+            ''', [(user_id, exercise_id) for exercise_id in exercise_ids])
+
+    def stock(self, subject, topic, difficulty):
+        """Exercises stored in the bucket"""
+        rows = self.data_manager.execute_query('''
+            SELECT COUNT(*) AS stock FROM exercise_pool WHERE bucket_key = %s
+        ''', (self.bucket_key(subject, topic, difficulty),))
+        return int(rows[0]['stock']) if rows else 0
+
+    def unseen_count(self, user_id, subject, topic, difficulty):
+        rows = self.data_manager.execute_query('''
+            SELECT COUNT(*) AS unseen FROM exercise_pool p
+            LEFT JOIN exercise_pool_seen s ON s.exercise_id = p.id AND s.user_id = %s
+            WHERE p.bucket_key = %s AND s.exercise_id IS NULL
+        ''', (user_id, self.bucket_key(subject, topic, difficulty)))
+        return int(rows[0]['unseen']) if rows else 0
+
+    def ensure_stock(self, subject, topic, difficulty, generate):
+        """
+        Schedule a background refill when the bucket holds fewer than low_water exercises (at most one per bucket,
+        however many users draw from it). generate(count) returns freshly generated exercises (empty or None on failure)
+        """
+        bucket = self.bucket_key(subject, topic, difficulty)
+        with self._lock:
+            if bucket in self._refilling:
+                return False
+            self._refilling.add(bucket)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="exercise_pool")
+        self._executor.submit(self._refill, bucket, subject, topic, difficulty, generate)
+        return True
+
+    def _refill(self, bucket, subject, topic, difficulty, generate):
+        try:
+            for _ in range(self.max_refill_calls):
+                if self.stock(subject, topic, difficulty) >= self.low_water:
+                    break
+                exercises = generate(self.refill_batch)
+                if not exercises:
+                    break
+                self.add(subject, topic, difficulty, exercises)
+        except Exception as e:
+            logger.error(f"Exercise pool refill failed ({subject} / {topic}): {str(e)}")
+        finally:
+            with self._lock:
+                self._refilling.discard(bucket)
+
+    def _trim(self, bucket):
+        """Drop the oldest exercises of an overfull bucket (their seen marks cascade)"""
+        self.data_manager.execute_query('''
+            DELETE FROM exercise_pool WHERE bucket_key = %s AND id < (
+                SELECT min_id FROM (
+                    SELECT id AS min_id FROM exercise_pool WHERE bucket_key = %s
+                    ORDER BY id DESC LIMIT 1 OFFSET %s
+                ) AS newest
+            )
+        ''', (bucket, bucket, self.max_per_bucket - 1))
+
+
+# One pool per process; its refills run in the background
+exercise_pool = ExercisePool(
+    low_water=int(os.environ.get("EXERCISE_POOL_LOW_WATER", 20)),
+    max_per_bucket=int(os.environ.get("EXERCISE_POOL_MAX_PER_BUCKET", 300))
+)
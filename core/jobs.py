@@ -0,0 +1,219 @@
+# Background generation jobs: rows in generation_jobs, run by a thread pool, polled by the UI
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from .data_manager import DataManager
+
+logger = logging.getLogger(__name__)
+
+
+class JobContext:
+    """What a handler sees of its job: the stored parameters, in-memory runtime objects and a progress reporter"""
+    def __init__(self, queue, job_id, user_id, kind, params, runtime):
+        self.queue = queue
+        self.id = job_id
+        self.user_id = user_id
+        self.kind = kind
+        self.params = params
+        self.runtime = runtime or {}
+
+    def report_progress(self, text):
+        """Store a short progress message (also refreshes the job's heartbeat)"""
+        self.queue.update_running(self.id, {'progress': str(text)[:255]})
+
+
+class JobQueue:
+    """
+    Submit returns a job id at once; the job runs on a worker thread and its status is read back with one
+    primary-key lookup. Claiming is a guarded UPDATE (queued -> running), so a job runs at most once even when
+    several app processes share the database
+    """
+    ACTIVE_STATUSES = ('queued', 'running')
+
+    def __init__(self, max_workers=4, stale_seconds=900, keep_days=7):
+        self.max_workers = max_workers
+        self.stale_seconds = stale_seconds  # A job without a heartbeat for this long is considered interrupted
+        self.heartbeat_seconds = max(1, stale_seconds // 3)  # A running job refreshes its row this often
+        self.keep_days = keep_days  # Finished jobs are purged after this many days
+        self.data_manager = DataManager()
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._handlers = {}
+        # Objects the job needs but that must not be persisted (e.g. the AI agent holding the API key)
+        self._runtime = {}
+        self._executor = None
+        self._recovered_at = None  # time.monotonic() of the last _recover
+        self._lock = threading.Lock()
+
+    def register(self, kind, handler):
+        """handler(job: JobContext) runs the job and returns the id of the row it produced"""
+        self._handlers[kind] = handler
+
+    def submit(self, user_id, kind, params, runtime=None):
+        """Queue a job and return its id (None when it could not be stored)"""
+        if kind not in self._handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        job_id = self.data_manager.execute_query('''
+            INSERT INTO generation_jobs (user_id, kind, status, params, progress, created_at)
+            VALUES (%s, %s, 'queued', %s, 'Queued', NOW())
+        ''', (user_id, kind, json.dumps(params)))
+        if not job_id:
+            logger.error(f"Failed to queue a {kind} job for user {user_id}")
+            return None
+        with self._lock:
+            self._runtime[job_id] = runtime
+        try:
+            self._get_executor().submit(self._run, job_id)
+        except Exception as e:
+            # E.g. the executor is shutting down: nothing will ever claim the row
+            with self._lock:
+                self._runtime.pop(job_id, None)
+            logger.error(f"Failed to schedule {kind} job {job_id}: {str(e)}")
+            self._fail_queued(job_id, 'Could not be scheduled, please try again')
+        return job_id
+
+    def status(self, job_id, user_id):
+        """The job's status row (id, kind, status, progress, result_id, error), or None"""
+        rows = self.data_manager.execute_query('''
+            SELECT id, kind, status, progress, result_id, error
+            FROM generation_jobs WHERE id = %s AND user_id = %s
+        ''', (job_id, user_id))
+        if rows and rows[0]['status'] in self.ACTIVE_STATUSES:
+            # A job whose failure could not be recorded is failed as stale, so polling always ends
+            self._recover_if_due()
+        return rows[0] if rows else None
+
+    def active_jobs(self, user_id, kind=None):
+        """The user's queued or running jobs, oldest first"""
+        query = '''
+            SELECT id, kind, status, progress FROM generation_jobs
+            WHERE user_id = %s AND status IN ('queued', 'running')
+        '''
+        params = [user_id]
+        if kind:
+            query += " AND kind = %s"
+            params.append(kind)
+        return self.data_manager.execute_query(query + " ORDER BY id", tuple(params)) or []
+
+    def update_running(self, job_id, values, touch=None):
+        """
+        Update a job that is still running on this worker; 0 when it is not (e.g. another process failed it as
+        stale), so an outcome never overwrites the status recorded since
+        """
+        return self.data_manager.update_fields(
+            'generation_jobs', values, {'id': job_id},
+            condition="status = 'running' AND worker = %s", condition_params=(self.worker_id,), touch=touch
+        )
+
+    def _heartbeat(self, job_id, stop_event):
+        """Keep a long handler's row fresh, so _recover in another process does not take it for interrupted"""
+        while not stop_event.wait(self.heartbeat_seconds):
+            try:
+                if self.update_running(job_id, {}) != 1:
+                    return
+            except Exception as e:
+                logger.warning(f"Job {job_id} heartbeat failed: {str(e)}")
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="jobs")
+                self._recovered_at = time.monotonic()
+                self._recover()
+            return self._executor
+
+    def _recover_if_due(self):
+        """Run _recover again at most once per heartbeat interval"""
+        with self._lock:
+            if self._recovered_at is not None and time.monotonic() - self._recovered_at < self.heartbeat_seconds:
+                return
+            self._recovered_at = time.monotonic()
+        self._recover()
+
+    def _fail_queued(self, job_id, error):
+        """Fail a job that never started (it could not be scheduled or claimed), so the UI stops polling it"""
+        try:
+            failed = self.data_manager.update_fields(
+                'generation_jobs', {'status': 'failed', 'error': error, 'progress': 'Failed'},
+                {'id': job_id}, condition="status = 'queued'", touch='finished_at'
+            )
+        except Exception as e:
+            logger.error(f"Job {job_id} could not be marked failed: {str(e)}")
+            failed = False
+        if failed is False:
+            logger.warning(f"Job {job_id} stays queued until it is failed as stale")
+
+    def _recover(self):
+        """
+        Fail the jobs that lost their worker (process restarted, or a failure that could not be recorded): their
+        runtime objects are gone, so they cannot be resumed and the user has to submit again. Also purge old
+        finished jobs
+        """
+        self.data_manager.execute_query('''
+            UPDATE generation_jobs
+            SET status = 'failed', error = 'Interrupted, please try again', finished_at = NOW(), version = version + 1
+            WHERE status IN ('queued', 'running') AND updated_at < NOW() - INTERVAL %s SECOND
+        ''', (self.stale_seconds,))
+        self.data_manager.execute_query('''
+            DELETE FROM generation_jobs
+            WHERE status IN ('succeeded', 'failed') AND finished_at < NOW() - INTERVAL %s DAY
+        ''', (self.keep_days,))
+
+    def _run(self, job_id):
+        with self._lock:
+            runtime = self._runtime.pop(job_id, None)
+
+        # 1. Claim the job (another process may have taken it already)
+        try:
+            claimed = self.data_manager.update_fields(
+                'generation_jobs', {'status': 'running', 'worker': self.worker_id, 'progress': 'Started'},
+                {'id': job_id}, condition="status = 'queued'", touch='started_at'
+            )
+        except Exception as e:
+            logger.error(f"Job {job_id} could not be claimed: {str(e)}")
+            claimed = False
+        if claimed is False:
+            # The claim itself failed (pool or connection error), not lost to another process
+            self._fail_queued(job_id, 'Could not be started, please try again')
+            return
+        if claimed != 1:
+            return
+
+        rows = self.data_manager.execute_query(
+            "SELECT user_id, kind, params FROM generation_jobs WHERE id = %s", (job_id,)
+        )
+        if not rows:
+            self.update_running(job_id, {'status': 'failed', 'error': 'Could not be started, please try again'},
+                                touch='finished_at')
+            return
+        row = rows[0]
+        params = json.loads(row['params']) if isinstance(row['params'], str) else (row['params'] or {})
+        job = JobContext(self, job_id, row['user_id'], row['kind'], params, runtime)
+
+        # 2. Run the handler (heartbeat on the side) and persist the outcome, only if the job is still ours
+        stop_event = threading.Event()
+        threading.Thread(
+            target=self._heartbeat, args=(job_id, stop_event), name=f"job_{job_id}_heartbeat", daemon=True
+        ).start()
+        try:
+            result_id = self._handlers[row['kind']](job)
+            stop_event.set()
+            updated = self.update_running(
+                job_id, {'status': 'succeeded', 'result_id': result_id, 'progress': 'Done'}, touch='finished_at'
+            )
+        except Exception as e:
+            stop_event.set()
+            logger.error(f"Job {job_id} ({row['kind']}) failed: {str(e)}")
+            updated = self.update_running(job_id, {'status': 'failed', 'error': str(e)[:1000]}, touch='finished_at')
+        if updated != 1:
+            logger.warning(f"Job {job_id} was no longer running on this worker, its outcome was not recorded")
+
+
+# One queue per process; several users' jobs run in parallel on its workers
+job_queue = JobQueue(
+    max_workers=int(os.environ.get("JOB_WORKERS", 4)),
+    stale_seconds=int(os.environ.get("JOB_STALE_SECONDS", 900))
+)
@@ -0,0 +1,212 @@
+# Content-addressed cache of LLM responses: in-memory LRU tier in front of a SQLite tier on disk
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds a response stays valid, per feature. 0 (or a feature that is not listed) means never cached:
+# sampling-sensitive features (fresh exercises, motivational messages, chat) must not repeat themselves
+FEATURE_TTLS = {
+    "learning_path_outline": 7 * 24 * 3600,
+    "learning_path_topic": 7 * 24 * 3600,
+    "study_schedule": 3600,
+    "assistance": 24 * 3600,
+    "answer_evaluation": 24 * 3600,
+    "answer_evaluation_bulk": 24 * 3600,
+    "chat_summary": 24 * 3600,
+    "practice_exercises": 0,
+    "practice_exercises_refill": 0,
+    "motivational_message": 0,
+    "study_reminder": 0,
+    "chat": 0,
+}
+
+
+def feature_ttl(feature):
+    """TTL of a feature, overridable with LLM_CACHE_TTL_<FEATURE> (seconds)"""
+    if not feature:
+        return 0
+    override = os.environ.get(f"LLM_CACHE_TTL_{feature.upper()}")
+    if override is not None:
+        try:
+            return float(override)
+        except ValueError:
+            logger.warning(f"Invalid LLM_CACHE_TTL_{feature.upper()}: {override}")
+    return FEATURE_TTLS.get(feature, 0)
+
+
+class LLMResponseCache:
+    """Responses keyed by a hash of (model, messages, temperature, response_format), with LRU/TTL eviction"""
+    def __init__(self, path, memory_size=256, disk_max_entries=20000):
+        self.path = path
+        self.memory_size = memory_size
+        self.disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()  # key -> (value, expires_at)
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._writes_since_trim = 0
+        self._stats = {}
+
+    @staticmethod
+    def make_key(model, messages, temperature, response_format):
+        payload = json.dumps(
+            {"model": model, "messages": messages, "temperature": temperature, "response_format": response_format},
+            sort_keys=True, ensure_ascii=False
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key, feature):
+        """The cached response, or None (memory first, then disk; a disk hit is promoted to memory)"""
+        now = time.time()
+        value = None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self._memory.move_to_end(key)
+                    value = entry[0]
+                else:
+                    del self._memory[key]
+        if value is not None:
+            self._count(feature, "memory_hits")
+            return value
+
+        row = self._disk_get(key, now)
+        if row is not None:
+            value, expires_at = row
+            self._remember(key, value, expires_at)
+            self._count(feature, "disk_hits")
+            return value
+
+        self._count(feature, "misses")
+        return None
+
+    def set(self, key, feature, value, ttl):
+        if ttl <= 0 or not isinstance(value, str) or not value:
+            return
+        expires_at = time.time() + ttl
+        self._remember(key, value, expires_at)
+        self._disk_set(key, feature, value, expires_at)
+        self._count(feature, "stores")
+
+    def stats(self):
+        """Per-feature counters and hit rates"""
+        with self._lock:
+            features = {name: dict(counters) for name, counters in self._stats.items()}
+            memory_entries = len(self._memory)
+        for counters in features.values():
+            hits = counters.get("memory_hits", 0) + counters.get("disk_hits", 0)
+            lookups = hits + counters.get("misses", 0)
+            counters["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        return {"memory_entries": memory_entries, "features": features}
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        db = self._connect()
+        if db is not None:
+            with self._db_lock:
+                db.execute("DELETE FROM llm_responses")
+                db.commit()
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._memory[key] = (value, expires_at)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def _count(self, feature, counter):
+        with self._lock:
+            counters = self._stats.setdefault(feature or "default", {})
+            counters[counter] = counters.get(counter, 0) + 1
+
+    def _connect(self):
+        """Open the SQLite tier lazily; the cache keeps working in memory only if the disk is unavailable"""
+        if self._db is not None or not self.path:
+            return self._db
+        with self._db_lock:
+            if self._db is None:
+                try:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    db = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+                    db.execute("PRAGMA journal_mode=WAL")
+                    db.execute('''
+                        CREATE TABLE IF NOT EXISTS llm_responses (
+                            key TEXT PRIMARY KEY,
+                            feature TEXT,
+                            value TEXT NOT NULL,
+                            expires_at REAL NOT NULL,
+                            accessed_at REAL NOT NULL
+                        )
+                    ''')
+                    db.execute("CREATE INDEX IF NOT EXISTS idx_accessed_at ON llm_responses (accessed_at)")
+                    db.commit()
+                    self._db = db
+                except sqlite3.Error as e:
+                    logger.warning(f"The LLM disk cache is unavailable ({self.path}): {str(e)}")
+                    self.path = None
+        return self._db
+
+    def _disk_get(self, key, now):
+        db = self._connect()
+        if db is None:
+            return None
+        try:
+            with self._db_lock:
+                row = db.execute(
+                    "SELECT value, expires_at FROM llm_responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    return None
+                if row[1] <= now:
+                    db.execute("DELETE FROM llm_responses WHERE key = ?", (key,))
+                    db.commit()
+                    return None
+                db.execute("UPDATE llm_responses SET accessed_at = ? WHERE key = ?", (now, key))
+                db.commit()
+            return row
+        except sqlite3.Error as e:
+            logger.warning(f"LLM disk cache read failed: {str(e)}")
+            return None
+
+    def _disk_set(self, key, feature, value, expires_at):
+        db = self._connect()
+        if db is None:
+            return
+        try:
+            with self._db_lock:
+                db.execute(
+                    "INSERT OR REPLACE INTO llm_responses (key, feature, value, expires_at, accessed_at) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (key, feature, value, expires_at, time.time())
+                )
+                self._writes_since_trim += 1
+                if self._writes_since_trim >= 100:
+                    # Drop expired rows, then the least recently used ones beyond the size cap
+                    self._writes_since_trim = 0
+                    db.execute("DELETE FROM llm_responses WHERE expires_at <= ?", (time.time(),))
+                    db.execute('''
+                        DELETE FROM llm_responses WHERE key IN (
+                            SELECT key FROM llm_responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                        )
+                    ''', (self.disk_max_entries,))
+                db.commit()
+        except sqlite3.Error as e:
+            logger.warning(f"LLM disk cache write failed: {str(e)}")
+
+
+# One cache per process (LLM_CACHE_PATH="" keeps it in memory only)
+llm_cache = LLMResponseCache(
+    os.environ.get("LLM_CACHE_PATH", os.path.join("data", "llm_cache.sqlite3")),
+    memory_size=int(os.environ.get("LLM_CACHE_MEMORY_SIZE", 256)),
+    disk_max_entries=int(os.environ.get("LLM_CACHE_DISK_ENTRIES", 20000))
+)
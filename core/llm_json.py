@@ -0,0 +1,225 @@
+# Tolerant JSON parsing of LLM output (one linear pass, no regex rewrites of the whole text)
+import re
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class LLMJSONError(json.JSONDecodeError):
+    """No JSON value could be recovered from an LLM response; repairs lists what was attempted"""
+    def __init__(self, msg, doc, pos=0, repairs=()):
+        super().__init__(msg, doc, pos)
+        self.repairs = list(repairs)
+
+
+_JSON_SCALAR = re.compile(r'-?(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?|[A-Za-z_][A-Za-z0-9_]*')
+_BARE_WORDS = {"true": "true", "false": "false", "null": "null", "True": "true", "False": "false", "None": "null"}
+_CLOSERS = {"{": "}", "[": "]"}
+
+
+def parse_llm_json(text):
+    """
+    Parse the JSON value in an LLM response, repairing what models commonly get wrong:
+    code fences and surrounding prose, // and /* */ comments, trailing / doubled / missing commas,
+    raw control characters in strings, unquoted keys, Python literals ('single-quoted' strings,
+    True / False / None), mismatched brackets.
+    A truncated response is cut back to its last complete element, at whatever depth, and every open
+    container is closed, so a long generation is salvaged rather than discarded. Objects cut short keep the
+    members completed so far: callers validate the fields they require
+    Return: (data, repairs) where repairs names each kind of fix applied ([] for valid JSON)
+    Raises LLMJSONError (a json.JSONDecodeError) when nothing can be recovered
+    """
+    if not isinstance(text, str) or not text.strip():
+        raise LLMJSONError("Empty response", str(text or ""), 0)
+    try:
+        return json.loads(text), []
+    except ValueError:
+        pass
+
+    repairs = []
+    def note(repair):
+        if repair not in repairs:
+            repairs.append(repair)
+
+    starts = [pos for pos in (text.find("{"), text.find("[")) if pos != -1]
+    if not starts:
+        raise LLMJSONError("No JSON object or array found", text, 0)
+    i = min(starts)
+    if text[:i].strip():
+        note("code_fence" if "```" in text[:i] else "leading_text")
+
+    out = []  # Output pieces; whitespace outside strings is dropped
+    stack = []  # [bracket, expecting] with expecting in key / colon / value / comma
+    safe = None  # (len(out), open brackets) right after the last salvageable element
+    complete = False
+    n = len(text)
+
+    def mark_safe():
+        nonlocal safe
+        safe = (len(out), [entry[0] for entry in stack])
+
+    def begin_value(is_key=False):
+        """Insert a missing comma before a new element"""
+        if stack and stack[-1][1] == "comma":
+            note("missing_comma")
+            out.append(",")
+            stack[-1][1] = "key" if stack[-1][0] == "{" else "value"
+
+    def end_value():
+        nonlocal complete
+        if not stack:
+            complete = True
+            return
+        stack[-1][1] = "comma"
+        mark_safe()
+
+    while i < n and not complete:
+        ch = text[i]
+        if ch in " \t\r\n":
+            i += 1
+        elif ch == '"' or ch == "'":
+            is_key = bool(stack) and stack[-1][0] == "{" and stack[-1][1] in ("key", "comma")
+            begin_value(is_key)
+            # Copy the string, escaping raw control characters (and double quotes inside a single-quoted one)
+            if ch == "'":
+                note("single_quotes")
+            j = i + 1
+            piece = ['"']
+            while j < n and not (text[j] == ch and (ch == '"' or _closes_single_quote(text, j))):
+                c = text[j]
+                if c == "\\" and j + 1 < n:
+                    # \' is not a JSON escape
+                    piece.append("'" if text[j + 1] == "'" else text[j:j + 2])
+                    j += 2
+                    continue
+                if c < " ":
+                    note("control_character")
+                    piece.append(json.dumps(c)[1:-1])
+                elif c == '"':
+                    piece.append('\\"')
+                else:
+                    piece.append(c)
+                j += 1
+            if j >= n:
+                break  # Truncated inside a string
+            piece.append('"')
+            out.append("".join(piece))
+            i = j + 1
+            if is_key:
+                stack[-1][1] = "colon"
+            else:
+                end_value()
+        elif ch in "{[":
+            begin_value()
+            out.append(ch)
+            stack.append([ch, "key" if ch == "{" else "value"])
+            mark_safe()  # An empty container is a valid stopping point
+            i += 1
+        elif ch in "}]":
+            if not stack:
+                break
+            bracket = stack[-1][0]
+            if ch != _CLOSERS[bracket]:
+                note("mismatched_bracket")
+            if out and out[-1] == ",":
+                out.pop()
+                note("trailing_comma")
+            if bracket == "{" and stack[-1][1] in ("colon", "value"):
+                # A key without a value: drop the key (and its colon)
+                while out and out[-1] != "{" and out[-1] != ",":
+                    out.pop()
+                if out and out[-1] == ",":
+                    out.pop()
+                note("dangling_key")
+            out.append(_CLOSERS[bracket])
+            stack.pop()
+            i += 1
+            end_value()
+        elif ch == ",":
+            if stack and stack[-1][1] == "comma":
+                out.append(",")
+                stack[-1][1] = "key" if stack[-1][0] == "{" else "value"
+            else:
+                note("extra_comma")
+            i += 1
+        elif ch == ":":
+            if stack and stack[-1][0] == "{" and stack[-1][1] == "colon":
+                out.append(":")
+                stack[-1][1] = "value"
+            else:
+                note("stray_character")
+            i += 1
+        elif ch == "/" and text.startswith("//", i):
+            note("comment")
+            end = text.find("\n", i)
+            i = n if end == -1 else end
+        elif ch == "/" and text.startswith("/*", i):
+            note("comment")
+            end = text.find("*/", i + 2)
+            i = n if end == -1 else end + 2
+        else:
+            match = _JSON_SCALAR.match(text, i)
+            if not match:
+                note("stray_character")
+                i += 1
+                continue
+            token = match.group(0)
+            if match.end() >= n:
+                break  # Truncated inside a number or word ("3" may have been "35", "tr" "true")
+            i = match.end()
+            if stack and stack[-1][0] == "{" and stack[-1][1] in ("key", "comma"):
+                begin_value(is_key=True)
+                note("unquoted_key")
+                out.append(json.dumps(token))
+                stack[-1][1] = "colon"
+                continue
+            begin_value()
+            if token in _BARE_WORDS:
+                if _BARE_WORDS[token] != token:
+                    note("python_literal")
+                out.append(_BARE_WORDS[token])
+            elif token[0].isalpha() or token[0] == "_":
+                note("unquoted_string")
+                out.append(json.dumps(token))
+            else:
+                if token.startswith(".") or token.startswith("-.") or token.endswith("."):
+                    note("number_format")
+                    token = token.replace("-.", "-0.")
+                    token = ("0" + token if token.startswith(".") else token).rstrip(".")
+                out.append(token)
+            end_value()
+
+    if complete:
+        if text[i:].strip().strip("`").strip():
+            note("trailing_text")
+    else:
+        # Truncated: cut back to the last complete element and close what is still open
+        if safe is None:
+            raise LLMJSONError("Truncated before any complete element", text, i, repairs)
+        note("truncated")
+        length, brackets = safe
+        del out[length:]
+        if out and out[-1] == ",":
+            out.pop()
+        out.extend(_CLOSERS[bracket] for bracket in reversed(brackets))
+
+    repaired = "".join(out)
+    try:
+        return json.loads(repaired), repairs
+    except ValueError as e:
+        raise LLMJSONError(f"Unrecoverable JSON ({e})", text, 0, repairs)
+
+
+def _closes_single_quote(text, j):
+    """A ' ends a single-quoted string only before , : } ] (or the end); otherwise it is an apostrophe"""
+    rest = text[j + 1:].lstrip()
+    return not rest or rest[0] in ",:}]"
+
+
+def load_llm_json(response, context):
+    """parse_llm_json for a feature's response, logging the repairs it needed"""
+    data, repairs = parse_llm_json(response)
+    if repairs:
+        logger.info(f"Repaired the {context} JSON response: {', '.join(repairs)}")
+    return data
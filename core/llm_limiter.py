@@ -0,0 +1,182 @@
+# Process-wide admission control for LLM calls: token-bucket rate limit + bounded concurrency, by priority
+import os
+import time
+import heapq
+import random
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Priority classes (lower is served first)
+INTERACTIVE = 0  # A student is waiting on the reply: chat, grading, help requests
+NORMAL = 1
+BACKGROUND = 2  # Generation that runs behind the UI: learning paths, pool refills
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", NORMAL: "normal", BACKGROUND: "background"}
+
+FEATURE_PRIORITIES = {
+    "chat": INTERACTIVE,
+    "chat_summary": INTERACTIVE,
+    "answer_evaluation": INTERACTIVE,
+    "answer_evaluation_bulk": INTERACTIVE,
+    "assistance": INTERACTIVE,
+    "practice_exercises": NORMAL,
+    "study_schedule": NORMAL,
+    "motivational_message": NORMAL,
+    "study_reminder": NORMAL,
+    "practice_exercises_refill": BACKGROUND,
+    "learning_path_outline": BACKGROUND,
+    "learning_path_topic": BACKGROUND,
+}
+
+
+def feature_priority(feature):
+    return FEATURE_PRIORITIES.get(feature, NORMAL)
+
+
+class LLMLimiter:
+    """
+    Every LLM request takes a slot: at most max_concurrency in flight, at most rate requests per second
+    (bursts up to burst). Waiters are served strictly by priority, then in arrival order. A server
+    Retry-After pauses admissions for the whole process instead of each caller sleeping on its own
+    """
+    def __init__(self, rate=5.0, burst=10, max_concurrency=8):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self._tokens = float(burst)
+        self._refilled_at = time.monotonic()
+        self._paused_until = 0.0
+        self._in_flight = 0
+        self._waiters = []  # heap of (priority, seq)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stats = {
+            name: {"granted": 0, "timeouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+            for name in PRIORITY_NAMES.values()
+        }
+        self._rate_limited = 0
+        self._max_queue_depth = 0
+
+    @contextmanager
+    def slot(self, feature=None, timeout=None):
+        """Hold an admission slot for one request (raises TimeoutError if none is granted within timeout)"""
+        self.acquire(feature_priority(feature), timeout)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def acquire(self, priority=NORMAL, timeout=None):
+        entry = (priority, next(self._seq))
+        started = time.monotonic()
+        deadline = started + timeout if timeout is not None else None
+        with self._cond:
+            heapq.heappush(self._waiters, entry)
+            self._max_queue_depth = max(self._max_queue_depth, len(self._waiters))
+            try:
+                while True:
+                    wait = self._admission_wait(entry)
+                    if wait == 0:
+                        heapq.heappop(self._waiters)
+                        self._tokens -= 1
+                        self._in_flight += 1
+                        break
+                    if deadline is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._waiters.remove(entry)
+                            heapq.heapify(self._waiters)
+                            self._stats[PRIORITY_NAMES[priority]]["timeouts"] += 1
+                            raise TimeoutError("No LLM request slot became available in time")
+                        wait = min(wait, remaining) if wait is not None else remaining
+                    self._cond.wait(wait)
+            finally:
+                # Whoever is at the head now may be admissible
+                self._cond.notify_all()
+
+            waited = time.monotonic() - started
+            stats = self._stats[PRIORITY_NAMES[priority]]
+            stats["granted"] += 1
+            stats["wait_total"] += waited
+            stats["wait_max"] = max(stats["wait_max"], waited)
+
+    def release(self):
+        with self._cond:
+            self._in_flight -= 1
+            self._cond.notify_all()
+
+    def pause(self, seconds):
+        """Stop admitting requests for a while (server asked us to back off); drains the bucket"""
+        with self._cond:
+            self._rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._cond.notify_all()
+        logger.warning(f"LLM rate limited by the server, pausing admissions for {seconds:.1f}s")
+
+    def _admission_wait(self, entry):
+        """0 when entry may go now, otherwise how long to wait (None: until notified). Caller holds the lock"""
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._refilled_at) * self.rate)
+        self._refilled_at = now
+        if self._waiters[0] != entry or self._in_flight >= self.max_concurrency:
+            return None
+        if now < self._paused_until:
+            return self._paused_until - now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        return 0
+
+    def stats(self):
+        """Queue depth, in-flight requests and wait times per priority class"""
+        with self._cond:
+            depth = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, _ in self._waiters:
+                depth[PRIORITY_NAMES[priority]] += 1
+            classes = {}
+            for name, stats in self._stats.items():
+                classes[name] = dict(stats, queued=depth[name])
+                classes[name]["wait_avg"] = round(stats["wait_total"] / stats["granted"], 4) if stats["granted"] else 0.0
+            return {
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._waiters),
+                "max_queue_depth": self._max_queue_depth,
+                "paused_for": round(max(0.0, self._paused_until - time.monotonic()), 2),
+                "rate_limited": self._rate_limited,
+                "classes": classes,
+            }
+
+
+def retry_decision(error, attempt, base_delay, max_delay=30.0):
+    """
+    (retryable, delay, from_server) for a failed request. 429s honor Retry-After (or retry-after-ms);
+    other transient failures use full-jitter exponential backoff; client errors (4xx) are not retried
+    """
+    status = getattr(error, "status_code", None)
+    if status is not None and 400 <= status < 500 and status not in (408, 409, 429):
+        return False, 0, False
+    if status == 429:
+        headers = getattr(getattr(error, "response", None), "headers", None) or {}
+        retry_after = None
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except (TypeError, ValueError):
+            retry_after = None
+        if retry_after is not None:
+            return True, min(retry_after, max_delay * 2), True
+    return True, random.uniform(0, min(max_delay, base_delay * (2 ** attempt))), status == 429
+
+
+# One limiter per process, shared by every session's agent
+llm_limiter = LLMLimiter(
+    rate=float(os.environ.get("LLM_RATE_PER_SECOND", 5)),
+    burst=int(os.environ.get("LLM_RATE_BURST", 10)),
+    max_concurrency=int(os.environ.get("LLM_MAX_CONCURRENCY", 8))
+)
@@ -0,0 +1,364 @@
+# Local OpenAI-compatible stand-in for the DeepSeek API: records real responses and replays them (or synthetic
+# fixtures) with configurable latency and injected errors, for offline benchmarks and load tests.
+#   python -m core.llm_standin --port 8765                      # replay
+#   python -m core.llm_standin --mode record --port 8765        # forward to DeepSeek and record
+# then run the app with DEEPSEEK_BASE_URL=http://127.0.0.1:8765/v1
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import logging
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import httpx
+from .llm_cache import LLMResponseCache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_FIXTURES_DIR = os.path.join("data", "llm_fixtures")
+DEFAULT_UPSTREAM = "https://api.deepseek.com/v1"
+
+
+class LatencyModel:
+    """
+    Simulated server time: "fixed:1.5", "uniform:0.5,3", "lognormal:2.0,0.6" (median seconds, sigma) or
+    "normal:2.0,0.5"; chunk_delay spaces the chunks of a streamed reply
+    """
+    def __init__(self, spec="fixed:0", chunk_delay=0.02, rng=None):
+        self.spec = spec
+        self.chunk_delay = chunk_delay
+        self.rng = rng or random.Random()
+        kind, _, args = spec.partition(":")
+        self.kind = kind
+        self.args = [float(a) for a in args.split(",") if a.strip()] or [0.0]
+        if kind not in ("fixed", "uniform", "lognormal", "normal"):
+            raise ValueError(f"Unknown latency distribution: {spec}")
+
+    def sample(self):
+        a = self.args
+        if self.kind == "uniform":
+            value = self.rng.uniform(a[0], a[1] if len(a) > 1 else a[0])
+        elif self.kind == "lognormal":
+            median = a[0]
+            value = median * self.rng.lognormvariate(0, a[1] if len(a) > 1 else 0.5) if median > 0 else 0
+        elif self.kind == "normal":
+            value = self.rng.gauss(a[0], a[1] if len(a) > 1 else 0)
+        else:
+            value = a[0]
+        return max(0.0, value)
+
+
+class FaultInjector:
+    """Fails a share of requests with an HTTP error (429s carry Retry-After)"""
+    def __init__(self, rate=0.0, statuses=(429, 500, 503), retry_after=1, rng=None):
+        self.rate = rate
+        self.statuses = tuple(statuses)
+        self.retry_after = retry_after
+        self.rng = rng or random.Random()
+
+    def pick(self):
+        if self.rate > 0 and self.rng.random() < self.rate:
+            return self.rng.choice(self.statuses)
+        return None
+
+
+class FixtureStore:
+    """
+    recorded/<key>.json: real responses keyed like the response cache (model, messages, temperature,
+    response_format). synthetic/*.json: responses chosen by a substring of the system prompt, with {variables}
+    captured from the user prompt and an optional list expanded to the requested count
+    """
+    def __init__(self, root=DEFAULT_FIXTURES_DIR):
+        self.root = root
+        self.recorded_dir = os.path.join(root, "recorded")
+        self.synthetic = []
+        self._lock = threading.Lock()
+        synthetic_dir = os.path.join(root, "synthetic")
+        if os.path.isdir(synthetic_dir):
+            for name in sorted(os.listdir(synthetic_dir)):
+                if name.endswith(".json"):
+                    with open(os.path.join(synthetic_dir, name), encoding="utf-8") as f:
+                        self.synthetic.append(json.load(f))
+
+    @staticmethod
+    def key(body):
+        return LLMResponseCache.make_key(
+            body.get("model"), body.get("messages"), body.get("temperature"), body.get("response_format")
+        )
+
+    def recorded(self, body):
+        path = os.path.join(self.recorded_dir, f"{self.key(body)}.json")
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["response"]["choices"][0]["message"]["content"]
+
+    def record(self, body, response):
+        os.makedirs(self.recorded_dir, exist_ok=True)
+        entry = {
+            "request": {k: body.get(k) for k in ("model", "messages", "temperature", "response_format")},
+            "response": response,
+        }
+        with self._lock:
+            with open(os.path.join(self.recorded_dir, f"{self.key(body)}.json"), "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False, indent=2)
+
+    def synthesize(self, body):
+        """(feature, content) of the first synthetic fixture matching the request, or (None, None)"""
+        messages = body.get("messages") or []
+        system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+        user = "\n".join(m.get("content", "") for m in messages if m.get("role") == "user")
+        for fixture in self.synthetic:
+            if fixture["match"] not in system:
+                continue
+            variables = {}
+            for name, pattern in fixture.get("variables", {}).items():
+                found = re.search(pattern, user)
+                variables[name] = found.group(1).strip() if found else name
+            response = json.loads(json.dumps(fixture["response"]))
+            repeat = fixture.get("repeat")
+            if repeat:
+                found = re.search(repeat["count"], user)
+                count = int(found.group(1)) if found else len(response[repeat["key"]])
+                templates = response[repeat["key"]]  # Used in turn
+                response[repeat["key"]] = [
+                    self._fill(templates[(n - 1) % len(templates)], dict(variables, n=str(n)))
+                    for n in range(1, count + 1)
+                ]
+            response = self._fill(response, variables)
+            content = response if isinstance(response, str) else json.dumps(response, ensure_ascii=False)
+            return fixture.get("feature"), content
+        return None, None
+
+    @classmethod
+    def _fill(cls, value, variables):
+        if isinstance(value, str):
+            whole = value.startswith("{") and value.endswith("}") and value[1:-1] in variables
+            for name, replacement in variables.items():
+                value = value.replace("{" + name + "}", replacement)
+            # A placeholder that is the whole value becomes a number when it is one ("index": "{n}")
+            return int(value) if whole and value.isdigit() else value
+        if isinstance(value, list):
+            return [cls._fill(item, variables) for item in value]
+        if isinstance(value, dict):
+            return {key: cls._fill(item, variables) for key, item in value.items()}
+        return value
+
+
+class StandInServer:
+    def __init__(self, mode="replay", fixtures=None, latency=None, faults=None, upstream=DEFAULT_UPSTREAM):
+        self.mode = mode
+        self.fixtures = fixtures or FixtureStore()
+        self.latency = latency or LatencyModel()
+        self.faults = faults or FaultInjector()
+        self.upstream = upstream.rstrip("/")
+        self._upstream_client = httpx.Client(timeout=httpx.Timeout(120, connect=10)) if mode == "record" else None
+        self.stats = {"requests": 0, "recorded": 0, "replayed": 0, "synthetic": 0, "misses": 0, "injected_errors": 0}
+        self._stats_lock = threading.Lock()
+        self.httpd = None
+
+    def count(self, name):
+        with self._stats_lock:
+            self.stats[name] += 1
+
+    def completion(self, body, authorization):
+        """(status, content or error message, extra headers)"""
+        self.count("requests")
+        status = self.faults.pick()
+        if status:
+            self.count("injected_errors")
+            headers = {"Retry-After": str(self.faults.retry_after)} if status == 429 else {}
+            return status, f"Injected error {status}", headers
+
+        if self.mode == "record":
+            upstream_body = dict(body, stream=False)
+            upstream_body.pop("stream_options", None)
+            response = self._upstream_client.post(
+                f"{self.upstream}/chat/completions", json=upstream_body,
+                headers={"Authorization": authorization or ""}
+            )
+            if response.status_code != 200:
+                return response.status_code, response.text[:500], {}
+            data = response.json()
+            self.fixtures.record(body, data)
+            self.count("recorded")
+            return 200, data["choices"][0]["message"]["content"], {}
+
+        content = self.fixtures.recorded(body)
+        if content is not None:
+            self.count("replayed")
+        else:
+            _, content = self.fixtures.synthesize(body)
+            if content is None:
+                self.count("misses")
+                return 404, "No recorded or synthetic response for this request", {}
+            self.count("synthetic")
+        time.sleep(self.latency.sample())
+        return 200, content, {}
+
+    def serve(self, host="127.0.0.1", port=8765):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.rstrip("/") in ("/v1/models", "/models"):
+                    self._json(200, {"object": "list", "data": [{"id": "deepseek-chat", "object": "model"}]})
+                elif self.path.rstrip("/") == "/stats":
+                    self._json(200, server.stats)
+                else:
+                    self._json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                if self.path.rstrip("/") not in ("/v1/chat/completions", "/chat/completions"):
+                    self._json(404, {"error": {"message": "Not found"}})
+                    return
+                length = int(self.headers.get("Content-Length") or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b"{}")
+                except ValueError:
+                    self._json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+                    return
+                try:
+                    status, content, headers = server.completion(body, self.headers.get("Authorization"))
+                except Exception as e:
+                    logger.error(f"Stand-in request failed: {str(e)}")
+                    status, content, headers = 502, str(e), {}
+                if status != 200:
+                    self._json(status, {"error": {"message": content, "type": "standin_error", "code": status}}, headers)
+                elif body.get("stream"):
+                    self._stream(body, content)
+                else:
+                    self._json(200, self._completion(body, content))
+
+            def _completion(self, body, content):
+                prompt_tokens, completion_tokens = self._usage(body, content)
+                return {
+                    "id": f"standin-{uuid.uuid4().hex[:12]}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body.get("model", "deepseek-chat"),
+                    "choices": [{
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop"
+                    }],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens
+                    }
+                }
+
+            def _stream(self, body, content):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Connection", "close")
+                self.end_headers()
+                self.close_connection = True
+                chunk_id = f"standin-{uuid.uuid4().hex[:12]}"
+                base = {"id": chunk_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                        "model": body.get("model", "deepseek-chat")}
+                pieces = re.findall(r"\S+\s*|\s+", content) or [""]
+                try:
+                    for piece in pieces:
+                        self._event(dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}]))
+                        time.sleep(server.latency.chunk_delay)
+                    self._event(dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}]))
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        prompt_tokens, completion_tokens = self._usage(body, content)
+                        self._event(dict(base, choices=[], usage={
+                            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                            "total_tokens": prompt_tokens + completion_tokens
+                        }))
+                    self.wfile.write(b"data: [DONE]\n\n")
+                    self.wfile.flush()
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # The client cancelled the stream
+
+            def _event(self, payload):
+                self.wfile.write(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.wfile.flush()
+
+            @staticmethod
+            def _usage(body, content):
+                prompt = "".join(m.get("content", "") for m in body.get("messages") or [])
+                return max(1, len(prompt) // 4), max(1, len(content) // 4)
+
+            def _json(self, status, payload, headers=None):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        return self.httpd
+
+    def start(self, host="127.0.0.1", port=8765):
+        """Serve on a daemon thread (for benchmarks driving the app in-process); returns the base URL"""
+        httpd = self.serve(host, port)
+        threading.Thread(target=httpd.serve_forever, name="llm_standin", daemon=True).start()
+        return f"http://{host}:{httpd.server_address[1]}/v1"
+
+    def stop(self):
+        if self.httpd is not None:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+        if self._upstream_client is not None:
+            self._upstream_client.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible LLM stand-in (record / replay)")
+    parser.add_argument("--mode", choices=["replay", "record"], default="replay")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--fixtures", default=DEFAULT_FIXTURES_DIR)
+    parser.add_argument("--upstream", default=DEFAULT_UPSTREAM, help="API base URL used in record mode")
+    parser.add_argument("--latency", default="fixed:0",
+                        help="fixed:S | uniform:LO,HI | lognormal:MEDIAN,SIGMA | normal:MEAN,STD (seconds)")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="Seconds between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests failed on purpose")
+    parser.add_argument("--error-status", default="429,500,503", help="Statuses used for injected errors")
+    parser.add_argument("--retry-after", type=int, default=1, help="Retry-After seconds sent with injected 429s")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for repeatable latency and errors")
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    server = StandInServer(
+        mode=args.mode,
+        fixtures=FixtureStore(args.fixtures),
+        latency=LatencyModel(args.latency, args.chunk_delay, rng),
+        faults=FaultInjector(args.error_rate, [int(s) for s in args.error_status.split(",") if s], args.retry_after, rng),
+        upstream=args.upstream
+    )
+    httpd = server.serve(args.host, args.port)
+    print(f"LLM stand-in ({args.mode}) on http://{args.host}:{args.port}/v1 "
+          f"with {len(server.fixtures.synthetic)} synthetic fixtures")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(json.dumps(server.stats))
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,277 @@
+# Telemetry of LLM calls: per-feature latency, time to first byte, attempts, token usage and cost
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger(__name__)
+
+# The call being made on this thread/task, so the HTTP response hook can stamp its time to first byte
+_active_call = contextvars.ContextVar("llm_active_call", default=None)
+
+
+class LLMCall:
+    """Timing of one logical call (all of its attempts)"""
+    def __init__(self, feature, stream=False):
+        self.feature = feature or "default"
+        self.stream = stream
+        self.started = time.monotonic()
+        self.attempt_started = self.started
+        self.attempts = 0
+        self.queue_wait = 0.0
+        self.ttfb = None
+        self.hedged = False  # A second, hedging request was sent
+        self._token = None
+
+    def begin_attempt(self):
+        self.attempts += 1
+        self.attempt_started = time.monotonic()
+        self.ttfb = None
+
+    def admitted(self):
+        """The limiter granted the slot: count the time spent queued, restart the attempt clock"""
+        now = time.monotonic()
+        self.queue_wait += now - self.attempt_started
+        self.attempt_started = now
+
+    def first_byte(self):
+        """Time to first byte of the current attempt (response headers, or the first streamed chunk)"""
+        if self.ttfb is None:
+            self.ttfb = time.monotonic() - self.attempt_started
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class LLMTelemetry:
+    """
+    Finished calls go to a bounded ring buffer (for percentiles), to cumulative counters (for Prometheus)
+    and, one JSON object per line, to a local file
+    """
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, capacity=2000, jsonl_path=None, max_file_bytes=20 * 1024 * 1024,
+                 price_input_per_m=0.27, price_output_per_m=1.10, latency_window=200):
+        self.records = deque(maxlen=capacity)
+        self.latency_window = latency_window
+        self.jsonl_path = jsonl_path
+        self.max_file_bytes = max_file_bytes
+        self.price_input_per_m = price_input_per_m
+        self.price_output_per_m = price_output_per_m
+        self._counters = {}  # (feature, outcome) -> calls
+        self._tokens = {}  # (feature, kind) -> tokens
+        self._cost = {}  # feature -> estimated cost
+        self._quantiles = {}  # (feature, q) -> (expires_at, seconds)
+        # feature -> recent attempt latencies (seconds) that adaptive timeouts are derived from; a timed-out
+        # attempt counts at its timeout, so a slowdown raises the quantiles instead of starving them
+        self._latencies = {}
+        self._lock = threading.Lock()
+        self._file_lock = threading.Lock()
+        self._server = None
+
+    def start(self, feature, stream=False):
+        call = LLMCall(feature, stream)
+        call._token = _active_call.set(call)
+        return call
+
+    def on_response(self, response):
+        """httpx response hook: fires when the headers arrive, before the body is read"""
+        call = _active_call.get()
+        if call is not None and not call.stream:
+            call.first_byte()
+
+    def finish(self, call, outcome, usage=None, error=None, model=None):
+        """Record a finished call; outcome is success / cache_hit / error / cancelled"""
+        if call._token is not None:
+            try:
+                _active_call.reset(call._token)
+            except ValueError:
+                _active_call.set(None)  # Finished in another context (e.g. a closed generator)
+            call._token = None
+        prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+        completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+        cost = (prompt_tokens * self.price_input_per_m + completion_tokens * self.price_output_per_m) / 1_000_000
+        record = {
+            "ts": round(time.time(), 3),
+            "feature": call.feature,
+            "outcome": outcome,
+            "model": model,
+            "stream": call.stream,
+            "wall_ms": round((time.monotonic() - call.started) * 1000, 1),
+            # Duration of the attempt that produced the outcome (what adaptive timeouts are derived from)
+            "attempt_ms": round((time.monotonic() - call.attempt_started) * 1000, 1),
+            "ttfb_ms": round(call.ttfb * 1000, 1) if call.ttfb is not None else None,
+            "queue_wait_ms": round(call.queue_wait * 1000, 1),
+            "attempts": call.attempts,
+            "hedged": call.hedged,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cost": round(cost, 8),
+            "error": type(error).__name__ if error is not None else None,
+        }
+        with self._lock:
+            self.records.append(record)
+            if outcome == "success" and not call.stream:
+                self._add_latency(call.feature, record["attempt_ms"] / 1000)
+            key = (call.feature, outcome)
+            self._counters[key] = self._counters.get(key, 0) + 1
+            for kind, tokens in (("prompt", prompt_tokens), ("completion", completion_tokens)):
+                self._tokens[(call.feature, kind)] = self._tokens.get((call.feature, kind), 0) + tokens
+            self._cost[call.feature] = self._cost.get(call.feature, 0.0) + cost
+        self._export(record)
+        return record
+
+    def attempt_timed_out(self, feature, timeout):
+        """An attempt of feature got no reply within timeout seconds: a latency sample of at least that much"""
+        with self._lock:
+            self._add_latency(feature or "default", timeout)
+            # A timeout is news: recompute the quantiles of the feature right away
+            for key in [key for key in self._quantiles if key[0] == (feature or "default")]:
+                del self._quantiles[key]
+
+    def latency_quantile(self, feature, q, min_samples=20, max_age=10):
+        """
+        The q-quantile (seconds) of the feature's recent non-streamed attempt latencies (successes, and timeouts
+        at their timeout), or None with fewer than min_samples observations; recomputed at most every max_age seconds
+        """
+        now = time.monotonic()
+        feature = feature or "default"
+        with self._lock:
+            cached = self._quantiles.get((feature, q))
+            if cached and cached[0] > now:
+                return cached[1]
+            values = sorted(self._latencies.get(feature, ()))
+            value = percentile(values, q) if len(values) >= min_samples else None
+            self._quantiles[(feature, q)] = (now + max_age, value)
+            return value
+
+    def _add_latency(self, feature, seconds):
+        """Caller holds the lock"""
+        window = self._latencies.get(feature)
+        if window is None:
+            window = self._latencies[feature] = deque(maxlen=self.latency_window)
+        window.append(seconds)
+
+    def summary(self):
+        """Per-feature call counts, error rate, latency / TTFB percentiles, attempts, tokens and cost"""
+        with self._lock:
+            records = list(self.records)
+        features = {}
+        for record in records:
+            features.setdefault(record["feature"], []).append(record)
+        result = {}
+        for feature, rows in features.items():
+            calls = [r for r in rows if r["outcome"] != "cache_hit"]
+            wall = sorted(r["wall_ms"] for r in calls)
+            ttfb = sorted(r["ttfb_ms"] for r in calls if r["ttfb_ms"] is not None)
+            result[feature] = {
+                "calls": len(rows),
+                "cache_hits": len(rows) - len(calls),
+                "errors": sum(1 for r in calls if r["outcome"] == "error"),
+                "error_rate": round(sum(1 for r in calls if r["outcome"] == "error") / len(calls), 4) if calls else 0.0,
+                "wall_ms": {f"p{int(q * 100)}": percentile(wall, q) for q in self.QUANTILES},
+                "ttfb_ms": {f"p{int(q * 100)}": percentile(ttfb, q) for q in self.QUANTILES},
+                "avg_attempts": round(sum(r["attempts"] for r in calls) / len(calls), 2) if calls else 0.0,
+                "hedged": sum(1 for r in calls if r.get("hedged")),
+                "prompt_tokens": sum(r["prompt_tokens"] for r in rows),
+                "completion_tokens": sum(r["completion_tokens"] for r in rows),
+                "cost": round(sum(r["cost"] for r in rows), 6),
+            }
+        return result
+
+    def prometheus_text(self):
+        """The metrics in the Prometheus text exposition format"""
+        with self._lock:
+            counters = dict(self._counters)
+            tokens = dict(self._tokens)
+            cost = dict(self._cost)
+            records = list(self.records)
+
+        def labels(**pairs):
+            return "{" + ",".join(f'{k}="{str(v).replace(chr(34), "")}"' for k, v in pairs.items()) + "}"
+
+        lines = ["# HELP llm_calls_total LLM calls by feature and outcome", "# TYPE llm_calls_total counter"]
+        lines += [f"llm_calls_total{labels(feature=f, outcome=o)} {n}" for (f, o), n in sorted(counters.items())]
+        lines += ["# HELP llm_tokens_total Tokens used by feature", "# TYPE llm_tokens_total counter"]
+        lines += [f"llm_tokens_total{labels(feature=f, kind=k)} {n}" for (f, k), n in sorted(tokens.items())]
+        lines += ["# HELP llm_cost_total Estimated cost by feature", "# TYPE llm_cost_total counter"]
+        lines += [f"llm_cost_total{labels(feature=f)} {round(c, 8)}" for f, c in sorted(cost.items())]
+        for metric, field, help_text in (
+            ("llm_call_seconds", "wall_ms", "Wall time of LLM calls (recent window)"),
+            ("llm_ttfb_seconds", "ttfb_ms", "Time to first byte of LLM calls (recent window)"),
+        ):
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} summary"]
+            by_feature = {}
+            for record in records:
+                if record["outcome"] != "cache_hit" and record[field] is not None:
+                    by_feature.setdefault(record["feature"], []).append(record[field] / 1000)
+            for feature, values in sorted(by_feature.items()):
+                values.sort()
+                for q in self.QUANTILES:
+                    lines.append(f"{metric}{labels(feature=feature, quantile=q)} {round(percentile(values, q), 4)}")
+                lines.append(f"{metric}_sum{labels(feature=feature)} {round(sum(values), 4)}")
+                lines.append(f"{metric}_count{labels(feature=feature)} {len(values)}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """Serve /metrics (Prometheus text) on a daemon thread; a port already in use is logged and skipped"""
+        if self._server is not None:
+            return self._server
+        telemetry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] not in ("/metrics", "/"):
+                    self.send_error(404)
+                    return
+                body = telemetry.prometheus_text().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        except OSError as e:
+            logger.warning(f"The LLM metrics endpoint could not listen on {host}:{port}: {str(e)}")
+            return None
+        threading.Thread(target=self._server.serve_forever, name="llm_metrics", daemon=True).start()
+        logger.info(f"LLM metrics served on http://{host}:{port}/metrics")
+        return self._server
+
+    def _export(self, record):
+        if not self.jsonl_path:
+            return
+        try:
+            with self._file_lock:
+                os.makedirs(os.path.dirname(self.jsonl_path) or ".", exist_ok=True)
+                if os.path.exists(self.jsonl_path) and os.path.getsize(self.jsonl_path) > self.max_file_bytes:
+                    os.replace(self.jsonl_path, self.jsonl_path + ".1")  # Keep one rotated file
+                with open(self.jsonl_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record) + "\n")
+        except OSError as e:
+            logger.warning(f"LLM telemetry export failed: {str(e)}")
+
+
+# One telemetry sink per process (LLM_TELEMETRY_PATH="" disables the file export)
+llm_telemetry = LLMTelemetry(
+    capacity=int(os.environ.get("LLM_TELEMETRY_CAPACITY", 2000)),
+    latency_window=int(os.environ.get("LLM_LATENCY_WINDOW", 200)),
+    jsonl_path=os.environ.get("LLM_TELEMETRY_PATH", os.path.join("data", "llm_calls.jsonl")),
+    price_input_per_m=float(os.environ.get("LLM_PRICE_INPUT_PER_M", 0.27)),
+    price_output_per_m=float(os.environ.get("LLM_PRICE_OUTPUT_PER_M", 1.10))
+)
+if os.environ.get("LLM_METRICS_PORT"):
+    llm_telemetry.serve(int(os.environ["LLM_METRICS_PORT"]), os.environ.get("LLM_METRICS_HOST", "127.0.0.1"))
@@ -0,0 +1,478 @@
+# Versioned schema migrations
+# Startup only reads schema_version (one primary-key lookup); DDL runs when the schema is behind, or explicitly:
+#   python -m core.migrations            apply all pending migrations
+#   python -m core.migrations status     show the applied and the latest version
+#   python -m core.migrations --to N     migrate up to version N
+import os
+import sys
+import MySQLdb
+import MySQLdb.cursors
+
+
+LOCK_NAME = 'adaptive_study_agent_schema_migrations'
+LOCK_TIMEOUT = 60  # Seconds to wait for another process that is migrating
+
+
+# ========== information_schema helpers (compatible with DictCursor) ==========
+def _column_exists(cursor, table_name, column_name):
+    cursor.execute("""
+        SELECT COUNT(*) AS count
+        FROM information_schema.columns
+        WHERE table_schema = DATABASE()
+        AND table_name = %s
+        AND column_name = %s
+    """, (table_name, column_name))
+    result = cursor.fetchone()
+    return result['count'] > 0 if result else False
+
+
+def _table_exists(cursor, table_name):
+    cursor.execute("""
+        SELECT COUNT(*) AS count
+        FROM information_schema.tables
+        WHERE table_schema = DATABASE()
+        AND table_name = %s
+    """, (table_name,))
+    result = cursor.fetchone()
+    return result['count'] > 0 if result else False
+
+
+def _index_exists(cursor, table_name, index_name):
+    cursor.execute("""
+        SELECT COUNT(*) AS count
+        FROM information_schema.statistics
+        WHERE table_schema = DATABASE()
+        AND table_name = %s
+        AND index_name = %s
+    """, (table_name, index_name))
+    result = cursor.fetchone()
+    return result['count'] > 0 if result else False
+
+
+# ========== Migrations (each one is idempotent, so databases created before versioning adopt cleanly) ==========
+def _baseline(cursor):
+    """The tables of the original schema"""
+    # User Table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            username VARCHAR(50) UNIQUE,
+            password VARCHAR(255),
+            email VARCHAR(100) UNIQUE,
+            full_name VARCHAR(100),
+            interests TEXT,
+            learning_style TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_login TIMESTAMP NULL,
+            is_active BOOLEAN DEFAULT TRUE,
+            version INT DEFAULT 1
+        )
+    ''')
+
+    # Learning Path table
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS learning_paths (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            subject VARCHAR(100),
+            progress FLOAT DEFAULT 0.0,
+            difficulty_level VARCHAR(10),
+            content JSON,
+            target_completion_date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            is_active BOOLEAN DEFAULT FALSE,
+            version INT DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            INDEX idx_user_id_subject (user_id, subject),
+            INDEX idx_last_updated (last_updated)
+        )
+    ''')
+
+    # Learning Activity Schedule
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS learning_activities (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            path_id INT,
+            topic_name VARCHAR(100),
+            progress FLOAT DEFAULT 0.0,
+            total_score FLOAT DEFAULT 0.0,
+            total_minutes DECIMAL(10,2) DEFAULT 0.00,
+            content JSON,
+            activity_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INT DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
+            INDEX idx_user_id_activity_date (user_id, activity_date)
+        )
+    ''')
+
+    # Evaluation Form
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS assessments (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            subject VARCHAR(100),
+            topic_name VARCHAR(100),
+            content JSON,
+            taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INT DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            INDEX idx_user_id_subject_topic_name (user_id, subject, topic_name)
+        )
+    ''')
+
+    # Path Evaluation Form
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS path_assessments (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            learning_path_id INT,
+            user_id INT,
+            question TEXT,
+            user_answer TEXT,
+            score FLOAT,
+            feedback TEXT,
+            difficulty_level VARCHAR(10),
+            question_type VARCHAR(10),
+            completed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INT DEFAULT 1,
+            FOREIGN KEY (learning_path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            INDEX idx_learning_path_id (learning_path_id)
+        )
+    ''')
+
+    # Certificate Form
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS certifications (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            learning_path_id INT,
+            completion_date DATE,
+            certificate_number VARCHAR(50) UNIQUE,
+            recipient_name VARCHAR(100),
+            version INT DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (learning_path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
+            INDEX idx_user_id_cert_date (user_id, completion_date)
+        )
+    ''')
+
+    # Learning Habits Chart
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS study_streaks (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT UNIQUE,
+            current_streak_days INT DEFAULT 0,
+            longest_streak_days INT DEFAULT 0,
+            last_study_date DATE,
+            version INT DEFAULT 1
+        )
+    ''')
+
+    # Study Schedule
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS study_schedules (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT,
+            path_id INT,
+            schedule_json JSON,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INT DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+            FOREIGN KEY (path_id) REFERENCES learning_paths(id) ON DELETE CASCADE,
+            INDEX idx_user_id_path_id (user_id, path_id)
+        )
+    ''')
+
+
+def _version_columns(cursor):
+    """Compatible with lower versions of MySQL: add the version field to tables created without it"""
+    tables = [
+        'users', 'learning_paths', 'learning_activities',
+        'assessments', 'path_assessments', 'certifications',
+        'study_streaks', 'study_schedules'
+    ]
+    for table in tables:
+        if not _column_exists(cursor, table, 'version'):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN version INT DEFAULT 1")
+            print(f"For table, {table} ,add version")
+
+
+def _unique_learning_activity(cursor):
+    """One learning activity row per user - path - topic (required by the batched timer upsert)"""
+    if _index_exists(cursor, 'learning_activities', 'uk_user_path_topic'):
+        return
+    # 1. Merge the content (viewed-resource flags) of duplicate rows into the oldest row, oldest first
+    # (<=> so that rows without a path are merged too: the unique key cannot tell NULL paths apart)
+    cursor.execute('''
+        SELECT la.id AS dup_id, d.keep_id
+        FROM learning_activities la
+        JOIN (
+            SELECT MIN(id) AS keep_id, user_id, path_id, topic_name
+            FROM learning_activities
+            GROUP BY user_id, path_id, topic_name
+            HAVING COUNT(*) > 1
+        ) d ON d.user_id <=> la.user_id AND d.path_id <=> la.path_id AND d.topic_name <=> la.topic_name
+           AND la.id > d.keep_id
+        ORDER BY la.id
+    ''')
+    duplicates = [(row['keep_id'], row['dup_id']) for row in cursor.fetchall()]
+    if duplicates:
+        cursor.executemany('''
+            UPDATE learning_activities keep_row
+            JOIN learning_activities dup ON dup.id = %s
+            SET keep_row.content = JSON_MERGE_PATCH(
+                COALESCE(keep_row.content, JSON_OBJECT()), COALESCE(dup.content, JSON_OBJECT())
+            )
+            WHERE keep_row.id = %s
+        ''', [(dup_id, keep_id) for keep_id, dup_id in duplicates])
+    # 2. Merge the minutes into the oldest row, then drop the duplicates
+    cursor.execute('''
+        UPDATE learning_activities la
+        JOIN (
+            SELECT MIN(id) AS keep_id, SUM(total_minutes) AS minutes
+            FROM learning_activities
+            GROUP BY user_id, path_id, topic_name
+            HAVING COUNT(*) > 1
+        ) d ON la.id = d.keep_id
+        SET la.total_minutes = d.minutes
+    ''')
+    cursor.execute('''
+        DELETE la FROM learning_activities la
+        JOIN learning_activities keep_row
+          ON keep_row.user_id <=> la.user_id
+         AND keep_row.path_id <=> la.path_id
+         AND keep_row.topic_name <=> la.topic_name
+         AND keep_row.id < la.id
+    ''')
+    cursor.execute('''
+        ALTER TABLE learning_activities
+        ADD UNIQUE KEY uk_user_path_topic (user_id, path_id, topic_name)
+    ''')
+
+
+def _user_study_totals(cursor):
+    """Study time totals (maintained incrementally; reconciled from learning_activities)"""
+    if _table_exists(cursor, 'user_study_totals'):
+        return
+    cursor.execute('''
+        CREATE TABLE user_study_totals (
+            user_id INT PRIMARY KEY,
+            total_minutes DECIMAL(12,2) DEFAULT 0.00,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            version INT DEFAULT 1,
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+    # Backfill once from the existing activities
+    cursor.execute('''
+        INSERT IGNORE INTO user_study_totals (user_id, total_minutes)
+        SELECT user_id, COALESCE(SUM(total_minutes), 0)
+        FROM learning_activities
+        WHERE user_id IS NOT NULL
+        GROUP BY user_id
+    ''')
+
+
+def _unique_assessments_and_plans(cursor):
+    """One saved assessment per topic and one plan per path (required by the upserts), with content hashes"""
+    unique_keys = [
+        ('assessments', 'uk_user_subject_topic', ('user_id', 'subject', 'topic_name')),
+        ('study_schedules', 'uk_user_path', ('user_id', 'path_id'))
+    ]
+    for table, index_name, columns in unique_keys:
+        if not _column_exists(cursor, table, 'content_hash'):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN content_hash CHAR(64) NULL")
+        if not _index_exists(cursor, table, index_name):
+            # Keep the newest row of each key (the old code always replaced by delete + insert)
+            match = " AND ".join(f"keep_row.{col} = t.{col}" for col in columns)
+            cursor.execute(f'''
+                DELETE t FROM {table} t
+                JOIN {table} keep_row ON {match} AND keep_row.id > t.id
+            ''')
+            cursor.execute(f"ALTER TABLE {table} ADD UNIQUE KEY {index_name} ({', '.join(columns)})")
+
+
+def _generation_jobs(cursor):
+    """Background generation jobs (learning paths, ...) polled by the UI"""
+    if _table_exists(cursor, 'generation_jobs'):
+        return
+    cursor.execute('''
+        CREATE TABLE generation_jobs (
+            id BIGINT AUTO_INCREMENT PRIMARY KEY,
+            user_id INT NOT NULL,
+            kind VARCHAR(32) NOT NULL,
+            status ENUM('queued', 'running', 'succeeded', 'failed') NOT NULL DEFAULT 'queued',
+            params JSON,
+            progress VARCHAR(255),
+            result_id INT NULL,
+            error TEXT,
+            worker VARCHAR(128),
+            created_at DATETIME NOT NULL,
+            started_at DATETIME NULL,
+            finished_at DATETIME NULL,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            version INT DEFAULT 1,
+            KEY idx_user_kind_status (user_id, kind, status),
+            KEY idx_status_updated (status, updated_at),
+            FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+        )
+    ''')
+
+
+def _exercise_pool(cursor):
+    """Pre-generated exercises per (subject, topic, difficulty) bucket and which ones each user has seen"""
+    if not _table_exists(cursor, 'exercise_pool'):
+        cursor.execute('''
+            CREATE TABLE exercise_pool (
+                id BIGINT AUTO_INCREMENT PRIMARY KEY,
+                bucket_key CHAR(64) NOT NULL,
+                subject VARCHAR(255) NOT NULL,
+                topic_name VARCHAR(255) NOT NULL,
+                difficulty_level VARCHAR(50) NOT NULL,
+                question_hash CHAR(64) NOT NULL,
+                exercise JSON NOT NULL,
+                created_at DATETIME NOT NULL,
+                version INT DEFAULT 1,
+                UNIQUE KEY uk_bucket_question (bucket_key, question_hash)
+            )
+        ''')
+    if not _table_exists(cursor, 'exercise_pool_seen'):
+        cursor.execute('''
+            CREATE TABLE exercise_pool_seen (
+                user_id INT NOT NULL,
+                exercise_id BIGINT NOT NULL,
+                seen_at DATETIME NOT NULL,
+                PRIMARY KEY (user_id, exercise_id),
+                FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE,
+                FOREIGN KEY (exercise_id) REFERENCES exercise_pool(id) ON DELETE CASCADE
+            )
+        ''')
+
+
+# Ordered and append-only: never edit an applied migration, add a new one instead
+MIGRATIONS = [
+    (1, "Baseline tables", _baseline),
+    (2, "Version column on every table", _version_columns),
+    (3, "One learning activity row per user, path and topic", _unique_learning_activity),
+    (4, "Per-user study time totals", _user_study_totals),
+    (5, "Unique assessments per topic and plans per path, with content hashes", _unique_assessments_and_plans),
+    (6, "Background generation jobs", _generation_jobs),
+    (7, "Exercise pool for instant re-assessments", _exercise_pool),
+]
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def current_version(connection):
+    """The applied schema version, 0 for a database that was never migrated (a single primary-key read)"""
+    try:
+        with connection.cursor(MySQLdb.cursors.DictCursor) as cursor:
+            cursor.execute("SELECT MAX(version) AS version FROM schema_version")
+            row = cursor.fetchone()
+        return int(row['version'] or 0) if row else 0
+    except MySQLdb.Error as e:
+        # 1146: table doesn't exist yet
+        if e.args and e.args[0] == 1146:
+            return 0
+        raise
+
+
+def migrate(connection, target=None):
+    """Apply the pending migrations in order (serialized across processes with GET_LOCK); return the new version"""
+    with connection.cursor(MySQLdb.cursors.DictCursor) as cursor:
+        cursor.execute("SELECT GET_LOCK(%s, %s) AS acquired", (LOCK_NAME, LOCK_TIMEOUT))
+        row = cursor.fetchone()
+        if not row or not row['acquired']:
+            raise RuntimeError("Another process is migrating the schema; timed out waiting for it")
+        try:
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version INT PRIMARY KEY,
+                    description VARCHAR(255),
+                    applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # Re-read under the lock: another process may have finished the work meanwhile
+            applied = current_version(connection)
+            for version, description, apply in MIGRATIONS:
+                if version <= applied or (target is not None and version > target):
+                    continue
+                print(f"Applying schema migration {version}: {description}")
+                try:
+                    apply(cursor)
+                    cursor.execute(
+                        "INSERT INTO schema_version (version, description) VALUES (%s, %s)",
+                        (version, description)
+                    )
+                    connection.commit()
+                except MySQLdb.Error:
+                    connection.rollback()
+                    raise
+                applied = version
+            return applied
+        finally:
+            cursor.execute("SELECT RELEASE_LOCK(%s)", (LOCK_NAME,))
+            cursor.fetchall()
+
+
+def ensure_schema(connection):
+    """
+    Startup check: one read of schema_version. Migrates only when the database is behind the code, unless
+    SCHEMA_AUTO_MIGRATE=0 (then run python -m core.migrations as a deploy step)
+    """
+    version = current_version(connection)
+    if version >= LATEST_VERSION:
+        return version
+    if os.environ.get('SCHEMA_AUTO_MIGRATE', '1') == '0':
+        print(f"The database schema is at version {version}, the code expects {LATEST_VERSION}. "
+              f"Run: python -m core.migrations")
+        return version
+    return migrate(connection)
+
+
+def _connect():
+    from .data_manager import Config
+    config = Config.POOL_CONFIG
+    return MySQLdb.connect(
+        host=config['host'],
+        user=config['user'],
+        passwd=config['password'],
+        db=config['database'],
+        port=config['port'],
+        connect_timeout=10,
+        cursorclass=MySQLdb.cursors.DictCursor
+    )
+
+
+def main(argv=None):
+    args = list(sys.argv[1:] if argv is None else argv)
+    target = None
+    if '--to' in args:
+        index = args.index('--to')
+        target = int(args[index + 1])
+        del args[index:index + 2]
+    command = args[0] if args else 'migrate'
+
+    connection = _connect()
+    try:
+        if command == 'status':
+            version = current_version(connection)
+            print(f"Schema version: {version} (latest: {LATEST_VERSION})")
+            for number, description, _ in MIGRATIONS:
+                print(f"  [{'x' if number <= version else ' '}] {number}: {description}")
+        elif command == 'migrate':
+            before = current_version(connection)
+            after = migrate(connection, target)
+            print(f"Schema migrated from version {before} to {after}")
+        else:
+            print(f"Unknown command: {command} (use 'migrate' or 'status')")
+            return 2
+    finally:
+        connection.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
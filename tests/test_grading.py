@@ -0,0 +1,43 @@
+import time
+import threading
+
+import pytest
+
+backend = pytest.importorskip("core.backend")
+MockAssessmentManager = backend.MockAssessmentManager
+
+
+def test_per_user_cap_and_idle_users_are_dropped(monkeypatch):
+    monkeypatch.setattr(MockAssessmentManager, "GRADING_PER_USER_LIMIT", 2)
+    manager = MockAssessmentManager()
+    in_flight, peak, lock = {}, {}, threading.Lock()
+
+    def evaluate_answer(subject, topic, question, user_answer, difficulty_level, ai_agent):
+        user = question.split(":")[0]
+        with lock:
+            in_flight[user] = in_flight.get(user, 0) + 1
+            peak[user] = max(peak.get(user, 0), in_flight[user])
+        time.sleep(0.02)
+        with lock:
+            in_flight[user] -= 1
+        return {"status": "success", "data": {"score": 1, "question": question}}
+
+    monkeypatch.setattr(manager, "evaluate_answer", evaluate_answer)
+
+    def grade(user_id):
+        items = [(f"u{user_id}: open question {index}", "an answer") for index in range(6)]
+        evaluations = manager.evaluate_answers_batch("Math", "Algebra", items, "Beginner", None,
+                                                     user_id=user_id, bulk=False)
+        assert [evaluation["data"]["question"] for evaluation in evaluations] == [question for question, _ in items]
+
+    threads = [threading.Thread(target=grade, args=(user_id,)) for user_id in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert max(peak.values()) <= 2
+    # Done-callbacks release the last slots just after the results are returned
+    deadline = time.monotonic() + 2
+    while MockAssessmentManager._user_slots and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert MockAssessmentManager._user_slots == {}
@@ -0,0 +1,99 @@
+import time
+import threading
+
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("dbutils")
+
+from core import jobs
+
+
+class FakeDataManager:
+    """generation_jobs as a dict; claim_error makes the claiming UPDATE fail like a lost connection"""
+    def __init__(self):
+        self.rows = {}
+        self.claim_error = None
+        self.recoveries = 0
+        self.finished = threading.Event()
+
+    def execute_query(self, query, params=None, commit=True):
+        sql = " ".join(query.split())
+        if sql.startswith("INSERT INTO generation_jobs"):
+            job_id = len(self.rows) + 1
+            self.rows[job_id] = {'id': job_id, 'user_id': params[0], 'kind': params[1], 'status': 'queued',
+                                 'params': params[2], 'progress': 'Queued', 'result_id': None, 'error': None}
+            return job_id
+        if sql.startswith("UPDATE generation_jobs SET status = 'failed'"):
+            self.recoveries += 1
+            return 0
+        if sql.startswith("DELETE"):
+            return 0
+        if sql.startswith("SELECT"):
+            return [dict(self.rows[params[0]])] if params[0] in self.rows else []
+        raise AssertionError(sql)
+
+    def update_fields(self, table, values, where, condition=None, condition_params=(), touch=None):
+        row = self.rows[where['id']]
+        if values.get('status') == 'running' and self.claim_error:
+            raise self.claim_error
+        if condition == "status = 'queued'" and row['status'] != 'queued':
+            return 0
+        if condition and condition.startswith("status = 'running'") and (
+                row['status'] != 'running' or row.get('worker') != condition_params[0]):
+            return 0
+        row.update(values)
+        if row['status'] in ('succeeded', 'failed'):
+            self.finished.set()
+        return 1
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    db = FakeDataManager()
+    monkeypatch.setattr(jobs, "DataManager", lambda: db)
+    job_queue = jobs.JobQueue(max_workers=2, stale_seconds=3)
+    job_queue.register("echo", lambda job: job.params["value"])
+    yield job_queue, db
+    if job_queue._executor:
+        job_queue._executor.shutdown(wait=True)
+
+
+def test_job_runs_to_success(queue):
+    job_queue, db = queue
+    job_id = job_queue.submit(7, "echo", {"value": 42})
+    assert db.finished.wait(2)
+    assert job_queue.status(job_id, 7)['status'] == 'succeeded'
+    assert db.rows[job_id]['result_id'] == 42
+
+
+def test_failed_claim_fails_the_job(queue):
+    job_queue, db = queue
+    db.claim_error = RuntimeError("pool exhausted")
+    job_id = job_queue.submit(7, "echo", {"value": 1})
+    assert db.finished.wait(2)
+    row = job_queue.status(job_id, 7)
+    assert row['status'] == 'failed' and 'started' in row['error']
+
+
+def test_rejected_submit_fails_the_job(queue):
+    job_queue, db = queue
+    job_queue._get_executor().shutdown(wait=True)
+    job_id = job_queue.submit(7, "echo", {"value": 1})
+    assert job_id is not None
+    row = job_queue.status(job_id, 7)
+    assert row['status'] == 'failed' and 'scheduled' in row['error']
+    assert job_queue._runtime == {}
+
+
+def test_polling_an_active_job_recovers_stale_ones_periodically(queue):
+    job_queue, db = queue
+    job_queue._get_executor()
+    assert db.recoveries == 1  # At start-up
+    db.rows[99] = {'id': 99, 'user_id': 7, 'kind': 'echo', 'status': 'queued', 'progress': 'Queued',
+                   'result_id': None, 'error': None}
+    job_queue.status(99, 7)
+    assert db.recoveries == 1  # Not again within the heartbeat interval
+    job_queue._recovered_at = time.monotonic() - job_queue.heartbeat_seconds
+    job_queue.status(99, 7)
+    assert db.recoveries == 2
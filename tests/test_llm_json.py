@@ -0,0 +1,47 @@
+import pytest
+
+from core.llm_json import LLMJSONError, parse_llm_json
+
+
+# (response, expected data, repairs that must be reported)
+CASES = [
+    ('{"a": 1, "b": [true, null]}', {"a": 1, "b": [True, None]}, []),
+    ('```json\n{"a": 1}\n```', {"a": 1}, ["code_fence"]),
+    ('Here is the plan:\n{"a": 1}\nGood luck!', {"a": 1}, ["leading_text", "trailing_text"]),
+    ('{"a": 1, // the first\n "b": 2 /* the second */}', {"a": 1, "b": 2}, ["comment"]),
+    ('{"a": 1 "b": 2}', {"a": 1, "b": 2}, ["missing_comma"]),
+    ('[{"a": 1} {"a": 2}]', [{"a": 1}, {"a": 2}], ["missing_comma"]),
+    ('{"a": [1, 2,], "b": 3,}', {"a": [1, 2], "b": 3}, ["trailing_comma"]),
+    ('{"a": 1,, "b": 2}', {"a": 1, "b": 2}, ["extra_comma"]),
+    ('{question: "Why?", level_2: 3}', {"question": "Why?", "level_2": 3}, ["unquoted_key"]),
+    ('{"a": True, "b": False, "c": None}', {"a": True, "b": False, "c": None}, ["python_literal"]),
+    ("{'question': 'What is 2 + 2?'}", {"question": "What is 2 + 2?"}, ["single_quotes"]),
+    ("{'q': 'It's \"fine\"', 'r': 'it\\'s'}", {"q": 'It\'s "fine"', "r": "it's"}, ["single_quotes"]),
+    ('{"a": .5, "b": 2.}', {"a": 0.5, "b": 2}, ["number_format"]),
+    ('{"a": "line\nbreak"}', {"a": "line\nbreak"}, ["control_character"]),
+    ('{"a": [1, 2}', {"a": [1, 2]}, ["mismatched_bracket"]),
+    # Truncation: cut back to the last complete element and close what is open
+    ('{"a": 1, "b": "unfinish', {"a": 1}, ["truncated"]),
+    ('{"a": 1, "b":', {"a": 1}, ["truncated"]),
+    ('[{"q": 1}, {"q": 2}, {"q"', [{"q": 1}, {"q": 2}, {}], ["truncated"]),
+    ('{"a":{"b":[1,2,3', {"a": {"b": [1, 2]}}, ["truncated"]),
+    ('{"items": [{"q": "x", "opts": ["p", "q"]}, {"q": "y", "opts": ["r"',
+     {"items": [{"q": "x", "opts": ["p", "q"]}, {"q": "y", "opts": ["r"]}]}, ["truncated"]),
+    ('{"a": 1, "b": tr', {"a": 1}, ["truncated"]),
+    ('```json\n{"a": [1, 2', {"a": [1]}, ["code_fence", "truncated"]),
+]
+
+
+@pytest.mark.parametrize("text,expected,repairs", CASES)
+def test_parse_llm_json(text, expected, repairs):
+    data, applied = parse_llm_json(text)
+    assert data == expected
+    assert set(repairs) <= set(applied)
+    if not repairs:
+        assert applied == []
+
+
+@pytest.mark.parametrize("text", ["", "   ", None, "No JSON here", "}} ]"])
+def test_unrecoverable(text):
+    with pytest.raises(LLMJSONError):
+        parse_llm_json(text)
@@ -0,0 +1,153 @@
+import time
+import threading
+
+import pytest
+
+from core.llm_limiter import LLMLimiter, INTERACTIVE, NORMAL, BACKGROUND, retry_decision
+
+
+def _wait_for_queue(limiter, depth, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while limiter.stats()["queue_depth"] < depth:
+        assert time.monotonic() < deadline, "waiters never queued"
+        time.sleep(0.005)
+
+
+def _contend(limiter, arrivals):
+    """Queue one waiter per (name, priority) in arrival order behind a held slot; return the admission order"""
+    order = []
+
+    def worker(name, priority):
+        limiter.acquire(priority, timeout=5)
+        order.append(name)
+        limiter.release()
+
+    limiter.acquire(NORMAL)
+    threads = []
+    for depth, (name, priority) in enumerate(arrivals, 1):
+        thread = threading.Thread(target=worker, args=(name, priority))
+        thread.start()
+        threads.append(thread)
+        _wait_for_queue(limiter, depth)
+    limiter.release()
+    for thread in threads:
+        thread.join(5)
+    return order
+
+
+def test_priority_order_under_contention():
+    limiter = LLMLimiter(rate=1000, burst=100, max_concurrency=1)
+    order = _contend(limiter, [
+        ("refill", BACKGROUND), ("schedule", NORMAL), ("outline", BACKGROUND), ("chat", INTERACTIVE), ("grade", INTERACTIVE)
+    ])
+    assert order == ["chat", "grade", "schedule", "refill", "outline"]
+    stats = limiter.stats()
+    assert stats["in_flight"] == 0 and stats["queue_depth"] == 0
+    assert stats["max_queue_depth"] == 5
+    assert stats["classes"]["interactive"]["granted"] == 2
+
+
+def test_same_priority_is_first_come_first_served():
+    limiter = LLMLimiter(rate=1000, burst=100, max_concurrency=1)
+    arrivals = [(f"w{index}", NORMAL) for index in range(6)]
+    assert _contend(limiter, arrivals) == [name for name, _ in arrivals]
+
+
+def test_concurrency_cap():
+    limiter = LLMLimiter(rate=1000, burst=100, max_concurrency=3)
+    in_flight, peak, lock = [0], [0], threading.Lock()
+
+    def worker():
+        with limiter.slot("chat", timeout=5):
+            with lock:
+                in_flight[0] += 1
+                peak[0] = max(peak[0], in_flight[0])
+            time.sleep(0.02)
+            with lock:
+                in_flight[0] -= 1
+
+    threads = [threading.Thread(target=worker) for _ in range(12)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    assert peak[0] == 3
+    assert limiter.stats()["classes"]["interactive"]["granted"] == 12
+
+
+def test_token_bucket_rate():
+    limiter = LLMLimiter(rate=20, burst=2, max_concurrency=100)
+    started = time.monotonic()
+    for _ in range(2):
+        limiter.acquire(NORMAL)  # The burst goes at once
+    assert time.monotonic() - started < 0.04
+    for _ in range(4):
+        limiter.acquire(NORMAL)  # Then one token every 1 / rate seconds
+    elapsed = time.monotonic() - started
+    assert 0.17 <= elapsed < 0.6
+
+
+def test_timeout_leaves_the_queue():
+    limiter = LLMLimiter(rate=1000, burst=100, max_concurrency=1)
+    limiter.acquire(NORMAL)
+    with pytest.raises(TimeoutError):
+        limiter.acquire(INTERACTIVE, timeout=0.05)
+    stats = limiter.stats()
+    assert stats["queue_depth"] == 0
+    assert stats["classes"]["interactive"]["timeouts"] == 1
+    # The timed-out waiter no longer blocks the head of the queue
+    limiter.release()
+    limiter.acquire(BACKGROUND, timeout=0.5)
+
+
+def test_pause_holds_every_admission():
+    limiter = LLMLimiter(rate=1000, burst=100, max_concurrency=10)
+    limiter.pause(0.2)
+    started = time.monotonic()
+    limiter.acquire(INTERACTIVE, timeout=2)
+    assert time.monotonic() - started >= 0.18
+    assert limiter.stats()["rate_limited"] == 1
+    with pytest.raises(TimeoutError):
+        limiter.pause(1)
+        limiter.acquire(INTERACTIVE, timeout=0.1)
+
+
+class _Response:
+    def __init__(self, headers):
+        self.headers = headers
+
+
+class _APIError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.response = _Response(headers or {})
+
+
+@pytest.mark.parametrize("error,attempt,expected", [
+    (_APIError(429, {"retry-after": "3"}), 0, (True, 3.0, True)),
+    (_APIError(429, {"retry-after-ms": "1500"}), 0, (True, 1.5, True)),
+    (_APIError(429, {"retry-after": "600"}), 0, (True, 60.0, True)),  # Capped at twice max_delay
+    (_APIError(400), 0, (False, 0, False)),
+    (_APIError(401), 2, (False, 0, False)),
+    (_APIError(422), 0, (False, 0, False)),
+])
+def test_retry_decision(error, attempt, expected):
+    assert retry_decision(error, attempt, base_delay=1.0) == expected
+
+
+@pytest.mark.parametrize("error,attempt,bound,from_server", [
+    (_APIError(429, {"retry-after": "soon"}), 3, 8.0, True),  # Unparsable Retry-After: backoff
+    (_APIError(500), 0, 1.0, False),
+    (_APIError(503), 4, 16.0, False),
+    (_APIError(408), 10, 30.0, False),  # Capped at max_delay
+    (ConnectionError("reset"), 1, 2.0, False),
+])
+def test_retry_backoff_is_jittered_and_bounded(error, attempt, bound, from_server):
+    delays = set()
+    for _ in range(50):
+        retryable, delay, server = retry_decision(error, attempt, base_delay=1.0)
+        assert retryable and server == from_server
+        assert 0 <= delay <= bound
+        delays.add(delay)
+    assert len(delays) > 1
@@ -0,0 +1,243 @@
+import os
+import re
+
+import pytest
+
+MySQLdb = pytest.importorskip("MySQLdb")
+pytest.importorskip("dbutils")
+
+from core import migrations
+from core.data_manager import DataManager
+
+
+# ========== An in-memory stand-in for the schema (tables, columns, indexes) ==========
+class FakeCursor:
+    def __init__(self, db):
+        self.db = db
+        self.result = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query, params=()):
+        sql = " ".join(query.split())
+        self.db.log.append(sql)
+        if self.db.fail_on and self.db.fail_on in sql:
+            self.db.fail_on = None
+            raise MySQLdb.OperationalError(1062, "Duplicate entry")
+        self.result = []
+        if sql.startswith("SELECT GET_LOCK"):
+            self.result = [{'acquired': 1}]
+        elif sql.startswith("SELECT MAX(version)"):
+            self.result = [{'version': max(self.db.versions, default=None)}]
+        elif sql.startswith("INSERT INTO schema_version"):
+            self.db.pending.append(params[0])
+        elif "information_schema.tables" in sql:
+            self.result = [{'count': int(params[0] in self.db.tables)}]
+        elif "information_schema.columns" in sql:
+            self.result = [{'count': int(params[1] in self.db.tables.get(params[0], ()))}]
+        elif "information_schema.statistics" in sql:
+            self.result = [{'count': int((params[0], params[1]) in self.db.indexes)}]
+        elif sql.startswith("CREATE TABLE"):
+            table = re.match(r"CREATE TABLE (?:IF NOT EXISTS )?(\w+)", sql).group(1)
+            if table not in self.db.tables:
+                body = query[query.index("(") + 1:]
+                self.db.tables[table] = {
+                    line.split()[0] for line in body.splitlines()
+                    if line.strip() and line.split()[0].isidentifier()
+                    and line.split()[0] not in ("INDEX", "KEY", "UNIQUE", "FOREIGN", "PRIMARY")
+                }
+        elif sql.startswith("ALTER TABLE"):
+            table = sql.split()[2]
+            column = re.search(r"ADD COLUMN (\w+)", sql)
+            index = re.search(r"ADD UNIQUE KEY (\w+)", sql)
+            if column:
+                self.db.tables[table].add(column.group(1))
+            if index:
+                self.db.indexes.add((table, index.group(1)))
+
+    def executemany(self, query, rows):
+        for params in rows:
+            self.execute(query, params)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return list(self.result)
+
+
+class FakeConnection:
+    """DDL is applied at once (MySQL commits it implicitly); schema_version rows wait for commit"""
+    def __init__(self):
+        self.tables = {}
+        self.indexes = set()
+        self.versions = []
+        self.pending = []
+        self.log = []
+        self.fail_on = None
+        self.rollbacks = 0
+
+    def cursor(self, cursorclass=None):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.versions.extend(self.pending)
+        self.pending = []
+
+    def rollback(self):
+        self.pending = []
+        self.rollbacks += 1
+
+
+def _ddl(log):
+    return [sql for sql in log if sql.startswith(("ALTER", "DELETE")) or
+            (sql.startswith("CREATE TABLE") and "IF NOT EXISTS" not in sql)]
+
+
+def test_migrate_twice():
+    connection = FakeConnection()
+    assert migrations.migrate(connection) == migrations.LATEST_VERSION
+    assert connection.versions == [version for version, _, _ in migrations.MIGRATIONS]
+    del connection.log[:]
+    assert migrations.migrate(connection) == migrations.LATEST_VERSION
+    assert _ddl(connection.log) == []
+    assert len(connection.versions) == len(migrations.MIGRATIONS)
+
+
+def test_each_migration_adopts_an_existing_schema():
+    # Databases created before versioning already have the tables: every step must detect its own work
+    connection = FakeConnection()
+    migrations.migrate(connection)
+    del connection.log[:]
+    with connection.cursor() as cursor:
+        for _, _, apply in migrations.MIGRATIONS:
+            apply(cursor)
+    assert _ddl(connection.log) == []
+
+
+def test_failed_migration_resumes():
+    connection = FakeConnection()
+    connection.fail_on = "ADD UNIQUE KEY uk_user_path ("
+    with pytest.raises(MySQLdb.Error):
+        migrations.migrate(connection)
+    # Migration 5 half-applied: its DDL stays, its version does not
+    assert max(connection.versions) == 4
+    assert connection.rollbacks == 1
+    assert "content_hash" in connection.tables['study_schedules']
+    assert "RELEASE_LOCK" in connection.log[-1]
+    del connection.log[:]
+    assert migrations.migrate(connection) == migrations.LATEST_VERSION
+    assert not any("ADD COLUMN content_hash" in sql for sql in connection.log)
+    assert any("ADD UNIQUE KEY uk_user_path (" in sql for sql in connection.log)
+
+
+def test_failed_schema_check_backs_off(monkeypatch):
+    attempts = []
+
+    def checkout():
+        attempts.append(1)
+        raise MySQLdb.OperationalError(2003, "Can't connect to MySQL server")
+
+    manager = object.__new__(DataManager)
+    manager._table_initialized = False
+    manager._schema_retry_at = 0.0
+    monkeypatch.setattr(manager, "_checkout_connection", checkout)
+    manager._initialize_database()
+    manager._initialize_database()
+    assert len(attempts) == 1
+    manager._schema_retry_at = 0.0  # The back-off has elapsed
+    manager._initialize_database()
+    assert len(attempts) == 2
+    assert not manager._table_initialized
+
+
+# ========== Against a real server (MIGRATIONS_TEST_DATABASE names a scratch database that is dropped) ==========
+@pytest.fixture
+def mysql_connection():
+    database = os.environ.get('MIGRATIONS_TEST_DATABASE')
+    if not database:
+        pytest.skip("MIGRATIONS_TEST_DATABASE is not set")
+    settings = dict(
+        host=os.environ.get('MYSQLHOST', 'localhost'),
+        user=os.environ.get('MYSQLUSER', 'root'),
+        passwd=os.environ.get('MYSQLPASSWORD', ''),
+        port=int(os.environ.get('MYSQLPORT', 3306)),
+        cursorclass=MySQLdb.cursors.DictCursor
+    )
+    admin = MySQLdb.connect(**settings)
+    with admin.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+        cursor.execute(f"CREATE DATABASE {database}")
+    connection = MySQLdb.connect(db=database, **settings)
+    yield connection
+    connection.close()
+    with admin.cursor() as cursor:
+        cursor.execute(f"DROP DATABASE IF EXISTS {database}")
+    admin.close()
+
+
+def _schema(connection):
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT table_name, column_name FROM information_schema.columns
+            WHERE table_schema = DATABASE() ORDER BY table_name, column_name
+        ''')
+        columns = cursor.fetchall()
+        cursor.execute('''
+            SELECT table_name, index_name FROM information_schema.statistics
+            WHERE table_schema = DATABASE() ORDER BY table_name, index_name
+        ''')
+        return columns, cursor.fetchall()
+
+
+def test_mysql_migrate_twice(mysql_connection):
+    assert migrations.migrate(mysql_connection) == migrations.LATEST_VERSION
+    schema = _schema(mysql_connection)
+    assert migrations.migrate(mysql_connection) == migrations.LATEST_VERSION
+    assert _schema(mysql_connection) == schema
+    assert migrations.current_version(mysql_connection) == migrations.LATEST_VERSION
+
+
+def test_mysql_migrate_merges_duplicates(mysql_connection):
+    migrations.migrate(mysql_connection, target=2)
+    with mysql_connection.cursor() as cursor:
+        cursor.execute("INSERT INTO users (id, username) VALUES (1, 'u')")
+        cursor.execute("INSERT INTO learning_paths (id, user_id, subject) VALUES (1, 1, 'Math')")
+        cursor.executemany('''
+            INSERT INTO learning_activities (user_id, path_id, topic_name, total_minutes, content)
+            VALUES (%s, %s, %s, %s, %s)
+        ''', [
+            (1, 1, 'Algebra', 10, '{"viewed": {"a": true}}'),
+            (1, 1, 'Algebra', 5, '{"viewed": {"b": true}}'),
+            (1, 1, 'Algebra', 2.5, None),
+            (1, None, 'Algebra', 3, '{"viewed": {"c": true}}'),
+            (1, None, 'Algebra', 4, None),
+            (1, 1, 'Geometry', 7, None),
+        ])
+        cursor.execute("INSERT INTO assessments (user_id, subject, topic_name, content) VALUES (1, 'Math', 'Algebra', '{}')")
+        cursor.execute("INSERT INTO assessments (user_id, subject, topic_name, content) VALUES (1, 'Math', 'Algebra', '{\"new\": 1}')")
+    mysql_connection.commit()
+
+    assert migrations.migrate(mysql_connection) == migrations.LATEST_VERSION
+    assert migrations.migrate(mysql_connection) == migrations.LATEST_VERSION
+    with mysql_connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT path_id, topic_name, total_minutes, content FROM learning_activities
+            ORDER BY topic_name, path_id
+        ''')
+        rows = cursor.fetchall()
+        cursor.execute("SELECT content FROM assessments")
+        assessments = cursor.fetchall()
+        cursor.execute("SELECT total_minutes FROM user_study_totals WHERE user_id = 1")
+        total = cursor.fetchone()
+    assert [(row['path_id'], row['topic_name'], float(row['total_minutes'])) for row in rows] == [
+        (None, 'Algebra', 7.0), (1, 'Algebra', 17.5), (1, 'Geometry', 7.0)
+    ]
+    assert '"a": true' in rows[1]['content'] and '"b": true' in rows[1]['content']
+    assert '"c": true' in rows[0]['content']
+    assert [row['content'] for row in assessments] == ['{"new": 1}']
+    assert float(total['total_minutes']) == 31.5
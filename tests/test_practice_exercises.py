@@ -0,0 +1,151 @@
+import re
+import json
+import uuid
+import threading
+
+import pytest
+
+backend = pytest.importorskip("core.backend")
+MockAssessmentManager = backend.MockAssessmentManager
+
+
+class FakeAgent:
+    """Answers each chunk prompt with respond(batch, size, focus, avoid) -> questions, or raises"""
+    def __init__(self, respond):
+        self.respond = respond
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def _call_api(self, messages, response_format=None, feature=None, **kwargs):
+        prompt = messages[-1]["content"]
+        size = int(re.search(r"The number of questions: (\d+)", prompt).group(1))
+        focus = re.search(r"Focus: (.*)", prompt).group(1).strip()
+        batch = int(re.search(r"This is batch (\d+) of", prompt).group(1))
+        avoid = [line.strip()[2:] for line in prompt.split("already contains:")[1].split("Requirement")[0].splitlines()
+                 if line.strip().startswith("- ") and line.strip() != "- None"]
+        with self._lock:
+            self.calls.append({"size": size, "focus": focus, "batch": batch, "avoid": avoid, "feature": feature})
+        questions = self.respond(batch, size, focus, avoid)
+        return json.dumps({"exercises": [
+            {
+                "question": question, "type": "Single-choice question", "options": ["A", "B", "C", "D"],
+                "correct_option": 0, "explanation": "", "difficulty": "Beginner", "estimated_time_minutes": 10
+            }
+            for question in questions
+        ]})
+
+
+def _unique(batch, size, focus, avoid):
+    return [f"batch{batch} {uuid.uuid4().hex} {uuid.uuid4().hex}" for _ in range(size)]
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(MockAssessmentManager, "EXERCISE_CHUNK_SIZE", 3)
+    monkeypatch.setattr(MockAssessmentManager, "EXERCISE_CHUNK_RETRIES", 1)
+    return MockAssessmentManager()
+
+
+@pytest.mark.parametrize("count,sizes", [
+    (1, [1]), (3, [3]), (4, [2, 2]), (7, [3, 2, 2]), (10, [3, 3, 2, 2]), (12, [3, 3, 3, 3]),
+])
+def test_chunk_sizes(manager, count, sizes):
+    assert manager._chunk_sizes(count) == sizes
+
+
+def test_chunks_run_with_distinct_focuses_and_merge_in_order(manager):
+    agent = FakeAgent(_unique)
+    result = manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=10)
+    assert sorted(call["size"] for call in agent.calls) == [2, 2, 3, 3]
+    assert len({call["focus"] for call in agent.calls}) == 4
+    assert [exercise["question"].split()[0] for exercise in result["exercises"]] == [
+        f"batch{batch}" for batch in (1, 1, 1, 2, 2, 2, 3, 3, 4, 4)
+    ]
+    assert {call["feature"] for call in agent.calls} == {"practice_exercises"}
+
+
+def test_feature_is_passed_to_every_chunk(manager):
+    agent = FakeAgent(_unique)
+    manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=5,
+                                        feature="practice_exercises_refill")
+    assert {call["feature"] for call in agent.calls} == {"practice_exercises_refill"}
+
+
+@pytest.mark.parametrize("similar,dropped", [
+    ("alpha beta gamma delta epsilon", True),  # 4 shared of 5 words: similarity 0.8
+    ("alpha beta gamma delta epsilon zeta", False),  # 4 of 6: 0.67
+    ("alpha beta gamma", False),  # 3 of 4: 0.75
+    ("Alpha, BETA gamma delta?", True),  # Case and punctuation are ignored: 1.0
+])
+def test_near_duplicates_dropped_at_threshold(manager, similar, dropped):
+    assert MockAssessmentManager.DUPLICATE_SIMILARITY == 0.8
+
+    def respond(batch, size, focus, avoid):
+        if batch == 1 and not avoid:
+            return ["alpha beta gamma delta", similar, "one two three"]
+        return [f"replacement {index}" for index in range(size)]
+
+    agent = FakeAgent(respond)
+    result = manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=3)
+    questions = [exercise["question"] for exercise in result["exercises"]]
+    if dropped:
+        assert questions == ["alpha beta gamma delta", "one two three", "replacement 0"]
+        # Only the shortfall is requested again, avoiding the accepted questions
+        assert [call["size"] for call in agent.calls] == [3, 1]
+        assert agent.calls[1]["avoid"] == ["alpha beta gamma delta", "one two three"]
+    else:
+        assert questions == ["alpha beta gamma delta", similar, "one two three"]
+        assert len(agent.calls) == 1
+
+
+def test_only_the_failed_chunk_is_retried(manager):
+    focuses = MockAssessmentManager.EXERCISE_FOCUSES
+    failed = []
+
+    def respond(batch, size, focus, avoid):
+        if focus == focuses[1] and not failed:
+            failed.append(focus)
+            raise ConnectionError("reset by peer")
+        return _unique(batch, size, focus, avoid)
+
+    agent = FakeAgent(respond)
+    result = manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=6)
+    assert len(result["exercises"]) == 6
+    assert "message" not in result
+    assert sorted((call["focus"], call["size"]) for call in agent.calls) == sorted(
+        [(focuses[0], 3), (focuses[1], 3), (focuses[2], 3)]
+    )
+    # The retry takes the next focus and avoids the questions already accepted
+    retry = agent.calls[-1]
+    assert retry["focus"] == focuses[2] and len(retry["avoid"]) == 3
+
+
+def test_short_chunk_is_topped_up(manager):
+    focuses = MockAssessmentManager.EXERCISE_FOCUSES
+
+    def respond(batch, size, focus, avoid):
+        return _unique(batch, 1 if focus == focuses[0] else size, focus, avoid)
+
+    agent = FakeAgent(respond)
+    result = manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=3)
+    assert len(result["exercises"]) == 3
+    assert [(call["focus"], call["size"]) for call in agent.calls] == [(focuses[0], 3), (focuses[1], 2)]
+
+
+def test_retries_are_bounded(manager):
+    agent = FakeAgent(lambda batch, size, focus, avoid: _unique(batch, 1, focus, avoid))
+    result = manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=3)
+    # One round plus EXERCISE_CHUNK_RETRIES rounds, each one question short
+    assert len(agent.calls) == 2
+    assert len(result["exercises"]) == 2
+
+
+def test_every_chunk_failing_falls_back_to_defaults(manager):
+    def respond(batch, size, focus, avoid):
+        raise ValueError("no JSON")
+
+    agent = FakeAgent(respond)
+    result = manager.generate_practice_exercises("Math", "Algebra", "Beginner", agent, num_exercises=4)
+    assert result["status"] == "success"
+    assert "default" in result["message"]
+    assert len(agent.calls) == 4  # Two chunks, each tried twice
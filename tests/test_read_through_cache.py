@@ -0,0 +1,93 @@
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("dbutils")
+
+from core.data_manager import ReadThroughCache
+
+
+class Source:
+    """A value and its version token, counting loads and probes"""
+    def __init__(self, value, token=1):
+        self.value = value
+        self.token = token
+        self.loads = 0
+        self.probes = 0
+
+    def load(self):
+        self.loads += 1
+        return self.value
+
+    def probe(self):
+        self.probes += 1
+        return self.token
+
+
+def test_fresh_entries_skip_the_database():
+    cache = ReadThroughCache("t", ttl=60)
+    source = Source(["a"])
+    assert cache.get(1, source.load, source.probe) == ["a"]
+    assert cache.get(1, source.load, source.probe) == ["a"]
+    assert (source.loads, source.probes) == (1, 1)
+
+
+def test_expire_revalidates_without_reloading():
+    cache = ReadThroughCache("t", ttl=60)
+    source = Source(["a"])
+    cache.get(1, source.load, source.probe)
+    cache.expire(1)
+    assert cache.get(1, source.load, source.probe) == ["a"]
+    assert (source.loads, source.probes) == (1, 2)
+    source.value, source.token = ["a", "b"], 2
+    cache.expire(1)
+    assert cache.get(1, source.load, source.probe) == ["a", "b"]
+    assert source.loads == 2
+
+
+def test_generations_are_bounded():
+    cache = ReadThroughCache("t", maxsize=4, ttl=60)
+    for key in range(100):
+        cache.invalidate(key)
+    assert len(cache._generations) == 4
+
+
+def test_load_racing_an_invalidation_is_not_stored_after_eviction():
+    cache = ReadThroughCache("t", maxsize=2, ttl=60)
+    stale = Source(["stale"])
+
+    def load_racing_writes():
+        # The key is invalidated during the load, then its generation is evicted by other keys
+        cache.invalidate("user")
+        for key in range(5):
+            cache.invalidate(key)
+        return stale.load()
+
+    assert cache.get("user", load_racing_writes, stale.probe) == ["stale"]
+    fresh = Source(["fresh"])
+    assert cache.get("user", fresh.load, fresh.probe) == ["fresh"]
+
+
+@pytest.mark.parametrize("path_id,found,revalidated", [
+    (5, True, 0),
+    (3, False, 0),  # Deleted, or another user's: the cached list is kept
+    (9, False, 1),  # Newer than every cached path: maybe created by another worker
+])
+def test_get_learning_path_miss(monkeypatch, path_id, found, revalidated):
+    backend = pytest.importorskip("core.backend")
+
+    class FakeDataManager:
+        revalidations = 0
+
+        def get_learning_paths(self, user_id):
+            return [{'id': 7}, {'id': 5}]
+
+        def revalidate_learning_paths(self, user_id):
+            FakeDataManager.revalidations += 1
+
+        def invalidate_learning_paths(self, user_id=None):
+            raise AssertionError("a read must not invalidate the cache")
+
+    monkeypatch.setattr(backend, "DataManager", FakeDataManager)
+    engine = backend.MockLearningEngine()
+    assert (engine.get_learning_path(path_id, 1) is not None) == found
+    assert FakeDataManager.revalidations == revalidated
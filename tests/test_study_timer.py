@@ -0,0 +1,82 @@
+import pytest
+
+backend = pytest.importorskip("core.backend")
+
+
+class FakeDataManager:
+    """learning_paths holds (user_id, path_id); a row of any other path breaks the foreign key"""
+    def __init__(self, paths, down=False):
+        self.paths = set(paths)
+        self.down = down
+        self.minutes = {}
+        self.totals = {}
+        self.batches = []
+
+    def execute_atomic(self, statements):
+        (_, rows), (_, totals) = statements
+        self.batches.append(len(rows))
+        if self.down or any(path_id not in {p for _, p in self.paths} for _, path_id, _, _, _ in rows):
+            return False
+        for uid, path_id, topic, _, minutes in rows:
+            self.minutes[(uid, path_id, topic)] = round(self.minutes.get((uid, path_id, topic), 0) + minutes, 2)
+        for uid, minutes in totals:
+            self.totals[uid] = round(self.totals.get(uid, 0) + minutes, 2)
+        return [len(rows), len(totals)]
+
+    def execute_query(self, query, params=None, commit=True):
+        if self.down:
+            return False
+        return [{'id': path_id, 'user_id': uid} for uid, path_id in self.paths if path_id in params]
+
+
+@pytest.fixture
+def accumulator(monkeypatch):
+    timer = backend.StudyTimeAccumulator(flush_interval=3600, reconcile_interval=0)
+    monkeypatch.setattr(timer, "start", lambda: None)
+    return timer
+
+
+def test_deleted_path_does_not_block_the_batch(monkeypatch, accumulator):
+    db = FakeDataManager({(1, 10), (2, 20)})
+    monkeypatch.setattr(backend, "DataManager", lambda: db)
+    accumulator.add(1, 10, "Algebra", 0.17)
+    accumulator.add(1, 11, "Algebra", 0.17)  # Deleted in another tab
+    accumulator.add(2, 20, "Physics", 0.5)
+    assert accumulator.flush() == 2
+    assert db.minutes == {(1, 10, "Algebra"): 0.17, (2, 20, "Physics"): 0.5}
+    assert db.totals == {1: 0.17, 2: 0.5}
+    # The delta of the deleted path is dropped, not queued again
+    assert accumulator.pending_minutes(1) == 0
+    accumulator.add(2, 20, "Physics", 0.5)
+    assert accumulator.flush() == 1
+    assert db.batches[-1] == 1
+
+
+def test_failing_user_only_holds_back_itself(monkeypatch, accumulator):
+    db = FakeDataManager({(1, 10), (2, 20)})
+    monkeypatch.setattr(backend, "DataManager", lambda: db)
+    real_write = db.execute_atomic
+
+    def execute_atomic(statements):
+        if any(row[0] == 2 for row in statements[0][1]):
+            return False
+        return real_write(statements)
+
+    db.execute_atomic = execute_atomic
+    accumulator.add(1, 10, "Algebra", 0.25)
+    accumulator.add(2, 20, "Physics", 0.5)
+    assert accumulator.flush() == 1
+    assert db.totals == {1: 0.25}
+    assert accumulator.pending_minutes(2) == 0.5
+
+
+def test_unreachable_database_keeps_everything(monkeypatch, accumulator):
+    db = FakeDataManager({(1, 10)}, down=True)
+    monkeypatch.setattr(backend, "DataManager", lambda: db)
+    accumulator.add(1, 10, "Algebra", 0.25)
+    accumulator.add(1, 10, "Algebra", 0.25)
+    assert accumulator.flush() == 0
+    assert accumulator.pending_minutes(1) == 0.5
+    db.down = False
+    assert accumulator.flush() == 1
+    assert db.minutes == {(1, 10, "Algebra"): 0.5}